@@ -33,6 +33,12 @@ log_levels = {
     'critical': logging.CRITICAL,
 }
 
+def get_optional(get, section, option, default):
+    """Read an optional setting, default is returned if setting is missing from configuration file."""
+    if config.has_option(section, option):
+        return get(section, option)
+    return default
+
 def init(configuration_file):
     global db_host
     global db_port
@@ -40,6 +46,15 @@ def init(configuration_file):
     global db_user
     global db_pass
     global db_pool_size
+    global db_pool_max_overflow
+    global localization_cache_ttl
+    global login_language_cache_size
+    global login_language_cache_ttl
+    global deviceless_login_cache_size
+    global deviceless_login_cache_ttl
+    global device_directory
+    global device_directory_path
+    global device_directory_delta_log_size
     global max_devices_per_user
     global max_users_per_device
     global sqlalchemy_url
@@ -48,11 +63,33 @@ def init(configuration_file):
     global world_id
     global port
     global request_queue_limit
+    global request_high_priority_queue_limit
+    global request_high_priority_weight
     global sender_batch_size
     global sender_queue_limit
+    global sender_high_priority_queue_limit
+    global sender_high_priority_weight
     global enabled_senders
+    global post_processor_window_size
+    global post_processor_window_seconds
+    global post_processor_workers
+    global post_processor_worker_queue_size
+    global sender_lookahead
+    global sender_spool
+    global sender_spool_path
+    global sender_spool_size
     global dry_run
     global request_processor_num_threads
+    global cooldown_tracker
+    global cooldown_tracker_size
+    global cooldown_tracker_flush_interval
+    global admission_control
+    global request_queue_low_watermark
+    global request_queue_high_watermark
+    global sender_queue_low_watermark
+    global sender_queue_high_watermark
+    global post_processor_low_watermark
+    global post_processor_high_watermark
     global login_event_id
     global turn_off_notification_event_id
     global main_log_path
@@ -73,6 +110,12 @@ def init(configuration_file):
     global apn_sender_queue_handler_url
     global gcm_sender_queue_handler_url
     global notification_post_processor_queue_handler_url
+    global statistics_handler_url
+    global stream_proto_batches
+    global stream_sub_batch_size
+    global max_decoded_body_size
+    global retry_after_drain_target
+    global max_retry_after
 
     config = ConfigParser.ConfigParser()
     config.read(configuration_file)
@@ -96,11 +139,46 @@ def init(configuration_file):
 
     # processing
     request_queue_limit = config.getint(REQUEST_PROCESSOR_CONFIG_SECTION, 'queue_limit')
+    request_high_priority_queue_limit = get_optional(config.getint, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                                     'high_priority_queue_limit', 10000)
+    request_high_priority_weight = get_optional(config.getint, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                                'high_priority_weight', 4)
     sender_batch_size = config.getint(MESSENGER_CONFIG_SECTION, 'apns_batch_size')
     sender_queue_limit = config.getint(SENDER_CONFIG_SECTION, 'sender_queue_limit')
+    sender_high_priority_queue_limit = get_optional(config.getint, SENDER_CONFIG_SECTION,
+                                                    'sender_high_priority_queue_limit', 10000)
+    sender_high_priority_weight = get_optional(config.getint, SENDER_CONFIG_SECTION, 'sender_high_priority_weight', 4)
     enabled_senders = config.get(SENDER_CONFIG_SECTION, 'enabled_senders')
+    post_processor_window_size = get_optional(config.getint, SENDER_CONFIG_SECTION, 'post_processor_window_size', 1000)
+    post_processor_window_seconds = get_optional(config.getfloat, SENDER_CONFIG_SECTION,
+                                                 'post_processor_window_seconds', 0.5)
+    post_processor_workers = get_optional(config.getint, SENDER_CONFIG_SECTION, 'post_processor_workers', 1)
+    post_processor_worker_queue_size = get_optional(config.getint, SENDER_CONFIG_SECTION,
+                                                    'post_processor_worker_queue_size', 10)
+    sender_lookahead = get_optional(config.getint, SENDER_CONFIG_SECTION, 'sender_lookahead', 500)
+    sender_spool = get_optional(config.getboolean, SENDER_CONFIG_SECTION, 'sender_spool', False)
+    sender_spool_path = get_optional(config.get, SENDER_CONFIG_SECTION, 'sender_spool_path', '/tmp/pushkin_spool')
+    sender_spool_size = get_optional(config.getint, SENDER_CONFIG_SECTION, 'sender_spool_size', 256 * 1024 * 1024)
     dry_run = config.getboolean(MESSENGER_CONFIG_SECTION, 'dry_run')
     request_processor_num_threads = config.getint(REQUEST_PROCESSOR_CONFIG_SECTION, 'request_processor_num_threads')
+    cooldown_tracker = get_optional(config.getboolean, REQUEST_PROCESSOR_CONFIG_SECTION, 'cooldown_tracker', False)
+    cooldown_tracker_size = get_optional(config.getint, REQUEST_PROCESSOR_CONFIG_SECTION, 'cooldown_tracker_size',
+                                         1000000)
+    cooldown_tracker_flush_interval = get_optional(config.getfloat, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                                   'cooldown_tracker_flush_interval', 1.0)
+    admission_control = get_optional(config.getboolean, REQUEST_PROCESSOR_CONFIG_SECTION, 'admission_control', True)
+    request_queue_low_watermark = get_optional(config.getfloat, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                               'request_queue_low_watermark', 0.6)
+    request_queue_high_watermark = get_optional(config.getfloat, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                                'request_queue_high_watermark', 0.9)
+    sender_queue_low_watermark = get_optional(config.getfloat, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                              'sender_queue_low_watermark', 0.6)
+    sender_queue_high_watermark = get_optional(config.getfloat, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                               'sender_queue_high_watermark', 0.9)
+    post_processor_low_watermark = get_optional(config.getint, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                                'post_processor_low_watermark', 50000)
+    post_processor_high_watermark = get_optional(config.getint, REQUEST_PROCESSOR_CONFIG_SECTION,
+                                                 'post_processor_high_watermark', 100000)
 
     # events
     login_event_id = config.getint(EVENT_CONFIG_SECTION, 'login_event_id')
@@ -113,6 +191,18 @@ def init(configuration_file):
     db_user = config.get(DATABASE_CONFIG_SECTION, 'db_user')
     db_pass = config.get(DATABASE_CONFIG_SECTION, 'db_pass')
     db_pool_size = int(config.get(DATABASE_CONFIG_SECTION, 'db_pool_size'))
+    db_pool_max_overflow = get_optional(config.getint, DATABASE_CONFIG_SECTION, 'db_pool_max_overflow', 10)
+    localization_cache_ttl = get_optional(config.getint, DATABASE_CONFIG_SECTION, 'localization_cache_ttl', 60)
+    login_language_cache_size = get_optional(config.getint, DATABASE_CONFIG_SECTION, 'login_language_cache_size', 100000)
+    login_language_cache_ttl = get_optional(config.getint, DATABASE_CONFIG_SECTION, 'login_language_cache_ttl', 300)
+    deviceless_login_cache_size = get_optional(config.getint, DATABASE_CONFIG_SECTION, 'deviceless_login_cache_size',
+                                               100000)
+    deviceless_login_cache_ttl = get_optional(config.getint, DATABASE_CONFIG_SECTION, 'deviceless_login_cache_ttl', 60)
+    device_directory = get_optional(config.getboolean, DATABASE_CONFIG_SECTION, 'device_directory', False)
+    device_directory_path = get_optional(config.get, DATABASE_CONFIG_SECTION, 'device_directory_path',
+                                         '/tmp/pushkin_device_directory')
+    device_directory_delta_log_size = get_optional(config.getint, DATABASE_CONFIG_SECTION,
+                                                   'device_directory_delta_log_size', 64 * 1024 * 1024)
     max_devices_per_user = int(config.get(DATABASE_CONFIG_SECTION, 'max_devices_per_user'))
     max_users_per_device = int(config.get(DATABASE_CONFIG_SECTION, 'max_users_per_device'))
     if db_host.startswith('/'):
@@ -132,3 +222,11 @@ def init(configuration_file):
     gcm_sender_queue_handler_url = config.get(REQUEST_HANDLER_SECTION, 'gcm_sender_queue_handler_url')
     notification_post_processor_queue_handler_url = config.get(REQUEST_HANDLER_SECTION,
                                                                'notification_post_processor_queue_handler_url')
+    statistics_handler_url = get_optional(config.get, REQUEST_HANDLER_SECTION, 'statistics_handler_url',
+                                          '/get_statistics')
+    stream_proto_batches = get_optional(config.getboolean, REQUEST_HANDLER_SECTION, 'stream_proto_batches', True)
+    stream_sub_batch_size = get_optional(config.getint, REQUEST_HANDLER_SECTION, 'stream_sub_batch_size', 1000)
+    max_decoded_body_size = get_optional(config.getint, REQUEST_HANDLER_SECTION, 'max_decoded_body_size',
+                                         100 * 1024 * 1024)
+    retry_after_drain_target = get_optional(config.getfloat, REQUEST_HANDLER_SECTION, 'retry_after_drain_target', 0.5)
+    max_retry_after = get_optional(config.getint, REQUEST_HANDLER_SECTION, 'max_retry_after', 60)
@@ -20,6 +20,8 @@ PERSIST_LOGGER_PREFFIX = 'persist_'
 main_logger = None
 notification_logger = None
 message_blacklist = None
+cooldown_tracker = None
+admission_controller = None
 
 """This module is used as a holder for global state in server process"""
 
@@ -60,4 +62,6 @@ def setup_configuration(configuration_filename):
 
 def start_processors():
     """Starts threads/processes needed for server request processing"""
+    if cooldown_tracker is not None:
+        cooldown_tracker.start()
     request_processor.start()
@@ -10,16 +10,17 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 '''
 import time
 import os
+import multiprocessing
 
 from pushkin.sender.nordifier import constants
 from pushkin import config, context
 from collections import defaultdict
 
 from pushkin.database import model
-from sqlalchemy.orm import sessionmaker, contains_eager
-from sqlalchemy import create_engine, func, text, update, bindparam, and_, pool
+from pushkin.database.device_directory import DeviceDirectory
+from sqlalchemy.orm import sessionmaker, contains_eager, joinedload
+from sqlalchemy import create_engine, event, func, text, pool
 
-import psycopg2 as dbapi2
 import psycopg2.extras
 
 from alembic.config import Config as AlembicConfig
@@ -27,20 +28,98 @@ from alembic import command as alembic_command
 from alembic.script import ScriptDirectory as AlembicScriptDirectory
 from alembic.migration import MigrationContext as AlembicMigrationContext
 from pushkin.sender.nordifier.gcm_push_sender import GCM2
+from pushkin.util.statistics import SharedStatistics
+from pushkin.util.cache import TTLCache, MISSING
 from contextlib import contextmanager
 
 
 """Module containing database wrapper calls."""
 
 ENGINE = None
+ENGINE_PID = None
 SESSION = None
 ALEMBIC_CONFIG = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'alembic.ini')
+POOL_STATISTICS = SharedStatistics('database_pool', ['pool_size', 'checked_out', 'overflow', 'connects', 'checkouts',
+                                                     'wait_time_ms'])
+
+DEFAULT_LANGUAGE_ID = 1
+LOCALIZATIONS = None
+MESSAGES = None
+LOCALIZATIONS_LOADED_AT = None
+LOCALIZATIONS_GENERATION = None
+LOGIN_LANGUAGE_CACHE = None
+# bumped when messages or localizations change, every process reloads its localizations on next use
+LOCALIZATION_GENERATION = multiprocessing.Value('l', 0)
+LOCALIZATION_STATISTICS = SharedStatistics('localization_cache', ['hits', 'misses', 'login_language_hits',
+                                                                  'login_language_misses'])
+
+DEVICELESS_LOGIN_CACHE = None
+DEVICE_REGISTRATION_BUCKETS = 4096
+# bumped after devices of a login are registered, a login cached as device-less is valid only while its stamp is unchanged
+DEVICE_REGISTRATION_STAMPS = multiprocessing.Array('l', DEVICE_REGISTRATION_BUCKETS)
+DEVICELESS_LOGIN_STATISTICS = SharedStatistics('deviceless_login_cache', ['hits', 'misses'])
+
+DEVICE_DIRECTORY = None
+
+
+class StatisticsQueuePool(pool.QueuePool):
+    """QueuePool which collects statistics about its usage into POOL_STATISTICS."""
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return pool.QueuePool._do_get(self)
+        finally:
+            POOL_STATISTICS.increment('wait_time_ms', (time.time() - start) * 1000)
+            POOL_STATISTICS.increment('checkouts')
+            self.update_statistics()
+
+    def _do_return_conn(self, conn):
+        pool.QueuePool._do_return_conn(self, conn)
+        self.update_statistics()
+
+    def update_statistics(self):
+        POOL_STATISTICS.set_gauge('checked_out', self.checkedout())
+        POOL_STATISTICS.set_gauge('overflow', max(0, self.overflow()))
+
+
+def on_pool_connect(*args):
+    POOL_STATISTICS.increment('connects')
+
 
 def init_db():
+    """
+    Create engine for this process.
+
+    Connection pool is sized from db_pool_size and is per process. When called in a forked worker process, engine
+    inherited from parent process is replaced with a new one, so connections are never shared between processes.
+    """
     global ENGINE
+    global ENGINE_PID
     global SESSION
-    if ENGINE is None:
-        ENGINE = create_engine(config.sqlalchemy_url, poolclass=pool.NullPool)
+    global LOGIN_LANGUAGE_CACHE
+    global DEVICELESS_LOGIN_CACHE
+    if LOGIN_LANGUAGE_CACHE is None:
+        LOGIN_LANGUAGE_CACHE = TTLCache(config.login_language_cache_size, config.login_language_cache_ttl)
+    if DEVICELESS_LOGIN_CACHE is None:
+        DEVICELESS_LOGIN_CACHE = TTLCache(config.deviceless_login_cache_size, config.deviceless_login_cache_ttl)
+    if ENGINE is None or ENGINE_PID != os.getpid():
+        ENGINE = create_engine(config.sqlalchemy_url, poolclass=StatisticsQueuePool, pool_size=config.db_pool_size,
+                               max_overflow=config.db_pool_max_overflow)
+        ENGINE_PID = os.getpid()
+        SESSION = None
+        event.listen(ENGINE, 'connect', on_pool_connect)
+        POOL_STATISTICS.set_gauge('pool_size', config.db_pool_size)
+
+def dispose_db():
+    """
+    Close all pooled connections of this process.
+
+    Should be called before forking worker processes, so they don't inherit open connections.
+    """
+    if ENGINE is not None:
+        ENGINE.dispose()
+        ENGINE.pool.update_statistics()
 
 def create_database():
     """Create database by executing db_create.sql"""
@@ -49,6 +128,58 @@ def create_database():
         sql_create_commands = fd.read()
         ENGINE.execute(sql_create_commands)
         ENGINE.execute(text("INSERT INTO alembic_version VALUES (:version_num)"), {"version_num": get_head_revision()})
+    clear_caches()
+
+def clear_caches():
+    """Drop cached login languages and device-less logins of this process and make all processes reload localizations."""
+    if LOGIN_LANGUAGE_CACHE is not None:
+        LOGIN_LANGUAGE_CACHE.clear()
+    if DEVICELESS_LOGIN_CACHE is not None:
+        DEVICELESS_LOGIN_CACHE.clear()
+    invalidate_localizations()
+    if DEVICE_DIRECTORY is not None:
+        rebuild_device_directory()
+
+def init_device_directory():
+    """
+    Build the device directory shared by worker processes, if it is enabled in configuration.
+
+    Must be called before worker processes are forked. Devices changed by other Pushkin instances are not seen by the
+    directory, so it should be enabled only when a single instance uses the database.
+    """
+    global DEVICE_DIRECTORY
+    if config.device_directory and DEVICE_DIRECTORY is None:
+        DEVICE_DIRECTORY = DeviceDirectory(config.device_directory_path, config.device_directory_delta_log_size)
+        rebuild_device_directory()
+
+def rebuild_device_directory():
+    """Build a new device directory snapshot from device table, lookups are not blocked while it is read."""
+    with DEVICE_DIRECTORY.rebuild_lock:
+        # deltas published from now on may be newer than rows of the query
+        version = DEVICE_DIRECTORY.next_version()
+        with raw_connection_scope() as conn:
+            with conn.cursor('device_directory') as cur:
+                cur.itersize = 10000
+                cur.execute("SELECT login_id, platform_id, COALESCE(device_token_new, device_token) FROM device "
+                            "WHERE unregistered_ts IS NULL ORDER BY login_id")
+                DEVICE_DIRECTORY.build(cur, version)
+
+def publish_devices(login_ids):
+    """
+    Replace devices of given logins in the device directory with their current state in database.
+
+    Must be called after changes are committed. Devices are read without holding any directory lock, a version taken
+    before they are read orders their delta against deltas published concurrently. Lookups only wait for the append.
+    """
+    login_ids = set(int(login_id) for login_id in login_ids)
+    if DEVICE_DIRECTORY is None or len(login_ids) == 0:
+        return
+    version = DEVICE_DIRECTORY.next_version()
+    devices_by_login = query_device_tokens(login_ids)
+    appended = DEVICE_DIRECTORY.append({login_id: devices_by_login.get(login_id, []) for login_id in login_ids},
+                                       version)
+    if not appended:
+        rebuild_device_directory()
 
 def upgrade_database():
     alembic_cfg = AlembicConfig(ALEMBIC_CONFIG)
@@ -65,12 +196,24 @@ def get_current_revision():
     current_revision = alembic_context.get_current_revision()
     return current_revision
 
+@contextmanager
+def raw_connection_scope():
+    """Provide a pooled DBAPI connection, transaction is committed if no exception occurs."""
+    connection = ENGINE.raw_connection()
+    try:
+        yield connection
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
 def execute_query(query):
     '''
     Execute a specific query.
     '''
-    with dbapi2.connect('host={db_host} user={db_user} password={db_pass} port={db_port} dbname={db_name}'.format(
-            db_host=config.db_host, db_port=config.db_port, db_user=config.db_user, db_pass=config.db_pass, db_name=config.db_name)) as conn:
+    with raw_connection_scope() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
             cur.execute(query)
 
@@ -78,8 +221,7 @@ def execute_query_with_results(query):
     '''
     Execute a specific query and return results.
     '''
-    with dbapi2.connect('host={db_host} user={db_user} password={db_pass} port={db_port} dbname={db_name}'.format(
-            db_host=config.db_host, db_port=config.db_port, db_user=config.db_user, db_pass=config.db_pass, db_name=config.db_name)) as conn:
+    with raw_connection_scope() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
             cur.execute(query)
             rows = cur.fetchall()
@@ -101,20 +243,14 @@ def session_scope():
     finally:
         session.close()
 
-def get_device_tokens(login_id):
+def unique_provider_devices(devices):
     '''
-    Get device tokens for a given login. Removes duplicates per provider.
+    Removes duplicate device tokens per provider.
     '''
-    with session_scope() as session:
-        result = session.query(model.Device.platform_id,
-                    func.coalesce(model.Device.device_token_new, model.Device.device_token).label('device_token')).\
-                    filter(model.Device.login_id == login_id).filter(model.Device.unregistered_ts.is_(None)).all()
-
-
     # only return unique device tokens per provider (gcm, apn) to avoid sending duplicates
-    devices = set()
+    unique_devices = set()
     provider_tokens = set()
-    for device in sorted(result): # sorting to make unit tests easier
+    for device in sorted(devices): # sorting to make unit tests easier
         platform_id, device_token = device
         provider_id = (constants.PLATFORM_BY_PROVIDER.get(platform_id, 0)
                        or platform_id)
@@ -123,15 +259,99 @@ def get_device_tokens(login_id):
         #       it is hard to verify providers for custom senders
         provider_token = (provider_id, device_token)
         if provider_token not in provider_tokens:
-            devices.add(device)
+            unique_devices.add(device)
             provider_tokens.add(provider_token)
-    return list(devices)
+    return sorted(unique_devices)
+
+def get_device_registration_stamp(login_id):
+    return DEVICE_REGISTRATION_STAMPS[int(login_id) % DEVICE_REGISTRATION_BUCKETS]
+
+def devices_registered(login_ids):
+    '''
+    Drop cached device-less state of given logins in all processes.
+
+    Must be called after the transaction which registered devices is committed, so a process which read the stamp
+    before its device query either sees the new device or sees the changed stamp.
+    '''
+    buckets = set(int(login_id) % DEVICE_REGISTRATION_BUCKETS for login_id in login_ids)
+    with DEVICE_REGISTRATION_STAMPS.get_lock():
+        for bucket in buckets:
+            DEVICE_REGISTRATION_STAMPS[bucket] += 1
+
+def is_cached_deviceless(login_id):
+    stamp = DEVICELESS_LOGIN_CACHE.get(int(login_id))
+    return stamp is not MISSING and stamp == get_device_registration_stamp(login_id)
+
+def query_device_tokens(login_ids):
+    '''
+    Query active devices of many logins, returns a dictionary {login_id: [(platform_id, device_token)]}.
+    '''
+    with session_scope() as session:
+        result = session.query(model.Device.login_id, model.Device.platform_id,
+                    func.coalesce(model.Device.device_token_new, model.Device.device_token).label('device_token')).\
+                    filter(model.Device.login_id == func.any(list(login_ids))).\
+                    filter(model.Device.unregistered_ts.is_(None)).all()
+
+    devices_by_login = defaultdict(list)
+    for login_id, platform_id, device_token in result:
+        devices_by_login[login_id].append((platform_id, device_token))
+    return devices_by_login
+
+def get_device_tokens(login_id):
+    '''
+    Get device tokens for a given login. Removes duplicates per provider.
+
+    Devices are looked up in the device directory if it is enabled. Otherwise logins without devices are cached per
+    process for deviceless_login_cache_ttl seconds, until a device is registered.
+    '''
+    if DEVICE_DIRECTORY is not None:
+        return unique_provider_devices(DEVICE_DIRECTORY.get(int(login_id)))
+    if is_cached_deviceless(login_id):
+        DEVICELESS_LOGIN_STATISTICS.increment('hits')
+        return []
+    DEVICELESS_LOGIN_STATISTICS.increment('misses')
+    stamp = get_device_registration_stamp(login_id)
+    with session_scope() as session:
+        result = session.query(model.Device.platform_id,
+                    func.coalesce(model.Device.device_token_new, model.Device.device_token).label('device_token')).\
+                    filter(model.Device.login_id == login_id).filter(model.Device.unregistered_ts.is_(None)).all()
+
+    devices = unique_provider_devices((platform_id, device_token) for platform_id, device_token in result)
+    if len(devices) == 0:
+        DEVICELESS_LOGIN_CACHE.put(int(login_id), stamp)
+    return devices
+
+def get_device_tokens_batch(login_ids):
+    '''
+    Get device tokens for many logins with a single query. Removes duplicates per provider.
+
+    Returns a dictionary {login_id: [(platform_id, device_token)]}, logins without devices are not in it.
+    '''
+    unique_login_ids = set(login_ids)
+    if DEVICE_DIRECTORY is not None:
+        devices_by_login = {login_id: DEVICE_DIRECTORY.get(int(login_id)) for login_id in unique_login_ids}
+        return {login_id: unique_provider_devices(devices) for login_id, devices in devices_by_login.iteritems()
+                if len(devices) > 0}
+    login_ids = [login_id for login_id in unique_login_ids if not is_cached_deviceless(login_id)]
+    DEVICELESS_LOGIN_STATISTICS.increment('hits', len(unique_login_ids) - len(login_ids))
+    DEVICELESS_LOGIN_STATISTICS.increment('misses', len(login_ids))
+    if len(login_ids) == 0:
+        return {}
+    stamps = {login_id: get_device_registration_stamp(login_id) for login_id in login_ids}
+    devices_by_login = query_device_tokens(login_ids)
+    for login_id, stamp in stamps.iteritems():
+        if login_id not in devices_by_login:
+            DEVICELESS_LOGIN_CACHE.put(int(login_id), stamp)
+    return {login_id: unique_provider_devices(devices) for login_id, devices in devices_by_login.iteritems()}
 
 
 def get_raw_messages(login_id, title, content, screen, game, world_id, dry_run, message_id=0, event_ts_bigint=None,
-                     expiry_millis=None, priority=GCM2.PRIORITY_NORMAL, filter_platform_id=None, filter_device_token=None):
+                     expiry_millis=None, priority=GCM2.PRIORITY_NORMAL, filter_platform_id=None, filter_device_token=None,
+                     devices=None):
     '''
     Get message dictionaries for a login id and message params.
+
+    Devices of a login are loaded from database unless they are given in devices, e.g. from get_device_tokens_batch.
     '''
     if expiry_millis is not None and event_ts_bigint is not None:
         time_to_live_ts_bigint = event_ts_bigint + expiry_millis
@@ -156,7 +376,7 @@ def get_raw_messages(login_id, title, content, screen, game, world_id, dry_run,
     }
     if filter_platform_id is not None and filter_device_token is not None:
         devices = [(filter_platform_id, filter_device_token)]
-    else:
+    elif devices is None:
         devices = get_device_tokens(login_id)
     if len(devices) > 0:
         for platform_id, device_token in devices:
@@ -172,31 +392,40 @@ def get_raw_messages(login_id, title, content, screen, game, world_id, dry_run,
 def update_canonicals(canonicals):
     '''
     Update canonical data for android devices.
-    '''
-    global ENGINE
-    binding = [{"p_{}".format(k): v for k, v in canonical.items()} for canonical in canonicals]
-    device_table = model.metadata.tables['device']
-    stmt = update(device_table).\
-        values(device_token_new=bindparam('p_new_token')).\
-        where(and_(device_table.c.login_id == bindparam('p_login_id'),
-                   func.coalesce(device_table.c.device_token_new, device_table.c.device_token) == bindparam('p_old_token')))
-    ENGINE.execute(stmt, binding)
 
+    Runs a constant number of statements per batch. When the same device of a login appears more than once, the last
+    canonical wins.
+    '''
+    if len(canonicals) == 0:
+        return
+    canonical_by_device = {(int(canonical['login_id']), canonical['old_token']): canonical['new_token']
+                           for canonical in canonicals}
+    new_tokens = list(set(canonical_by_device.values()))
+    android_platforms = [constants.PLATFORM_ANDROID, constants.PLATFORM_ANDROID_TABLET]
     with session_scope() as session:
-        query = text('SELECT keep_max_users_per_device( \
-                     (:platform_id)::int2, :device_token, (:max_users_per_device)::int2)')
-        for canonical in canonicals:
-            session.execute(query,
-                            {'platform_id': constants.PLATFORM_ANDROID,
-                             'device_token': canonical['new_token'],
-                             'max_users_per_device': config.max_users_per_device
-                            })
-            session.execute(query,
-                            {'platform_id': constants.PLATFORM_ANDROID_TABLET,
-                             'device_token': canonical['new_token'],
-                             'max_users_per_device': config.max_users_per_device
-                            })
+        session.execute(text('''
+            UPDATE device
+            SET device_token_new = d.new_token
+            FROM UNNEST((:login_ids)::int8[], (:old_tokens)::text[], (:new_tokens)::text[])
+                AS d(login_id, old_token, new_token)
+            WHERE device.login_id = d.login_id
+                AND COALESCE(device.device_token_new, device.device_token) = d.old_token'''),
+                        {
+                            'login_ids': [login_id for login_id, _ in canonical_by_device],
+                            'old_tokens': [old_token for _, old_token in canonical_by_device],
+                            'new_tokens': canonical_by_device.values()
+                        })
+        deleted_login_ids = session.execute(text('''
+            SELECT * FROM keep_max_users_per_devices((:platform_ids)::int2[], (:device_tokens)::text[],
+                                                     (:max_users_per_device)::int2)'''),
+                        {
+                            'platform_ids': [platform_id for platform_id in android_platforms for _ in new_tokens],
+                            'device_tokens': new_tokens * len(android_platforms),
+                            'max_users_per_device': config.max_users_per_device
+                        }).fetchall()
         session.commit()
+    publish_devices([login_id for login_id, _ in canonical_by_device] +
+                    [login_id for login_id, in deleted_login_ids])
 
 def update_unregistered_devices(unregistered):
     '''
@@ -204,33 +433,69 @@ def update_unregistered_devices(unregistered):
 
     Unregistered device will not receive notifications and will be deleted when number of devices exceeds maximum.
     '''
-    global ENGINE
-    binding = [{"p_{}".format(k): v for k, v in u.items()} for u in unregistered]
-    device_table = model.metadata.tables['device']
-    stmt = update(device_table).\
-        values(unregistered_ts=func.now()).\
-        where(and_(device_table.c.login_id == bindparam('p_login_id'),
-                   func.coalesce(device_table.c.device_token_new, device_table.c.device_token) == bindparam('p_device_token')))
-    ENGINE.execute(stmt, binding)
+    if len(unregistered) == 0:
+        return
+    devices = set((int(u['login_id']), u['device_token']) for u in unregistered)
+    with session_scope() as session:
+        session.execute(text('''
+            UPDATE device
+            SET unregistered_ts = now()
+            FROM UNNEST((:login_ids)::int8[], (:device_tokens)::text[]) AS d(login_id, device_token)
+            WHERE device.login_id = d.login_id
+                AND COALESCE(device.device_token_new, device.device_token) = d.device_token'''),
+                        {
+                            'login_ids': [login_id for login_id, _ in devices],
+                            'device_tokens': [device_token for _, device_token in devices]
+                        })
+        session.commit()
+    publish_devices([login_id for login_id, _ in devices])
 
 def process_user_login(login_id, language_id, platform_id, device_token, application_version):
     '''
     Add or update device and login data. Also deletes oldest device if number of devices exceeds maximum.
     '''
+    process_user_logins([{
+        'login_id': login_id,
+        'language_id': language_id,
+        'platform_id': platform_id,
+        'device_token': device_token,
+        'application_version': application_version
+    }])
+
+def process_user_logins(logins):
+    '''
+    Add or update device and login data for many logins in a single database call. Expects a list of dictionaries with
+    login_id, language_id, platform_id, device_token and application_version keys. When the same login appears more
+    than once, the last occurrence wins. Device limits are applied as in process_user_login.
+    '''
+    if len(logins) == 0:
+        return
+
+    def to_int(value):
+        return int(value) if value is not None else None
+
+    def to_str(value):
+        # unicode inside arrays is not encoded with connection encoding by psycopg2
+        return value.encode('utf-8') if isinstance(value, unicode) else value
+
     with session_scope() as session:
-        session.execute(text('SELECT process_user_login(:login_id, (:language_id)::int2, \
-                             (:platform_id)::int2,:device_token, :application_version, \
+        affected_login_ids = session.execute(text('SELECT process_user_logins((:login_ids)::int8[], (:language_ids)::int2[], \
+                             (:platform_ids)::int2[], (:device_tokens)::text[], (:application_versions)::int4[], \
                              (:max_devices_per_user)::int2, (:max_users_per_device)::int2)'),
                     {
-                    'login_id': login_id,
-                    'language_id': language_id,
-                    'platform_id': platform_id,
-                    'device_token': device_token,
-                    'application_version': application_version,
+                    'login_ids': [to_int(login['login_id']) for login in logins],
+                    'language_ids': [to_int(login.get('language_id')) for login in logins],
+                    'platform_ids': [to_int(login['platform_id']) for login in logins],
+                    'device_tokens': [to_str(login.get('device_token')) for login in logins],
+                    'application_versions': [to_int(login['application_version']) for login in logins],
                     'max_devices_per_user': config.max_devices_per_user,
                     'max_users_per_device': config.max_users_per_device
-                    })
+                    }).fetchall()
         session.commit()
+    for login in logins:
+        cache_login_language(to_int(login['login_id']), to_int(login.get('language_id')))
+    devices_registered([login['login_id'] for login in logins if login.get('device_token') is not None])
+    publish_devices(login_id for login_id, in affected_login_ids)
 
 def upsert_login(login_id, language_id):
     '''
@@ -245,6 +510,7 @@ def upsert_login(login_id, language_id):
             session.add(login)
         session.commit()
         session.refresh(login)
+    cache_login_language(login.id, login.language_id)
     return login
 
 def upsert_device(login_id, platform_id, device_token, application_version, unregistered_ts=None):
@@ -268,6 +534,8 @@ def upsert_device(login_id, platform_id, device_token, application_version, unre
         session.commit()
         session.refresh(device)
         session.refresh(device.login)
+    devices_registered([login_id])
+    publish_devices([login_id])
     return device
 
 def get_all_logins():
@@ -328,6 +596,9 @@ def delete_login(login):
             session.delete(device)
         session.delete(reloaded_login)
         session.commit()
+    if LOGIN_LANGUAGE_CACHE is not None:
+        LOGIN_LANGUAGE_CACHE.invalidate(login.id)
+    publish_devices([login.id])
 
 def delete_device(device):
     '''
@@ -337,6 +608,76 @@ def delete_device(device):
         reloaded_device = session.query(model.Device).filter(model.Device.id == device.id).one()
         session.delete(reloaded_device)
         session.commit()
+    publish_devices([device.login_id])
+
+def cache_login_language(login_id, language_id):
+    '''
+    Remember language of a login written by this process.
+    '''
+    if LOGIN_LANGUAGE_CACHE is not None:
+        LOGIN_LANGUAGE_CACHE.put(int(login_id), int(language_id) if language_id is not None else None)
+
+def get_login_language(login_id):
+    '''
+    Get language id of a specific user, None if user doesn't exist.
+
+    Languages are cached per process for login_language_cache_ttl seconds, logins which don't exist are not cached.
+    '''
+    login_id = int(login_id)
+    language_id = LOGIN_LANGUAGE_CACHE.get(login_id)
+    if language_id is not MISSING:
+        LOCALIZATION_STATISTICS.increment('login_language_hits')
+        return language_id
+    LOCALIZATION_STATISTICS.increment('login_language_misses')
+    with session_scope() as session:
+        row = session.query(model.Login.language_id).filter(model.Login.id == login_id).one_or_none()
+    if row is None:
+        return None
+    LOGIN_LANGUAGE_CACHE.put(login_id, row.language_id)
+    return row.language_id
+
+def invalidate_localizations():
+    '''
+    Make all processes reload messages and localizations on next use.
+    '''
+    with LOCALIZATION_GENERATION.get_lock():
+        LOCALIZATION_GENERATION.value += 1
+
+def get_cached_localizations():
+    '''
+    Get all message localizations with messages preloaded, in format {(message_id, language_id): localization}.
+
+    Localizations are loaded once per process and reloaded after localization_cache_ttl seconds or when messages are
+    changed through this module by any process of this server.
+    '''
+    global LOCALIZATIONS
+    global MESSAGES
+    global LOCALIZATIONS_LOADED_AT
+    global LOCALIZATIONS_GENERATION
+    generation = LOCALIZATION_GENERATION.value
+    if LOCALIZATIONS is not None and LOCALIZATIONS_GENERATION == generation and \
+            time.time() - LOCALIZATIONS_LOADED_AT < config.localization_cache_ttl:
+        LOCALIZATION_STATISTICS.increment('hits')
+        return LOCALIZATIONS
+    LOCALIZATION_STATISTICS.increment('misses')
+    with session_scope() as session:
+        localizations = session.query(model.MessageLocalization).\
+            options(joinedload(model.MessageLocalization.message)).\
+            all()
+        messages = session.query(model.Message).all()
+    LOCALIZATIONS = {(localization.message_id, localization.language_id): localization
+                     for localization in localizations}
+    MESSAGES = {message.id: message for message in messages}
+    LOCALIZATIONS_LOADED_AT = time.time()
+    LOCALIZATIONS_GENERATION = generation
+    return LOCALIZATIONS
+
+def get_cached_messages():
+    '''
+    Get all messages in format {message_id: message}, cached together with localizations.
+    '''
+    get_cached_localizations()
+    return MESSAGES
 
 def get_localized_message(login_id, message_id):
     '''
@@ -344,12 +685,13 @@ def get_localized_message(login_id, message_id):
 
     If translation for language of a user doesn't exist English translation is given.
     '''
-    with session_scope() as session:
-        localized_message = session.query(model.MessageLocalization).\
-        from_statement(text("select lm.*, m.* from get_localized_message(:login_id, :message_id) lm inner join message m on lm.message_id = m.id")).\
-        params(login_id=login_id, message_id=message_id).\
-        options(contains_eager(model.MessageLocalization.message)).\
-        one_or_none()
+    language_id = get_login_language(login_id)
+    if language_id is None:
+        return None
+    localizations = get_cached_localizations()
+    localized_message = localizations.get((message_id, language_id))
+    if localized_message is None:
+        localized_message = localizations.get((message_id, DEFAULT_LANGUAGE_ID))
     return localized_message
 
 def upsert_message(message_name, cooldown_ts, trigger_event_id, screen, expiry_millis, priority):
@@ -370,6 +712,7 @@ def upsert_message(message_name, cooldown_ts, trigger_event_id, screen, expiry_m
             session.add(message)
         session.commit()
         session.refresh(message)
+    invalidate_localizations()
     return message
 
 def upsert_message_localization(message_name, language_id, message_title, message_text):
@@ -392,6 +735,7 @@ def upsert_message_localization(message_name, language_id, message_title, messag
         session.commit()
         session.refresh(message_localization)
         session.refresh(message_localization.message)
+    invalidate_localizations()
     return message_localization
 
 def add_message(message_name, language_id, message_title, message_text, trigger_event_id=None, cooldown_ts=None,
@@ -439,6 +783,7 @@ def delete_message(message):
             session.delete(message_localization)
         session.delete(reloaded_message)
         session.commit()
+    invalidate_localizations()
 
 def delete_message_localization(message_localization):
     '''
@@ -448,6 +793,7 @@ def delete_message_localization(message_localization):
         reloaded_message_localization = session.query(model.MessageLocalization).filter(model.MessageLocalization.id == message_localization.id).one()
         session.delete(reloaded_message_localization)
         session.commit()
+    invalidate_localizations()
 
 def get_event_to_message_mapping():
     '''
@@ -463,33 +809,60 @@ def get_event_to_message_mapping():
 
 def get_and_update_messages_to_send(user_message_set):
     '''
-    Update last time a message id was send for a user.
+    Update last time a message id was send for a user. Returns a list of (login_id, message_id) tuples that are
+    eligible for sending according to message cooldown.
 
     Expects a set of (login_id, message_id) tuples.
     '''
-    # collect user messages in a dictionary for easier processing
-    user_dict = defaultdict(set)
-    for login_id, message_id in user_message_set:
-        user_dict[login_id].add(message_id)
+    if len(user_message_set) == 0:
+        return []
     with session_scope() as session:
-        joined_login_ids = ','.join([str(login_id) for login_id in user_dict.keys()])
-        array_login_ids = "'{{{}}}'".format(joined_login_ids)
-        query = "select * from get_non_elligible_user_message_pairs({})".format(array_login_ids)
-        non_eligible_messages = session.query(model.UserMessageLastTimeSent).\
-            from_statement(text(query)).all()
-        for non_eligible_message in non_eligible_messages:
-            user_dict[non_eligible_message.login_id].discard(non_eligible_message.message_id)
-
-        # update user_message_last_time_sent
-        return_tuple = []
-        for user, messages in user_dict.iteritems():
-            for message in messages:
-                return_tuple.append({str(user): str(message)})
-                session.execute(text(
-                    'SELECT upsert_user_message_last_time_sent((:login_id)::bigint, :message_id)'),
+        pairs = session.execute(text('SELECT login_id, message_id FROM get_and_update_messages_to_send( \
+                                     (:login_ids)::int8[], (:message_ids)::int4[])'),
                                 {
-                                    'login_id': user,
-                                    'message_id': message
-                                })
+                                    'login_ids': [int(login_id) for login_id, _ in user_message_set],
+                                    'message_ids': [int(message_id) for _, message_id in user_message_set]
+                                }).fetchall()
+        session.commit()
+    return [(int(login_id), int(message_id)) for login_id, message_id in pairs]
+
+def get_messages_in_cooldown():
+    '''
+    Get (login_id, message_id, last_time_sent_ts_bigint) tuples of messages which can't be sent again yet because of
+    message cooldown.
+    '''
+    with session_scope() as session:
+        result = session.query(model.UserMessageLastTimeSent.login_id, model.UserMessageLastTimeSent.message_id,
+                               model.UserMessageLastTimeSent.last_time_sent_ts_bigint).\
+            join(model.Message, model.Message.id == model.UserMessageLastTimeSent.message_id).\
+            filter(model.UserMessageLastTimeSent.last_time_sent_ts_bigint + model.Message.cooldown_ts >
+                   int(round(time.time() * 1000))).\
+            all()
+    return [(login_id, message_id, last_time_sent) for login_id, message_id, last_time_sent in result]
+
+def upsert_messages_last_time_sent(rows):
+    '''
+    Set last time a message was sent for a list of (login_id, message_id, last_time_sent_ts_bigint) tuples.
+
+    Later time already stored is kept. Rows of logins or messages which don't exist are skipped.
+    '''
+    if len(rows) == 0:
+        return
+    with session_scope() as session:
+        session.execute(text('''
+            INSERT INTO user_message_last_time_sent (login_id, message_id, last_time_sent_ts_bigint)
+            SELECT d.login_id, d.message_id, MAX(d.last_time_sent_ts_bigint)
+            FROM UNNEST((:login_ids)::int8[], (:message_ids)::int4[], (:last_time_sent)::int8[])
+                AS d(login_id, message_id, last_time_sent_ts_bigint)
+            INNER JOIN login l ON l.id = d.login_id
+            INNER JOIN message m ON m.id = d.message_id
+            GROUP BY d.login_id, d.message_id
+            ON CONFLICT ON CONSTRAINT c_user_unique_message
+            DO UPDATE SET last_time_sent_ts_bigint = GREATEST(user_message_last_time_sent.last_time_sent_ts_bigint,
+                                                              EXCLUDED.last_time_sent_ts_bigint)'''),
+                        {
+                            'login_ids': [int(login_id) for login_id, _, _ in rows],
+                            'message_ids': [int(message_id) for _, message_id, _ in rows],
+                            'last_time_sent': [int(last_time_sent) for _, _, last_time_sent in rows]
+                        })
         session.commit()
-    return return_tuple
@@ -222,6 +222,126 @@ VOLATILE
 CALLED ON NULL INPUT
 SECURITY INVOKER;
 
+DROP FUNCTION IF EXISTS "keep_max_users_per_devices" (int2[], text[], int2);
+CREATE OR REPLACE FUNCTION "keep_max_users_per_devices" (
+  p_platform_ids int2[],
+  p_device_tokens text[],
+  p_max_users_per_device int2
+)
+RETURNS SETOF int8 AS
+$body$
+BEGIN
+  RETURN QUERY
+  WITH
+	data AS (
+	SELECT DISTINCT d.platform_id, d.device_token
+	FROM UNNEST(p_platform_ids, p_device_tokens) AS d(platform_id, device_token)
+	WHERE d.device_token IS NOT NULL
+	),
+	users_ordered AS (
+	SELECT
+		device.id,
+		ROW_NUMBER() OVER (PARTITION BY device.platform_id, COALESCE(device.device_token_new, device.device_token)
+		  ORDER BY device.last_login_ts DESC NULLS LAST, device.id DESC) AS user_order
+	FROM device
+	INNER JOIN data d
+		ON device.platform_id = d.platform_id
+		AND COALESCE(device.device_token_new, device.device_token) = d.device_token
+	WHERE device.unregistered_ts IS NULL
+	),
+	users_to_delete AS (
+	SELECT *
+	FROM users_ordered
+	WHERE user_order > p_max_users_per_device
+	)
+	DELETE FROM device
+	WHERE id IN (SELECT id FROM users_to_delete)
+	RETURNING device.login_id;
+END;
+$body$
+LANGUAGE 'plpgsql'
+VOLATILE
+CALLED ON NULL INPUT
+SECURITY INVOKER;
+
+DROP FUNCTION IF EXISTS "process_user_logins" (int8[], int2[], int2[], text[], int4[], int2, int2);
+CREATE OR REPLACE FUNCTION "process_user_logins" (
+	p_login_ids int8[],
+	p_language_ids int2[],
+	p_platform_ids int2[],
+	p_device_tokens text[],
+	p_application_versions int4[],
+	p_max_devices_per_user int2,
+	p_max_users_per_device int2
+)
+RETURNS SETOF int8 AS
+$body$
+BEGIN
+	-- the last login of a user in the batch determines the language
+	INSERT INTO login (id, language_id)
+	SELECT DISTINCT ON (d.login_id) d.login_id, d.language_id
+	FROM UNNEST(p_login_ids, p_language_ids) WITH ORDINALITY AS d(login_id, language_id, ord)
+	ORDER BY d.login_id, d.ord DESC
+	ON CONFLICT (id) DO UPDATE SET language_id = EXCLUDED.language_id;
+
+	WITH
+	data AS (
+		SELECT DISTINCT ON (d.login_id, d.platform_id, d.device_token) d.*
+		FROM UNNEST(p_login_ids, p_platform_ids, p_device_tokens, p_application_versions) WITH ORDINALITY
+			AS d(login_id, platform_id, device_token, application_version, ord)
+		WHERE d.device_token IS NOT NULL
+		ORDER BY d.login_id, d.platform_id, d.device_token, d.ord DESC
+	),
+	update_part AS (
+		UPDATE device SET
+		application_version = d.application_version,
+		unregistered_ts = NULL,
+		-- logins later in the batch are later, as if they were processed one by one
+		last_login_ts = NOW() + d.ord * INTERVAL '1 microsecond'
+		FROM data d
+		WHERE (device.device_token = d.device_token OR device.device_token_new = d.device_token)
+			AND device.login_id = d.login_id
+			AND device.platform_id = d.platform_id
+	)
+	-- device table is seen as it was before the update, so devices matched by any token are not inserted again
+	INSERT INTO device(login_id, platform_id, device_token, application_version, last_login_ts)
+	SELECT d.login_id, d.platform_id, d.device_token, d.application_version, NOW() + d.ord * INTERVAL '1 microsecond'
+	FROM data d
+	WHERE NOT EXISTS (
+		SELECT 1
+		FROM device
+		WHERE (device.device_token = d.device_token OR device.device_token_new = d.device_token)
+			AND device.login_id = d.login_id
+			AND device.platform_id = d.platform_id)
+	ORDER BY d.ord;
+
+	WITH
+	devices_ordered AS (
+	SELECT
+		id,
+		ROW_NUMBER() OVER (PARTITION BY login_id ORDER BY unregistered_ts DESC NULLS FIRST, id DESC) AS device_order
+	FROM device
+	WHERE login_id = ANY(p_login_ids)
+	),
+	devices_to_delete AS (
+	SELECT *
+	FROM devices_ordered
+	WHERE device_order > p_max_devices_per_user
+	)
+	DELETE FROM device
+	WHERE id IN (SELECT id FROM devices_to_delete);
+
+	-- logins whose devices might have changed
+	RETURN QUERY SELECT DISTINCT d.login_id FROM UNNEST(p_login_ids) AS d(login_id);
+	RETURN QUERY SELECT * FROM keep_max_users_per_devices(p_platform_ids, p_device_tokens, p_max_users_per_device);
+
+END;
+$body$
+LANGUAGE 'plpgsql'
+VOLATILE
+CALLED ON NULL INPUT
+SECURITY INVOKER;
+
 DROP FUNCTION IF EXISTS "get_non_elligible_user_message_pairs" (bigint[]);
 CREATE OR REPLACE FUNCTION "get_non_elligible_user_message_pairs" (
 	p_users bigint[]
@@ -280,6 +400,51 @@ VOLATILE
 CALLED ON NULL INPUT
 SECURITY INVOKER;
 
+DROP FUNCTION IF EXISTS "get_and_update_messages_to_send" (int8[], int4[]);
+CREATE OR REPLACE FUNCTION "get_and_update_messages_to_send" (
+	p_login_ids int8[],
+	p_message_ids int4[]
+)
+RETURNS TABLE (login_id int8, message_id int4) AS
+$body$
+#variable_conflict use_column
+DECLARE
+	v_now int8 := extract(epoch from current_timestamp)::bigint*1000;
+BEGIN
+	RETURN QUERY
+	WITH
+	pairs AS (
+		SELECT DISTINCT p.login_id, p.message_id
+		FROM UNNEST(p_login_ids, p_message_ids) AS p(login_id, message_id)
+	),
+	eligible AS (
+		SELECT p.login_id, p.message_id
+		FROM pairs p
+		INNER JOIN login l
+			ON l.id = p.login_id
+		INNER JOIN message m
+			ON m.id = p.message_id
+		LEFT JOIN user_message_last_time_sent umlts
+			ON umlts.login_id = p.login_id AND umlts.message_id = p.message_id
+		WHERE
+			umlts.id IS NULL OR
+			m.cooldown_ts IS NULL OR
+			umlts.last_time_sent_ts_bigint + m.cooldown_ts <= v_now
+	)
+	INSERT INTO user_message_last_time_sent AS umlts (login_id, message_id, last_time_sent_ts_bigint)
+	SELECT e.login_id, e.message_id, v_now
+	FROM eligible e
+	ON CONFLICT ON CONSTRAINT c_user_unique_message
+	DO UPDATE SET last_time_sent_ts_bigint = EXCLUDED.last_time_sent_ts_bigint
+	RETURNING umlts.login_id, umlts.message_id;
+
+END;
+$body$
+LANGUAGE 'plpgsql'
+VOLATILE
+CALLED ON NULL INPUT
+SECURITY INVOKER;
+
 DROP FUNCTION IF EXISTS "get_localized_message" (int8, int4);
 CREATE OR REPLACE FUNCTION "get_localized_message" (
 	p_login_id int8,
@@ -0,0 +1,234 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import mmap
+import multiprocessing
+import os
+import struct
+from array import array
+
+from pushkin.util.statistics import SharedStatistics
+
+"""Device directory shared by all worker processes."""
+
+SNAPSHOT_MAGIC = 'PDD1'
+# magic, number of devices, size of all tokens
+SNAPSHOT_HEADER = struct.Struct('=4sqq')
+# items of snapshot arrays, native formats match typecodes of arrays used to write them
+LOGIN_ID_ITEM = struct.Struct('l')
+PLATFORM_ID_ITEM = struct.Struct('h')
+TOKEN_OFFSET_ITEM = struct.Struct('L')
+TOKEN_OFFSETS_ITEM = struct.Struct('2L')
+# version, login id, number of devices
+DELTA_HEADER = struct.Struct('=qqH')
+# platform id, token length
+DELTA_DEVICE = struct.Struct('=hH')
+
+STATISTICS = SharedStatistics('device_directory', ['lookups', 'deltas', 'rebuilds'])
+
+
+def encode_token(device_token):
+    if isinstance(device_token, unicode):
+        return device_token.encode('utf-8')
+    return device_token
+
+
+class DeviceDirectory():
+    """
+    Index of active devices, login_id -> [(platform_id, device_token)], shared by forked worker processes.
+
+    Consists of a snapshot of the device table, kept in a memory mapped file as arrays sorted by login_id, and a log of
+    deltas in anonymous shared memory. A delta replaces all devices of a login. Before a lookup each process applies
+    new deltas to its own overlay. When the log is full, snapshot should be rebuilt, which also empties the log.
+
+    Must be created before worker processes are forked. lock is held only while switching snapshots and appending
+    deltas, so lookups are not blocked by writers reading the database. Callers serialize rebuilds with rebuild_lock.
+
+    Writers read the database concurrently, so deltas may be appended out of order. A writer takes a version with
+    next_version() after its changes are committed and before it reads the rows it publishes. Rows read later reflect
+    at least the state of rows read earlier, so of deltas and snapshots of a login, the one with the highest version
+    wins, whatever order they were appended in.
+    """
+
+    def __init__(self, path, delta_log_size):
+        self.path = path
+        self.lock = multiprocessing.Lock()
+        self.rebuild_lock = multiprocessing.Lock()
+        self._delta_log = mmap.mmap(-1, delta_log_size)
+        self._delta_log_size = delta_log_size
+        self._delta_log_position = multiprocessing.Value('l', 0, lock=False)
+        self._generation = multiprocessing.Value('l', 0, lock=False)
+        self._version = multiprocessing.Value('l', 0, lock=False)
+        self._snapshot_version = multiprocessing.Value('l', 0, lock=False)
+
+        # state of this process
+        self._snapshot = None
+        self._snapshot_generation = 0
+        self._count = 0
+        self._platform_ids_offset = 0
+        self._token_offsets_offset = 0
+        self._tokens_offset = 0
+        self._overlay = {}
+        self._applied_position = 0
+
+    def _snapshot_path(self, generation):
+        return '{path}.{generation}'.format(path=self.path, generation=generation)
+
+    def next_version(self):
+        """Returns version of rows read from database from now on, higher than all versions returned before."""
+        with self.lock:
+            self._version.value += 1
+            return self._version.value
+
+    def build(self, rows, version=0):
+        """
+        Writes a new snapshot from (login_id, platform_id, device_token) rows sorted by login_id and switches to it.
+
+        Caller must hold rebuild_lock. Rows are written without holding lock. Deltas of a higher version than rows may
+        be newer than them, they are moved to the start of the log instead of being dropped.
+        """
+        login_ids = array('l')
+        platform_ids = array('h')
+        token_offsets = array('L', [0])
+        tokens = []
+        tokens_size = 0
+        for login_id, platform_id, device_token in rows:
+            device_token = encode_token(device_token)
+            login_ids.append(login_id)
+            platform_ids.append(platform_id)
+            tokens.append(device_token)
+            tokens_size += len(device_token)
+            token_offsets.append(tokens_size)
+
+        building_path = self.path + '.tmp'
+        with open(building_path, 'wb') as fd:
+            fd.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(login_ids), tokens_size))
+            login_ids.tofile(fd)
+            platform_ids.tofile(fd)
+            token_offsets.tofile(fd)
+            for device_token in tokens:
+                fd.write(device_token)
+
+        with self.lock:
+            generation = self._generation.value + 1
+            os.rename(building_path, self._snapshot_path(generation))
+            old_path = self._snapshot_path(self._generation.value)
+            kept = ''.join(self._delta_log[start:end] for start, end, delta_version, login_id, devices
+                           in self._deltas(0, self._delta_log_position.value) if delta_version > version)
+            self._delta_log[0:len(kept)] = kept
+            self._delta_log_position.value = len(kept)
+            self._generation.value = generation
+            self._snapshot_version.value = version
+        # processes which still map the old snapshot keep their mapping until they switch to the new one
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        STATISTICS.increment('rebuilds')
+
+    def append(self, devices_by_login, version):
+        """
+        Appends deltas {login_id: [(platform_id, device_token)]} of rows read after next_version() returned version.
+        Returns False if the log is full.
+        """
+        entries = []
+        for login_id, devices in devices_by_login.iteritems():
+            entries.append(DELTA_HEADER.pack(version, login_id, len(devices)))
+            for platform_id, device_token in devices:
+                device_token = encode_token(device_token)
+                entries.append(DELTA_DEVICE.pack(platform_id, len(device_token)))
+                entries.append(device_token)
+        data = ''.join(entries)
+        with self.lock:
+            if version <= self._snapshot_version.value:
+                # rows were read before those of current snapshot
+                return True
+            position = self._delta_log_position.value
+            if position + len(data) > self._delta_log_size:
+                return False
+            self._delta_log[position:position + len(data)] = data
+            self._delta_log_position.value = position + len(data)
+        STATISTICS.increment('deltas', len(devices_by_login))
+        return True
+
+    def get(self, login_id):
+        """Returns a list of (platform_id, device_token) of active devices of a login."""
+        STATISTICS.increment('lookups')
+        self._refresh()
+        if login_id in self._overlay:
+            return self._overlay[login_id][1]
+        return self._snapshot_devices(login_id)
+
+    def _refresh(self):
+        if self._generation.value == self._snapshot_generation and \
+                self._delta_log_position.value == self._applied_position:
+            return
+        with self.lock:
+            generation = self._generation.value
+            if generation != self._snapshot_generation:
+                self._open_snapshot(generation)
+            self._apply_deltas(self._delta_log_position.value)
+
+    def _open_snapshot(self, generation):
+        if self._snapshot is not None:
+            self._snapshot.close()
+        with open(self._snapshot_path(generation), 'rb') as fd:
+            self._snapshot = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, _ = SNAPSHOT_HEADER.unpack_from(self._snapshot, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise Exception("Device directory snapshot {} is not valid!".format(self._snapshot_path(generation)))
+        self._platform_ids_offset = SNAPSHOT_HEADER.size + self._count * LOGIN_ID_ITEM.size
+        self._token_offsets_offset = self._platform_ids_offset + self._count * PLATFORM_ID_ITEM.size
+        self._tokens_offset = self._token_offsets_offset + (self._count + 1) * TOKEN_OFFSET_ITEM.size
+        self._snapshot_generation = generation
+        self._overlay = {}
+        self._applied_position = 0
+
+    def _deltas(self, offset, position):
+        """Yields (start, end, version, login_id, devices) of deltas in log between offset and position."""
+        while offset < position:
+            start = offset
+            version, login_id, count = DELTA_HEADER.unpack_from(self._delta_log, offset)
+            offset += DELTA_HEADER.size
+            devices = []
+            for i in range(count):
+                platform_id, token_length = DELTA_DEVICE.unpack_from(self._delta_log, offset)
+                offset += DELTA_DEVICE.size
+                devices.append((platform_id, self._delta_log[offset:offset + token_length].decode('utf-8')))
+                offset += token_length
+            yield start, offset, version, login_id, devices
+
+    def _apply_deltas(self, position):
+        for start, end, version, login_id, devices in self._deltas(self._applied_position, position):
+            # a delta appended late may be older than one already applied
+            if version > self._overlay.get(login_id, (0, None))[0]:
+                self._overlay[login_id] = (version, devices)
+        self._applied_position = position
+
+    def _login_id_at(self, index):
+        return LOGIN_ID_ITEM.unpack_from(self._snapshot, SNAPSHOT_HEADER.size + index * LOGIN_ID_ITEM.size)[0]
+
+    def _snapshot_devices(self, login_id):
+        # binary search for the first device of a login
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._login_id_at(middle) < login_id:
+                low = middle + 1
+            else:
+                high = middle
+        devices = []
+        while low < self._count and self._login_id_at(low) == login_id:
+            platform_id = PLATFORM_ID_ITEM.unpack_from(self._snapshot,
+                                                       self._platform_ids_offset + low * PLATFORM_ID_ITEM.size)[0]
+            start, end = TOKEN_OFFSETS_ITEM.unpack_from(self._snapshot,
+                                                        self._token_offsets_offset + low * TOKEN_OFFSET_ITEM.size)
+            device_token = self._snapshot[self._tokens_offset + start:self._tokens_offset + end].decode('utf-8')
+            devices.append((platform_id, device_token))
+            low += 1
+        return devices
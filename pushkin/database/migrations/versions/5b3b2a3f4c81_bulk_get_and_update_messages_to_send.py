@@ -0,0 +1,69 @@
+"""bulk get_and_update_messages_to_send
+
+Revision ID: 5b3b2a3f4c81
+Revises: 1dd47617dcf0
+Create Date: 2026-10-18 11:02:17.554210
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b3b2a3f4c81'
+down_revision = '1dd47617dcf0'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+create_get_and_update_messages_to_send = """
+DROP FUNCTION IF EXISTS "get_and_update_messages_to_send" (int8[], int4[]);
+CREATE OR REPLACE FUNCTION "get_and_update_messages_to_send" (
+	p_login_ids int8[],
+	p_message_ids int4[]
+)
+RETURNS TABLE (login_id int8, message_id int4) AS
+$body$
+#variable_conflict use_column
+DECLARE
+	v_now int8 := extract(epoch from current_timestamp)::bigint*1000;
+BEGIN
+	RETURN QUERY
+	WITH
+	pairs AS (
+		SELECT DISTINCT p.login_id, p.message_id
+		FROM UNNEST(p_login_ids, p_message_ids) AS p(login_id, message_id)
+	),
+	eligible AS (
+		SELECT p.login_id, p.message_id
+		FROM pairs p
+		INNER JOIN login l
+			ON l.id = p.login_id
+		INNER JOIN message m
+			ON m.id = p.message_id
+		LEFT JOIN user_message_last_time_sent umlts
+			ON umlts.login_id = p.login_id AND umlts.message_id = p.message_id
+		WHERE
+			umlts.id IS NULL OR
+			m.cooldown_ts IS NULL OR
+			umlts.last_time_sent_ts_bigint + m.cooldown_ts <= v_now
+	)
+	INSERT INTO user_message_last_time_sent AS umlts (login_id, message_id, last_time_sent_ts_bigint)
+	SELECT e.login_id, e.message_id, v_now
+	FROM eligible e
+	ON CONFLICT ON CONSTRAINT c_user_unique_message
+	DO UPDATE SET last_time_sent_ts_bigint = EXCLUDED.last_time_sent_ts_bigint
+	RETURNING umlts.login_id, umlts.message_id;
+
+END;
+$body$
+LANGUAGE 'plpgsql'
+VOLATILE
+CALLED ON NULL INPUT
+SECURITY INVOKER;
+"""
+
+def upgrade():
+    op.execute(create_get_and_update_messages_to_send)
+
+def downgrade():
+    op.execute('DROP FUNCTION IF EXISTS "get_and_update_messages_to_send" (int8[], int4[]);')
@@ -22,10 +22,13 @@ from pushkin.requesthandlers.events import ProtoEventHandler, JsonEventHandler
 from pushkin.requesthandlers.notifications import ProtoNotificationHandler, JsonNotificationHandler
 from pushkin.request.request_processor import RequestProcessor
 from pushkin.request.event_handlers import EventHandlerManager
+from pushkin.request.cooldown_tracker import CooldownTracker
+from pushkin.request.admission_controller import AdmissionController
 from pushkin.requesthandlers.monitoring import RequestQueueHandler
 from pushkin.requesthandlers.monitoring import ApnSenderQueueHandler
 from pushkin.requesthandlers.monitoring import GcmSenderQueueHandler
 from pushkin.requesthandlers.monitoring import NotificationPostProcessorQueue
+from pushkin.requesthandlers.monitoring import StatisticsHandler
 import multiprocessing
 
 from pushkin import context
@@ -46,6 +49,11 @@ def init():
               "To upgrade database run pushkin --configuration {cfg} --upgrade-db".format(cfg=CONFIGURATION_FILENAME))
         sys.exit(1)
 
+    database.init_device_directory()
+    if config.cooldown_tracker:
+        context.cooldown_tracker = CooldownTracker(config.cooldown_tracker_size, config.cooldown_tracker_flush_interval)
+    if config.admission_control:
+        context.admission_controller = AdmissionController(context.request_processor)
     context.log_queue = multiprocessing.Queue()
     context.message_blacklist = {row.login_id:set(row.blacklist) for row in database.get_all_message_blacklist()}
 
@@ -60,6 +68,7 @@ def create_app():
         (config.apn_sender_queue_handler_url, ApnSenderQueueHandler),
         (config.gcm_sender_queue_handler_url, GcmSenderQueueHandler),
         (config.notification_post_processor_queue_handler_url, NotificationPostProcessorQueue),
+        (config.statistics_handler_url, StatisticsHandler),
     ])
     return application
 
@@ -0,0 +1,80 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import random
+
+from pushkin import config
+from pushkin.util.laned_queue import NORMAL_PRIORITY
+from pushkin.util.statistics import SharedStatistics
+
+"""Admission of batch requests from depth of queues they will go through."""
+
+STATISTICS = SharedStatistics('admission', ['admitted', 'throttled', 'shed', 'pressure'])
+
+
+def pressure(depth, low_watermark, high_watermark):
+    """0 below low watermark, 1 above high watermark, growing linearly in between."""
+    if depth <= low_watermark:
+        return 0.0
+    if depth >= high_watermark:
+        return 1.0
+    return float(depth - low_watermark) / (high_watermark - low_watermark)
+
+
+class AdmissionController():
+    """
+    Decides whether a batch request is admitted, before it is read, from depth of request processor, sender and
+    post processor queues. Depth of sender queues includes notifications taken ahead by their workers, and depth of
+    post processor includes windows waiting for its workers, so backlog is seen wherever it builds up.
+
+    Each queue has a low and a high watermark. Below low watermarks of all queues every request is admitted, above high
+    watermark of any queue none are, and in between requests are admitted with probability falling linearly, so load
+    is shed gradually before any queue overflows. A sender with notifications in its spool already overflowed, it
+    counts as being above its high watermark for normal priority requests. Request and sender queues are looked at in
+    lane of the request, so high priority requests can still be admitted while normal ones are shed.
+    """
+
+    def __init__(self, request_processor):
+        self.request_processor = request_processor
+
+    def queue_pressures(self, lane=NORMAL_PRIORITY):
+        """Returns {queue name: pressure between 0 and 1} for requests of given priority lane."""
+        request_processor = self.request_processor
+        sender_manager = request_processor.sender_manager
+        pressures = {
+            request_processor.name: pressure(request_processor.lane_size(lane),
+                                             config.request_queue_low_watermark * request_processor.lane_limit(lane),
+                                             config.request_queue_high_watermark * request_processor.lane_limit(lane)),
+            'NotificationPostProcessor': pressure(sender_manager.notification_post_processor.queue_size(),
+                                                  config.post_processor_low_watermark,
+                                                  config.post_processor_high_watermark),
+        }
+        for sender in sender_manager.sender_by_name.values():
+            # spool fills up with overflow of normal lane, high lane has its own limit
+            if lane == NORMAL_PRIORITY and sender.spool is not None and len(sender.spool) > 0:
+                pressures[sender.name] = 1.0
+            else:
+                pressures[sender.name] = pressure(sender.lane_size(lane),
+                                                  config.sender_queue_low_watermark * sender.lane_limit(lane),
+                                                  config.sender_queue_high_watermark * sender.lane_limit(lane))
+        return pressures
+
+    def admit(self, lane=NORMAL_PRIORITY):
+        """Returns False if request of given priority lane should be rejected."""
+        current = max(self.queue_pressures(lane).values())
+        STATISTICS.set_gauge('pressure', current)
+        if current >= 1:
+            STATISTICS.increment('shed')
+            return False
+        if random.random() < current:
+            STATISTICS.increment('throttled')
+            return False
+        STATISTICS.increment('admitted')
+        return True
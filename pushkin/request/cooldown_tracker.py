@@ -0,0 +1,168 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import multiprocessing
+import time
+from Queue import Empty
+from threading import Thread
+
+from pushkin import context
+from pushkin.database import database
+from pushkin.util.statistics import SharedStatistics
+
+"""In memory tracking of message cooldowns, shared by request processor workers."""
+
+STATISTICS = SharedStatistics('cooldown_tracker', ['eligible', 'not_eligible', 'database_fallbacks', 'flushed',
+                                                   'flush_errors'])
+NUM_STRIPES = 64
+MAX_PROBES = 32
+
+
+def current_time_millis():
+    return int(round(time.time() * 1000))
+
+
+class CooldownTracker():
+    """
+    Keeps last time a message was sent to a user in shared memory, so message cooldowns are checked without database.
+
+    Entries are kept in a hash table partitioned into stripes by login_id, each stripe has its own lock. Cooldowns are
+    taken from cached messages. Changes are written to user_message_last_time_sent in bulk by a flusher thread in the
+    server process, which also loads messages still in cooldown on start. Pairs which can't be tracked, because their
+    message is unknown or their part of the table is full, are checked in database.
+
+    Must be created and started before worker processes are forked. Sends made by other Pushkin instances are not
+    seen, so it should be enabled only when a single instance uses the database.
+    """
+
+    def __init__(self, size, flush_interval):
+        self.stripe_size = max(1, size / NUM_STRIPES)
+        self.flush_interval = flush_interval
+        self._login_ids = multiprocessing.RawArray('l', self.stripe_size * NUM_STRIPES)
+        # message ids start from 1, 0 marks an empty slot
+        self._message_ids = multiprocessing.RawArray('i', self.stripe_size * NUM_STRIPES)
+        self._last_time_sent = multiprocessing.RawArray('l', self.stripe_size * NUM_STRIPES)
+        self._locks = [multiprocessing.Lock() for i in range(NUM_STRIPES)]
+        self._flush_queue = multiprocessing.Queue()
+        self._pending = {}
+        self._flusher = None
+
+    def start(self):
+        """Loads messages still in cooldown and starts flusher thread."""
+        messages = database.get_cached_messages()
+        for login_id, message_id, last_time_sent in database.get_messages_in_cooldown():
+            if message_id in messages:
+                self._check_and_set(login_id, message_id, last_time_sent, messages, force=True)
+        self._flusher = CooldownFlusher(self)
+        self._flusher.start()
+
+    def get_and_update_messages_to_send(self, user_message_set):
+        """
+        Update last time a message id was send for a user. Returns a list of (login_id, message_id) tuples that are
+        eligible for sending according to message cooldown.
+
+        Expects a set of (login_id, message_id) tuples.
+        """
+        now = current_time_millis()
+        messages = database.get_cached_messages()
+        eligible = []
+        untracked = set()
+        for login_id, message_id in user_message_set:
+            login_id, message_id = int(login_id), int(message_id)
+            if message_id not in messages:
+                untracked.add((login_id, message_id))
+                continue
+            result = self._check_and_set(login_id, message_id, now, messages)
+            if result is None:
+                untracked.add((login_id, message_id))
+            elif result:
+                eligible.append((login_id, message_id))
+        STATISTICS.increment('eligible', len(eligible))
+        STATISTICS.increment('not_eligible', len(user_message_set) - len(eligible) - len(untracked))
+        if len(eligible) > 0:
+            self._flush_queue.put([(login_id, message_id, now) for login_id, message_id in eligible])
+        if len(untracked) > 0:
+            STATISTICS.increment('database_fallbacks', len(untracked))
+            eligible.extend(database.get_and_update_messages_to_send(untracked))
+        return eligible
+
+    def _is_expired(self, slot, now, messages):
+        message = messages.get(self._message_ids[slot])
+        if message is None or message.cooldown_ts is None:
+            return True
+        return self._last_time_sent[slot] + message.cooldown_ts <= now
+
+    def _check_and_set(self, login_id, message_id, now, messages, force=False):
+        """
+        Sets last time sent to now if message is out of cooldown, or always if force is set. Returns True if it was
+        set, False if message is in cooldown and None if there is no free slot for it.
+        """
+        cooldown_ts = messages[message_id].cooldown_ts
+        stripe = login_id % NUM_STRIPES
+        base = stripe * self.stripe_size
+        start = (login_id / NUM_STRIPES * 31 + message_id) % self.stripe_size
+        with self._locks[stripe]:
+            free_slot = None
+            for probe in range(min(MAX_PROBES, self.stripe_size)):
+                slot = base + (start + probe) % self.stripe_size
+                if self._message_ids[slot] == 0:
+                    if free_slot is None:
+                        free_slot = slot
+                    break
+                if self._message_ids[slot] == message_id and self._login_ids[slot] == login_id:
+                    if not force and cooldown_ts is not None and self._last_time_sent[slot] + cooldown_ts > now:
+                        return False
+                    self._last_time_sent[slot] = now
+                    return True
+                # slots are reused instead of emptied, so probe sequences are never broken
+                if free_slot is None and self._is_expired(slot, now, messages):
+                    free_slot = slot
+            if free_slot is None:
+                return None
+            self._login_ids[free_slot] = login_id
+            self._message_ids[free_slot] = message_id
+            self._last_time_sent[free_slot] = now
+            return True
+
+    def flush(self):
+        """Writes all queued changes to database, changes are kept for next flush if writing fails."""
+        while True:
+            try:
+                rows = self._flush_queue.get_nowait()
+            except Empty:
+                break
+            for login_id, message_id, last_time_sent in rows:
+                key = (login_id, message_id)
+                self._pending[key] = max(self._pending.get(key, 0), last_time_sent)
+        if len(self._pending) == 0:
+            return
+        try:
+            database.upsert_messages_last_time_sent(
+                [(login_id, message_id, last_time_sent)
+                 for (login_id, message_id), last_time_sent in self._pending.iteritems()])
+            STATISTICS.increment('flushed', len(self._pending))
+            self._pending = {}
+        except:
+            STATISTICS.increment('flush_errors')
+            context.main_logger.exception("Failed to write {} message cooldowns".format(len(self._pending)))
+
+
+class CooldownFlusher(Thread):
+    """Periodically writes changes of a cooldown tracker to database."""
+
+    def __init__(self, tracker):
+        Thread.__init__(self)
+        self.daemon = True
+        self.tracker = tracker
+
+    def run(self):
+        while True:
+            time.sleep(self.tracker.flush_interval)
+            self.tracker.flush()
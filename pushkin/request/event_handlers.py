@@ -42,12 +42,22 @@ class EventHandlerManager():
 
 
 class EventHandler():
+    # handlers that set this are given all events of a batch at once through handle_events
+    handles_batch = False
+
     def __init__(self, event_id):
         self.event_id = event_id
 
     def handle_event(self, event, event_params):
         raise Exception("Not implemented!")
 
+    def handle_events(self, events):
+        """Handles a list of (event, event_params) pairs, returns messages for all of them."""
+        messages = []
+        for event, event_params in events:
+            messages.extend(self.handle_event(event, event_params))
+        return messages
+
     def validate(self, event, event_params):
         return event.has_field('user_id') and event.has_field('timestamp')
 
@@ -55,6 +65,8 @@ class EventHandler():
 class LoginEventHandler(EventHandler):
     """Writes user data to database on login event."""
 
+    handles_batch = True
+
     def __init__(self):
         EventHandler.__init__(self, config.login_event_id)
 
@@ -65,6 +77,26 @@ class LoginEventHandler(EventHandler):
                                     application_version=event_params['applicationVersion'])
         return []
 
+    def handle_events(self, events):
+        """Writes all logins of a batch with one database call, falls back to one call per login on failure."""
+        logins = [{
+            'login_id': event.user_id,
+            'language_id': event_params.get('languageId'),
+            'platform_id': event_params['platformId'],
+            'device_token': event_params.get('deviceToken'),
+            'application_version': event_params['applicationVersion']
+        } for event, event_params in events]
+        try:
+            database.process_user_logins(logins)
+        except:
+            context.main_logger.exception("Bulk login processing failed, processing {} logins one by one".format(len(logins)))
+            for event, event_params in events:
+                try:
+                    self.handle_event(event, event_params)
+                except:
+                    context.main_logger.exception("Error while processing login event: {}".format(event))
+        return []
+
     def validate(self, event, event_params):
         result = EventHandler.validate(self, event, event_params)
         result &= is_integer(event_params.get('platformId', ''))
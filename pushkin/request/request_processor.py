@@ -15,17 +15,26 @@ from pushkin.util.pool import ThreadPool
 from pushkin import context
 from pushkin import config
 from pushkin.sender.sender_manager import NotificationSenderManager
-from pushkin.util.pool import ProcessPool
+from pushkin.util.pool import LanedProcessPool
+from pushkin.util.laned_queue import NORMAL_PRIORITY
+from pushkin.database import database
 
 
-class RequestProcessor(ProcessPool):
+class RequestProcessor(LanedProcessPool):
     """Background thread pool for doing blocking tasks from server requests and offloading notifications to other processes."""
 
     def __init__(self):
-        ProcessPool.__init__(self, self.__class__.__name__, config.request_processor_num_threads,
-                            config.request_queue_limit)
+        LanedProcessPool.__init__(self, self.__class__.__name__, config.request_processor_num_threads,
+                                  config.request_queue_limit, config.request_high_priority_queue_limit,
+                                  config.request_high_priority_weight)
         self.sender_manager = NotificationSenderManager()
 
+    def lane_of(self, request):
+        return getattr(request, 'priority', NORMAL_PRIORITY)
+
+    def init_worker(self):
+        database.init_db()
+
     def process(self):
         while True:
             item = self.task_queue.get()
@@ -40,5 +49,7 @@ class RequestProcessor(ProcessPool):
                 context.main_logger.exception("RequestProcessor failed to process item: {}".format(item))
 
     def start(self):
-        ProcessPool.start(self)
+        # workers create their own connection pools, don't let them inherit connections of this process
+        database.dispose_db()
+        LanedProcessPool.start(self)
         self.sender_manager.start()
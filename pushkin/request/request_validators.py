@@ -17,32 +17,43 @@ class NotificationValidator():
         self.fields_to_check = ['login_id', 'title', 'content']
 
     @abc.abstractmethod
-    def validate_single(self, request):
+    def missing_field(self, request):
+        """Returns name of the first required field missing from request, None if it has all of them."""
         raise NotImplementedError
 
+    def validation_error(self, request):
+        """Returns reason request is not valid, None if it is."""
+        field = self.missing_field(request)
+        if field is not None:
+            return 'missing {}'.format(field)
+        return None
+
+    def validate_single(self, request):
+        return self.validation_error(request) is None
+
 class ProtoNotificationValidator(NotificationValidator):
 
     def __init__(self):
         super(ProtoNotificationValidator, self).__init__()
 
-    def validate_single(self, request):
+    def missing_field(self, request):
         for field in self.fields_to_check:
             if not request.HasField(field):
-                return False
+                return field
 
-        return True
+        return None
 
 class JsonNotificationValidator(NotificationValidator):
 
     def __init__(self):
         super(JsonNotificationValidator, self).__init__()
 
-    def validate_single(self, request):
+    def missing_field(self, request):
         for field in self.fields_to_check:
             if field not in request:
-                return False
+                return field
 
-        return True
+        return None
 
 class EventValidator():
     __metaclass__  = abc.ABCMeta
@@ -51,20 +62,31 @@ class EventValidator():
         self.fields_to_check = ['user_id', 'event_id', 'timestamp']
 
     @abc.abstractmethod
-    def validate_single(self, request):
+    def missing_field(self, request):
+        """Returns name of the first required field missing from request, None if it has all of them."""
         raise NotImplementedError
 
+    def validation_error(self, request):
+        """Returns reason request is not valid, None if it is."""
+        field = self.missing_field(request)
+        if field is not None:
+            return 'missing {}'.format(field)
+        return None
+
+    def validate_single(self, request):
+        return self.validation_error(request) is None
+
 class JsonEventValidator(EventValidator):
     ''' Concrete implementation of EventValidator for JSON requests. '''
     def __init__(self):
         super(JsonEventValidator, self).__init__()
 
-    def validate_single(self, request):
+    def missing_field(self, request):
         for field in self.fields_to_check:
             if field not in request:
-                return False
+                return field
 
-        return True
+        return None
 
 class ProtoEventValidator(EventValidator):
     ''' Concrete implementation of EventValidator for protobuff requests. '''
@@ -72,9 +94,9 @@ class ProtoEventValidator(EventValidator):
     def __init__(self):
         super(ProtoEventValidator, self).__init__()
 
-    def validate_single(self, request):
+    def missing_field(self, request):
         for field in self.fields_to_check:
             if not request.HasField(field):
-                return False
+                return field
 
-        return True
+        return None
@@ -8,9 +8,11 @@ The above copyright notice and this permission notice shall be included in all c
 
 THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 '''
+from collections import OrderedDict
 from pushkin import context
 from pushkin import config
 from pushkin.database import database
+from pushkin.util.laned_queue import NORMAL_PRIORITY
 
 
 class AbstractRequest():
@@ -30,26 +32,39 @@ class NotificationRequestSingle(AbstractRequest):
 
 
 class NotificationRequestBatch():
-    """Encapsulates a batch of notifications ready for processing."""
+    """Encapsulates a batch of notifications ready for processing. Priority of the batch is their lane in queues."""
 
-    def __init__(self, notifications):
+    def __init__(self, notifications, priority=NORMAL_PRIORITY):
         self.notifications = notifications
+        self.priority = priority
 
     def process(self):
+        valid_notifications = []
         for notification in self.notifications:
             try:
                 if self.validate_single(notification):
-                    self.process_single(notification)
+                    valid_notifications.append(notification)
                 else:
                     context.main_logger.error("Notification proto is not valid: {}".format(notification))
             except:
                 context.main_logger.exception("Error while processing notification proto: {}".format(notification))
 
-    def process_single(self, notification):
+        # resolve devices of the whole batch with a single query
+        devices_by_login = database.get_device_tokens_batch(
+            [notification.login_id for notification in valid_notifications])
+        for notification in valid_notifications:
+            try:
+                self.process_single(notification, devices_by_login.get(notification.login_id, []))
+            except:
+                context.main_logger.exception("Error while processing notification proto: {}".format(notification))
+
+    def process_single(self, notification, devices=None):
         raw_messages = database.get_raw_messages(notification.login_id, notification.title, notification.content,
-                                                 notification.screen, config.game, config.world_id, config.dry_run)
+                                                 notification.screen, config.game, config.world_id, config.dry_run,
+                                                 devices=devices)
         if len(raw_messages) > 0:
             for raw_message in raw_messages:
+                raw_message['lane'] = self.priority
                 context.main_logger.debug("Submitting to NotificationSender: {}".format(raw_message))
                 context.request_processor.sender_manager.submit(raw_message)
         else:
@@ -79,49 +94,78 @@ class EventRequestSingle(AbstractRequest):
 
 
 class EventRequestBatch():
-    """Encapsulates a batch of events ready for processing."""
+    """Encapsulates a batch of events ready for processing. Priority of the batch is its lane in queues."""
 
-    def __init__(self, events):
+    def __init__(self, events, priority=NORMAL_PRIORITY):
         self.events = events
+        self.priority = priority
 
     def process(self):
         messages = self.build_messages()
         for message in self.filter_messages(messages):
+            message['lane'] = self.priority
             context.request_processor.sender_manager.submit(message)
 
     def build_messages(self):
         """Creates a list of messages if there are registered event handlers"""
         messages = []
+        valid_events = []
         for event in self.events:
             try:
                 event_params = event.pairs
                 if self.validate_single(event, event_params):
-                    new_messages = self.process_single(event, event_params)
-                    messages.extend(new_messages)
+                    valid_events.append((event, event_params))
                 else:
                     context.main_logger.error("Event proto is not valid: {}".format(event))
             except Exception as e:
                 context.main_logger.exception("Error while processing event proto: {}".format(event))
+
+        # batch handlers (logins) run first so the rest of the handlers see their changes
+        messages.extend(self.process_batched(valid_events))
+        for event, event_params in valid_events:
+            try:
+                new_messages = self.process_single(event, event_params, include_batched=False)
+                messages.extend(new_messages)
+            except Exception as e:
+                context.main_logger.exception("Error while processing event proto: {}".format(event))
+        return messages
+
+    def process_batched(self, events):
+        """Passes events to handlers that handle the whole batch at once."""
+        messages = []
+        events_per_handler = OrderedDict()
+        for event, event_params in events:
+            for handler in context.event_handler_manager.get_handlers(event.event_id):
+                if handler.handles_batch:
+                    events_per_handler.setdefault(handler, []).append((event, event_params))
+        for handler, handler_events in events_per_handler.iteritems():
+            context.main_logger.debug(
+                "Handling {count} events with handler: {handler}".format(count=len(handler_events),
+                                                                         handler=handler.__class__))
+            try:
+                messages.extend(handler.handle_events(handler_events))
+            except Exception as e:
+                context.main_logger.exception("Error while handling events with handler: {}".format(handler.__class__))
         return messages
 
     def filter_messages(self, messages):
         """Filters out messages that shouldn't be send according to cooldown"""
         if len(messages) > 0:
             pairs = {(message['login_id'], message['message_id']) for message in messages}
-            pairs_to_send = database.get_and_update_messages_to_send(pairs)
-            if pairs_to_send is not None and len(pairs_to_send) > 0:
-                # converts [{user_id: message_id}, ...] to [(user_id, message_id), ...]
-                pairs_to_send_tuple = set([(pair.iteritems().next()) for pair in pairs_to_send])
-                return [message for message in messages if
-                        (str(message['login_id']), str(message['message_id'])) in pairs_to_send_tuple]
+            if context.cooldown_tracker is not None:
+                pairs_to_send = set(context.cooldown_tracker.get_and_update_messages_to_send(pairs))
             else:
-                return []
+                pairs_to_send = set(database.get_and_update_messages_to_send(pairs))
+            return [message for message in messages if
+                    (int(message['login_id']), int(message['message_id'])) in pairs_to_send]
         return messages
 
-    def process_single(self, event, event_params):
+    def process_single(self, event, event_params, include_batched=True):
         messages = []
         handlers = context.event_handler_manager.get_handlers(event.event_id)
         for handler in handlers:
+            if handler.handles_batch and not include_batched:
+                continue
             context.main_logger.debug(
                 "Handling event: {event} with handler: {handler}".format(event=event, handler=handler.__class__))
             messages.extend(handler.handle_event(event, event_params))
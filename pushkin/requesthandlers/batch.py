@@ -11,14 +11,154 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 import tornado.web
 import httplib
 import abc
+import math
 from pushkin import context
+from pushkin import config
+from pushkin.util.laned_queue import LANES, NORMAL_PRIORITY
+from pushkin.util.proto_stream import ProtoStreamError
+from pushkin.util.body_decoder import BodyDecoder, BodyTooLarge, UnsupportedEncoding
+from pushkin.util.statistics import SharedStatistics
 
+ENDPOINTS = ('proto_events', 'json_events', 'proto_notifications', 'json_notifications')
+COMPRESSION_STATISTICS = SharedStatistics('request_compression', [
+    '{endpoint}_{name}'.format(endpoint=endpoint, name=name) for endpoint in ENDPOINTS
+    for name in ('requests', 'compressed_bytes', 'decompressed_bytes', 'ratio')])
 
+
+@tornado.web.stream_request_body
 class BatchHandler(tornado.web.RequestHandler):
-    """Abstract handler for receiving request batches."""
+    """
+    Abstract handler for receiving request batches.
+
+    If handler has a stream parser, requests are parsed while body is received and submitted in sub batches, otherwise
+    body is buffered and parsed once it is complete. Body compressed with gzip or zstd, as given by Content-Encoding, is
+    decompressed while it is received. Batches posted with ?priority=high go through high priority lanes of queues.
+    """
 
     __metaclass__ = abc.ABCMeta
 
+    # name of endpoint in request_compression statistics
+    ENDPOINT = None
+
+    def prepare(self):
+        self.body_error = None
+        self.rejected = []
+        self.accepted = 0
+        self.batch_offset = 0
+        self.unprocessed_from = None
+        self.chunks = []
+        self.stream_parser = None
+        self.stream_requests = []
+        self.num_requests = 0
+        self.stream_failed = False
+        self.submit_failed = False
+        self.priority = self.get_query_argument('priority', NORMAL_PRIORITY).lower()
+        if self.priority not in LANES:
+            context.main_logger.error("Unknown priority {priority} in batch handler {handler}!".format(
+                priority=self.priority, handler=self.__class__.__name__))
+            self.body_error = httplib.BAD_REQUEST
+            raise tornado.web.HTTPError(httplib.BAD_REQUEST)
+        for pool in self.pools():
+            pool.sample_drain_rate()
+        if context.admission_controller is not None and not context.admission_controller.admit(self.priority):
+            context.main_logger.warning("Queues are close to their limits, sending back off response...")
+            # body is not read
+            self.body_error = httplib.SERVICE_UNAVAILABLE
+            self.unprocessed_from = 0
+            self.respond(httplib.SERVICE_UNAVAILABLE)
+            self.finish()
+            return
+        try:
+            self.body_decoder = BodyDecoder(self.request.headers.get('Content-Encoding'), config.max_decoded_body_size)
+        except UnsupportedEncoding:
+            context.main_logger.exception("Unsupported encoding in batch handler {}!".format(self.__class__.__name__))
+            self.body_error = httplib.UNSUPPORTED_MEDIA_TYPE
+            raise tornado.web.HTTPError(httplib.UNSUPPORTED_MEDIA_TYPE)
+        if config.stream_proto_batches:
+            self.stream_parser = self.create_stream_parser()
+
+    def create_stream_parser(self):
+        """Returns ProtoStreamParser of batch body, None if batches are parsed only after the whole body is received."""
+        return None
+
+    def data_received(self, chunk):
+        if self.body_error is not None:
+            return
+        try:
+            chunk = self.body_decoder.decode(chunk)
+        except BodyTooLarge:
+            context.main_logger.error(
+                "Decoded request is too large in batch handler {}!".format(self.__class__.__name__))
+            self.body_error = httplib.REQUEST_ENTITY_TOO_LARGE
+            return
+        except Exception:
+            context.main_logger.exception(
+                "Request could not be decoded in batch handler {}!".format(self.__class__.__name__))
+            self.body_error = httplib.BAD_REQUEST
+            return
+        if self.stream_parser is None:
+            self.chunks.append(chunk)
+            return
+        if self.stream_failed:
+            return
+        try:
+            self.stream_requests.extend(self.stream_parser.feed(chunk))
+        except ProtoStreamError:
+            context.main_logger.exception(
+                "Request could not be parsed in batch handler {}!".format(self.__class__.__name__))
+            self.stream_failed = True
+            return
+        while len(self.stream_requests) >= config.stream_sub_batch_size:
+            self.submit_stream_requests()
+
+    def submit_stream_requests(self):
+        requests = self.stream_requests[:config.stream_sub_batch_size]
+        self.stream_requests = self.stream_requests[config.stream_sub_batch_size:]
+        offset = self.num_requests
+        self.num_requests += len(requests)
+        # once request processor is full, rest of the batch is rejected
+        if not self.submit_failed and not self.submit(requests, offset):
+            self.submit_failed = True
+
+    def submit(self, requests, offset=0):
+        """Submits requests starting at offset of the batch to RequestProcessor, returns False if it is full."""
+        self.batch_offset = offset
+        num_rejected = len(self.rejected)
+        if not context.request_processor.submit(self.create_request(requests)):
+            del self.rejected[num_rejected:]
+            self.unprocessed_from = offset
+            return False
+        self.accepted += len(requests) - (len(self.rejected) - num_rejected)
+        return True
+
+    def reject(self, index, reason):
+        """Called by create_request for requests which are not valid, index is position of request in requests."""
+        self.rejected.append({'index': self.batch_offset + index, 'reason': reason})
+
+    def pools(self):
+        """Pools whose queues are filled by this handler."""
+        return [context.request_processor] + context.request_processor.sender_manager.sender_by_name.values()
+
+    def retry_after(self):
+        """Seconds until lanes of this batch in all pools are drained to retry_after_drain_target of their limits."""
+        seconds = 0
+        for pool in self.pools():
+            pool_seconds = pool.seconds_to_drain(config.retry_after_drain_target, self.priority)
+            if pool_seconds is None:
+                return config.max_retry_after
+            seconds = max(seconds, pool_seconds)
+        return int(min(config.max_retry_after, max(1, math.ceil(seconds))))
+
+    def respond(self, status):
+        self.set_status(status)
+        if status == httplib.SERVICE_UNAVAILABLE:
+            self.set_header('Retry-After', str(self.retry_after()))
+        if self.get_query_argument('report', 'false').lower() in ('1', 'true'):
+            report = {'accepted': self.accepted, 'rejected': self.rejected}
+            if self.unprocessed_from is not None:
+                report['unprocessed_from'] = self.unprocessed_from
+            self.write(report)
+
     def parse_request(self, body):
         # discard invalid requests
         if not body:
@@ -32,8 +172,46 @@ class BatchHandler(tornado.web.RequestHandler):
                 "Request could not be parsed in batch handler {}!".format(self.__class__.__name__))
             raise tornado.web.HTTPError(400)
 
+    def record_compression(self):
+        if self.body_decoder.encoding == 'identity' or self.ENDPOINT is None:
+            return
+        prefix = self.ENDPOINT + '_'
+        COMPRESSION_STATISTICS.increment(prefix + 'requests')
+        COMPRESSION_STATISTICS.increment(prefix + 'compressed_bytes', self.body_decoder.encoded_size)
+        COMPRESSION_STATISTICS.increment(prefix + 'decompressed_bytes', self.body_decoder.decoded_size)
+        compressed_bytes = COMPRESSION_STATISTICS.get(prefix + 'compressed_bytes')
+        decompressed_bytes = COMPRESSION_STATISTICS.get(prefix + 'decompressed_bytes')
+        if compressed_bytes > 0:
+            COMPRESSION_STATISTICS.set_gauge(prefix + 'ratio', decompressed_bytes / compressed_bytes)
+
+    def respond_error(self, status):
+        """
+        Responds to a batch which could not be read to the end. Sub batches submitted before the error are not taken
+        back, so if there are any, unprocessed_from tells the client where to resume.
+        """
+        if self.num_requests == 0:
+            raise tornado.web.HTTPError(status)
+        if self.unprocessed_from is None:
+            self.unprocessed_from = self.num_requests
+        self.respond(status)
+
     def post(self):
-        self.handle_request()
+        if self.body_error is None:
+            try:
+                self.body_decoder.finish()
+            except Exception:
+                context.main_logger.exception(
+                    "Request could not be decoded in batch handler {}!".format(self.__class__.__name__))
+                self.body_error = httplib.BAD_REQUEST
+        if self.body_error is not None:
+            self.respond_error(self.body_error)
+            return
+        self.record_compression()
+        if self.stream_parser is None:
+            self.request.body = ''.join(self.chunks)
+            self.handle_request()
+        else:
+            self.handle_stream_end()
 
     @abc.abstractmethod
     def init_input_format(self, body):
@@ -47,7 +225,7 @@ class BatchHandler(tornado.web.RequestHandler):
 
     @abc.abstractmethod
     def create_request(self, requests):
-        """Create request to encapsulate proto_requests objects.
+        """Create request to encapsulate proto_requests objects, in priority lane of this batch.
         Passed to RequestProcessor.
         """
         raise NotImplementedError
@@ -59,8 +237,33 @@ class BatchHandler(tornado.web.RequestHandler):
                                   .format(num_requests=len(unpacked_requests),
                                           handler=self.__class__.__name__))
 
-        if not context.request_processor.submit(self.create_request(unpacked_requests)):
+        if not self.submit(unpacked_requests):
+            context.main_logger.warning("RequestProcessor queue size limit reached, sending back off response...")
+            self.respond(httplib.SERVICE_UNAVAILABLE)
+        else:
+            self.respond(httplib.OK)
+
+    def handle_stream_end(self):
+        try:
+            self.stream_parser.finish()
+        except ProtoStreamError:
+            context.main_logger.exception(
+                "Request could not be parsed in batch handler {}!".format(self.__class__.__name__))
+            self.stream_failed = True
+        if self.stream_failed or self.stream_parser.bytes_received == 0:
+            context.main_logger.error(
+                "Request was empty or invalid in batch handler {}!".format(self.__class__.__name__))
+            self.respond_error(httplib.BAD_REQUEST)
+            return
+        if self.stream_requests or self.num_requests == 0:
+            # remaining requests are fewer than a sub batch
+            self.submit_stream_requests()
+        context.main_logger.debug("Received an event batch of {num_requests} requests in batch handler {handler}"
+                                  .format(num_requests=self.num_requests,
+                                          handler=self.__class__.__name__))
+
+        if self.submit_failed:
             context.main_logger.warning("RequestProcessor queue size limit reached, sending back off response...")
-            self.set_status(httplib.SERVICE_UNAVAILABLE)
+            self.respond(httplib.SERVICE_UNAVAILABLE)
         else:
-            self.set_status(httplib.OK)
+            self.respond(httplib.OK)
@@ -10,6 +10,7 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 '''
 from pushkin.protobuf import EventMessage_pb2
 from batch import BatchHandler
+from pushkin.util.proto_stream import ProtoStreamParser
 from pushkin.request.requests import EventRequestBatch
 from pushkin.request.request_validators import ProtoEventValidator, JsonEventValidator
 from pushkin.request.requests import EventRequestSingle
@@ -19,29 +20,39 @@ import json
 class ProtoEventHandler(BatchHandler):
     """Http handler for receiving proto event batches."""
 
+    ENDPOINT = 'proto_events'
+
     def init_input_format(self, body):
         proto_request = EventMessage_pb2.BatchEventRequest()
         proto_request.ParseFromString(body)
         return proto_request
 
+    def create_stream_parser(self):
+        field_number = EventMessage_pb2.BatchEventRequest.DESCRIPTOR.fields_by_name['events'].number
+        return ProtoStreamParser(field_number, EventMessage_pb2.Event)
+
     def unpack_batch(self, request):
         return request.events
 
     def create_request(self, requests):
         valid_requests = []
         validator = ProtoEventValidator()
-        for request in requests:
-            if validator.validate_single(request):
+        for index, request in enumerate(requests):
+            error = validator.validation_error(request)
+            if error is None:
                 valid_requests.append(EventRequestSingle(request.user_id, request.event_id, {pair.key:pair.value for pair in request.pairs}, request.timestamp))
             else:
+                self.reject(index, error)
                 context.main_logger.error("Request not valid: {req}".format(req=str(request.__dict__)))
 
-        return EventRequestBatch(valid_requests)
+        return EventRequestBatch(valid_requests, self.priority)
 
 
 class JsonEventHandler(BatchHandler):
     """Http handler for receiving JSON event batches."""
 
+    ENDPOINT = 'json_events'
+
     def init_input_format(self, body):
         return json.loads(body)
 
@@ -51,8 +62,11 @@ class JsonEventHandler(BatchHandler):
     def create_request(self, requests):
         valid_requests = []
         validator = JsonEventValidator()
-        for request in requests:
-            if validator.validate_single(request):
+        for index, request in enumerate(requests):
+            error = validator.validation_error(request)
+            if error is None:
                 valid_requests.append(EventRequestSingle(request['user_id'], request['event_id'], request['pairs'] if 'pairs' in request else {}, request['timestamp']))
+            else:
+                self.reject(index, error)
 
-        return EventRequestBatch(valid_requests)
\ No newline at end of file
+        return EventRequestBatch(valid_requests, self.priority)
\ No newline at end of file
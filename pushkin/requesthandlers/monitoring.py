@@ -10,6 +10,7 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 '''
 import tornado.web
 from pushkin import context
+from pushkin.util import statistics
 
 """Utility handlers used for monitoring the server."""
 
@@ -66,3 +67,14 @@ class NotificationPostProcessorQueue(tornado.web.RequestHandler):
             context.main_logger.exception(
                 "Could not get queue size for notification post processor!")
             raise tornado.web.HTTPError(400)
+
+
+class StatisticsHandler(tornado.web.RequestHandler):
+    """Responds with JSON of all statistics collected by server and worker processes."""
+
+    def get(self):
+        try:
+            self.write(statistics.get_all_statistics())
+        except:
+            context.main_logger.exception("Could not get statistics!")
+            raise tornado.web.HTTPError(400)
@@ -10,6 +10,7 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 '''
 from pushkin.protobuf import PushNotificationMessage_pb2
 from batch import BatchHandler
+from pushkin.util.proto_stream import ProtoStreamParser
 from pushkin.request.requests import NotificationRequestBatch
 from pushkin.request.request_validators import ProtoNotificationValidator, JsonNotificationValidator
 from pushkin.request.requests import NotificationRequestSingle
@@ -18,27 +19,39 @@ import json
 class ProtoNotificationHandler(BatchHandler):
     """Http handler for receiving proto notification batches."""
 
+    ENDPOINT = 'proto_notifications'
+
     def init_input_format(self, body):
         proto_request = PushNotificationMessage_pb2.BatchNotificationRequest()
         proto_request.ParseFromString(body)
         return proto_request
 
+    def create_stream_parser(self):
+        batch_descriptor = PushNotificationMessage_pb2.BatchNotificationRequest.DESCRIPTOR
+        field_number = batch_descriptor.fields_by_name['notifications'].number
+        return ProtoStreamParser(field_number, PushNotificationMessage_pb2.PushNotification)
+
     def unpack_batch(self, request_proto):
         return request_proto.notifications
 
     def create_request(self, requests):
         valid_requests = []
         validator = ProtoNotificationValidator()
-        for request in requests:
-            if validator.validate_single(request):
+        for index, request in enumerate(requests):
+            error = validator.validation_error(request)
+            if error is None:
                 valid_requests.append(NotificationRequestSingle(request.login_id, request.title, request.content))
+            else:
+                self.reject(index, error)
 
-        return NotificationRequestBatch(valid_requests)
+        return NotificationRequestBatch(valid_requests, self.priority)
 
 
 class JsonNotificationHandler(BatchHandler):
     """Http handler for receiving JSON notification batches."""
 
+    ENDPOINT = 'json_notifications'
+
     def init_input_format(self, body):
         return json.loads(body)
 
@@ -48,8 +61,11 @@ class JsonNotificationHandler(BatchHandler):
     def create_request(self, requests):
         valid_requests = []
         validator = JsonNotificationValidator()
-        for request in requests:
-            if validator.validate_single(request):
+        for index, request in enumerate(requests):
+            error = validator.validation_error(request)
+            if error is None:
                 valid_requests.append(NotificationRequestSingle(request['login_id'], request['title'], request['content']))
+            else:
+                self.reject(index, error)
 
-        return NotificationRequestBatch(valid_requests)
\ No newline at end of file
+        return NotificationRequestBatch(valid_requests, self.priority)
\ No newline at end of file
@@ -15,17 +15,32 @@ import constants as const
 from pyapn2.client import APNsClient
 from datetime import datetime
 from pyapn2.payload import Payload
-from pyapn2.errors import APNsException, Unregistered
+from pyapn2.errors import APNsException, Unregistered, ConnectionLost
+from retry_policy import APNS_RETRY_POLICY
+from pushkin.util.statistics import SharedStatistics
+
+
+CONNECTION_STATISTICS = SharedStatistics('apns_connections', APNsClient.STATISTICS_NAMES)
 
 
 class APNS2PushSender(Sender):
+    MAINTENANCE_INTERVAL = 1
 
     def __init__(self, config, log):
         Sender.__init__(self, config, log)
         self.sandbox = config.getboolean('Messenger', 'apns_sandbox')
         self.certificate_path = config.get('Messenger', 'apns_certificate_path')
         self.topic = config.get('Messenger', 'apns_topic')
-        self.apn = APNsClient(self.certificate_path, use_sandbox=self.sandbox, log=log)
+        self.batch_size = config.getint('Messenger', 'apns_batch_size')
+        self.linger_seconds = self.get_optional_float(config, 'apns_linger_ms', 10.0) / 1000
+        self.apn = APNsClient(self.certificate_path, use_sandbox=self.sandbox, log=log,
+                              num_connections=self.get_optional_int(config, 'apns_connections', 1),
+                              max_concurrent_streams=self.get_optional_int(config, 'apns_max_concurrent_streams', 100),
+                              ping_interval=self.get_optional_float(config, 'apns_ping_interval', 60.0),
+                              reconnect_initial_delay=self.get_optional_float(config, 'apns_reconnect_initial_delay', 1.0),
+                              reconnect_max_delay=self.get_optional_float(config, 'apns_reconnect_max_delay', 60.0),
+                              statistics=CONNECTION_STATISTICS)
+        self.retry_policy = APNS_RETRY_POLICY
         self.canonical_ids = []
         self.unregistered_devices = []
 
@@ -39,6 +54,12 @@ class APNS2PushSender(Sender):
         self.unregistered_devices = []
         return items
 
+    def warm_up(self):
+        self.apn.warm_up()
+
+    def maintain_connections(self):
+        self.apn.maintain_connections()
+
     def prepare_data(self, notification):
         def to_timestamp(dt, epoch=datetime(1970, 1, 1)):
             # http://stackoverflow.com/questions/8777753/converting-datetime-date-to-utc-timestamp-in-python
@@ -73,26 +94,38 @@ class APNS2PushSender(Sender):
 
 
     def send(self, notification):
-        data = self.prepare_data(notification)
-
-        if data is not None:
-            for i in xrange(self.connection_error_retries):
-                try:
-                    self.apn.send_notification(data['token'], data['payload'], expiration=data['expiry'], topic=self.topic)
-                    notification['status'] = const.NOTIFICATION_SUCCESS
-                    break #We did it, time to break free!
-                except APNsException as e:
-                    if isinstance(e, Unregistered):
-                        notification['status'] = const.NOTIFICATION_APNS_DEVICE_UNREGISTERED
-                        unregistered_data = {
-                                        'login_id': notification['login_id'],
-                                        'device_token': notification['receiver_id'],
-                                    }
-                        self.unregistered_devices.append(unregistered_data)
-                    else:
-                        self.log.warning('APN got exception {}'.format(type(e).__name__))
+        self.send_notifications([notification])
+
+    def send_notifications(self, notifications):
+        """Sends notifications concurrently, failed ones are scheduled for retry according to APNs retry policy."""
+        prepared = []
+        for notification in notifications:
+            data = self.prepare_data(notification)
+            if data is not None:
+                prepared.append((notification, data))
+
+        def on_result(index, error):
+            notification, data = prepared[index]
+            if error is None:
+                notification['status'] = const.NOTIFICATION_SUCCESS
+            elif isinstance(error, Unregistered):
+                notification['status'] = const.NOTIFICATION_APNS_DEVICE_UNREGISTERED
+                unregistered_data = {
+                                'login_id': notification['login_id'],
+                                'device_token': notification['receiver_id'],
+                            }
+                self.unregistered_devices.append(unregistered_data)
+            else:
+                if isinstance(error, ConnectionLost):
+                    notification['status'] = const.NOTIFICATION_CONNECTION_ERROR
+                self.log.warning('APN got exception {}'.format(type(error).__name__))
+                self.retry(notification, error)
+
+        if prepared:
+            self.apn.send_notification_batch([(data['token'], data['payload'], data['expiry']) for _, data in prepared],
+                                             on_result, topic=self.topic)
 
     def send_batch(self):
-        while len(self.queue):
-            self.send(self.queue.pop())
-    
+        notifications = self.queue
+        self.queue = []
+        self.send_notifications(notifications)
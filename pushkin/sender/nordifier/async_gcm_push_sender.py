@@ -0,0 +1,106 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import json
+import socket
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+
+from gcm import GCMException, GCMConnectionException
+from gcm import GCMMissingRegistrationException, GCMTooManyRegIdsException, GCM_URL
+from gcm_push_sender import GCM2, GCMPushSender
+
+
+class AsyncGCM2(GCM2):
+    """GCM client making requests through tornado AsyncHTTPClient of the current IOLoop."""
+
+    def __init__(self, api_key, url=GCM_URL, max_clients=100, timeout=10):
+        GCM2.__init__(self, api_key, url=url)
+        self.timeout = timeout
+        self.http_client = AsyncHTTPClient(force_instance=True, max_clients=max_clients)
+
+    @gen.coroutine
+    def json_request_async(self, registration_ids, data=None, collapse_key=None, delay_while_idle=False,
+                           time_to_live=None, retries=5, dry_run=False, priority=GCM2.PRIORITY_NORMAL):
+        """Same as json_request, but doesn't block while waiting for GCM."""
+        if not registration_ids:
+            raise GCMMissingRegistrationException("Missing registration_ids")
+        if len(registration_ids) > 1000:
+            raise GCMTooManyRegIdsException("Exceded number of registration_ids")
+
+        backoff = self.BACKOFF_INITIAL_DELAY
+        info = {}
+        for attempt in range(retries):
+            payload = self.construct_payload(
+                registration_ids, data, collapse_key,
+                delay_while_idle, time_to_live, True, dry_run, priority=priority
+            )
+            response = yield self.make_request_async(payload)
+            attempt_info = self.handle_json_response(response, registration_ids)
+
+            unsent_reg_ids = self.merge_attempt_info(info, attempt_info, attempt == retries - 1)
+            if unsent_reg_ids:
+                registration_ids = unsent_reg_ids
+                yield gen.sleep(self.backoff_sleep_seconds(backoff))
+                if 2 * backoff < self.MAX_BACKOFF_DELAY:
+                    backoff *= 2
+            else:
+                break
+
+        raise gen.Return(info)
+
+    @gen.coroutine
+    def make_request_async(self, data):
+        headers = {
+            'Authorization': 'key=%s' % self.api_key,
+            'Content-Type': 'application/json',
+        }
+        request = HTTPRequest(self.url, method='POST', body=data, headers=headers, request_timeout=self.timeout)
+        try:
+            response = yield self.http_client.fetch(request)
+        except HTTPError as e:
+            # 599 is used by tornado for connection errors and timeouts
+            if e.code == 599:
+                raise GCMConnectionException(
+                    "There was an internal error in the GCM server while trying to process the request")
+            self.raise_http_error(e.code)
+        except (socket.error, IOError):
+            raise GCMConnectionException(
+                "There was an internal error in the GCM server while trying to process the request")
+        raise gen.Return(json.loads(response.body))
+
+
+class AsyncGCMPushSender(GCMPushSender):
+    """GCM sender sending all multicasts of a batch concurrently on the current IOLoop."""
+
+    def __init__(self, config, log, max_clients=100):
+        GCMPushSender.__init__(self, config, log)
+        self.gcm = AsyncGCM2(self.access_key, max_clients=max_clients,
+                             timeout=self.get_optional_int(config, 'gcm_connection_timeout', 10))
+
+    @gen.coroutine
+    def send_notifications_async(self, notifications):
+        yield [self.send_multicast_async(*multicast) for multicast in self.group_notifications(notifications)]
+
+    @gen.coroutine
+    def send_multicast_async(self, notifications_by_reg_id, data, expiry_seconds, priority, dry_run):
+        try:
+            response = yield self.gcm.json_request_async(
+                registration_ids=notifications_by_reg_id.keys(),
+                data=data,
+                time_to_live=expiry_seconds,
+                retries=1,
+                dry_run=dry_run,
+                priority=priority
+            )
+            self.handle_response(notifications_by_reg_id, response)
+        except GCMException as e:
+            self.handle_error(notifications_by_reg_id, e)
@@ -0,0 +1,169 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import httplib
+import socket
+import time
+import urlparse
+
+
+class ConnectionPoolException(Exception): pass
+
+
+class PooledConnection():
+    """A persistent HTTP connection and its usage counters."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.requests = 0
+        self.last_used = time.time()
+        self.handshake_ms = 0
+
+
+class HTTPConnectionPool():
+    """
+    Keeps persistent keep-alive connections to a single HTTP or HTTPS url, so requests don't pay for a new TCP
+    connection and TLS handshake each time.
+
+    Connections idle longer than idle_timeout seconds are closed instead of reused. A request which fails on a reused
+    connection, because it was closed by the server in the meantime, is retried once on a new connection. Timeouts and
+    errors after the server may have received the request are not retried, so a request is never sent twice.
+    Not thread safe, meant to be used by a single worker.
+
+    Besides totals, statistics hold requests sent over connections which were closed, so their mean number of requests
+    is closed_requests / closed, and the most requests sent over any connection and the longest handshake.
+    """
+    STATISTICS_NAMES = ['requests', 'connections', 'reconnects', 'idle_evictions', 'handshake_ms', 'max_handshake_ms',
+                        'closed', 'closed_requests', 'max_requests']
+
+    def __init__(self, url, size=1, idle_timeout=60, timeout=10, statistics=None):
+        parsed = urlparse.urlparse(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.statistics = statistics
+        self._idle = []
+        # highest values reported by this process, so shared maximums are only updated when they may change
+        self._max_requests = 0
+        self._max_handshake_ms = 0
+
+    def _increment(self, name, value=1):
+        if self.statistics is not None:
+            self.statistics.increment(name, value)
+
+    def _update_max(self, name, value):
+        if self.statistics is not None:
+            self.statistics.update_max(name, value)
+
+    def _close(self, pooled):
+        pooled.connection.close()
+        self._increment('closed')
+        self._increment('closed_requests', pooled.requests)
+
+    def _connect(self):
+        if self.scheme == 'https':
+            connection = httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        pooled = PooledConnection(connection)
+        start = time.time()
+        connection.connect()
+        pooled.handshake_ms = int((time.time() - start) * 1000)
+        self._increment('connections')
+        self._increment('handshake_ms', pooled.handshake_ms)
+        if pooled.handshake_ms > self._max_handshake_ms:
+            self._max_handshake_ms = pooled.handshake_ms
+            self._update_max('max_handshake_ms', pooled.handshake_ms)
+        return pooled
+
+    def _acquire(self):
+        now = time.time()
+        while self._idle:
+            pooled = self._idle.pop()
+            if now - pooled.last_used < self.idle_timeout:
+                return pooled, True
+            self._increment('idle_evictions')
+            self._close(pooled)
+        return self._connect(), False
+
+    def _release(self, pooled, response):
+        pooled.last_used = time.time()
+        if pooled.requests > self._max_requests:
+            self._max_requests = pooled.requests
+            self._update_max('max_requests', pooled.requests)
+        if response.will_close or len(self._idle) >= self.size:
+            self._close(pooled)
+        else:
+            self._idle.append(pooled)
+
+    def _stale(self, error, sent):
+        """
+        True if error means a reused connection was closed by the server before it got the request, so the request can
+        be sent again without being sent twice.
+        """
+        if isinstance(error, socket.timeout):
+            return False
+        if not sent:
+            return True
+        # connection closed without any response, server dropped it as idle
+        return isinstance(error, httplib.BadStatusLine) and error.line in ('', repr(''))
+
+    def request(self, method, body=None, headers=None):
+        """
+        Sends a request to pool url, returns a (status, response body) tuple.
+
+        :raises ConnectionPoolException: if request could not be sent or response could not be read
+        """
+        headers = headers or {}
+        try:
+            pooled, reused = self._acquire()
+        except (socket.error, httplib.HTTPException) as e:
+            raise ConnectionPoolException(str(e))
+        while True:
+            sent = False
+            try:
+                pooled.connection.request(method, self.path, body, headers)
+                sent = True
+                response = pooled.connection.getresponse()
+                data = response.read()
+            except (socket.error, httplib.HTTPException) as e:
+                self._close(pooled)
+                if not reused or not self._stale(e, sent):
+                    raise ConnectionPoolException(str(e))
+                self._increment('reconnects')
+                try:
+                    pooled, reused = self._connect(), False
+                except (socket.error, httplib.HTTPException) as e:
+                    raise ConnectionPoolException(str(e))
+                continue
+            pooled.requests += 1
+            self._increment('requests')
+            self._release(pooled, response)
+            return response.status, data
+
+    def warm_up(self):
+        """Opens a connection, so the first request doesn't have to."""
+        try:
+            pooled, reused = self._acquire()
+        except (socket.error, httplib.HTTPException):
+            return
+        pooled.last_used = time.time()
+        self._idle.append(pooled)
+
+    def close(self):
+        """Closes all idle connections."""
+        while self._idle:
+            self._close(self._idle.pop())
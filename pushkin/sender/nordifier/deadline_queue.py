@@ -0,0 +1,77 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import heapq
+import itertools
+import time
+
+from pushkin.util.statistics import SharedStatistics
+
+STATISTICS = SharedStatistics('sender_deadlines', ['queued_high', 'queued_normal', 'dropped_expired', 'pending'])
+
+HIGH_PRIORITY = 'high'
+
+
+def delivery_priority(notification):
+    return notification.get('priority')
+
+
+class DeadlineQueue():
+    """
+    Notifications waiting to be sent, high priority ones first, then earliest deadline (time_to_live_ts_bigint) first.
+    Priority of a notification is returned by lane_of(notification), its delivery priority by default.
+
+    Expired notifications are at the head of their lane, so they are removed in bulk without looking at the rest.
+    Number of notifications in each lane is published in statistics when notifications are popped.
+    """
+
+    STATISTICS_NAMES = ['pending_high', 'pending_normal']
+
+    def __init__(self, lane_of=delivery_priority, statistics=None):
+        self.lane_of = lane_of
+        self.statistics = statistics
+        self._high = []
+        self._normal = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._high) + len(self._normal)
+
+    def push(self, notification):
+        if self.lane_of(notification) == HIGH_PRIORITY:
+            lane = self._high
+            STATISTICS.increment('queued_high')
+        else:
+            lane = self._normal
+            STATISTICS.increment('queued_normal')
+        heapq.heappush(lane, (notification['time_to_live_ts_bigint'], next(self._counter), notification))
+
+    def pop_expired(self):
+        """Removes and returns notifications which expired."""
+        now = int(round(time.time() * 1000))
+        expired = []
+        for lane in (self._high, self._normal):
+            while lane and lane[0][0] <= now:
+                expired.append(heapq.heappop(lane)[2])
+        if expired:
+            STATISTICS.increment('dropped_expired', len(expired))
+        return expired
+
+    def pop(self, max_count):
+        """Removes and returns up to max_count notifications which should be sent first."""
+        notifications = []
+        for lane in (self._high, self._normal):
+            while lane and len(notifications) < max_count:
+                notifications.append(heapq.heappop(lane)[2])
+        STATISTICS.set_gauge('pending', len(self))
+        if self.statistics is not None:
+            self.statistics.set_gauge('pending_high', len(self._high))
+            self.statistics.set_gauge('pending_normal', len(self._normal))
+        return notifications
@@ -16,6 +16,8 @@ from collections import defaultdict
 import time
 import random
 
+from connection_pool import ConnectionPoolException
+
 GCM_URL = 'https://android.googleapis.com/gcm/send'
 
 
@@ -103,13 +105,15 @@ class GCM(object):
     BACKOFF_INITIAL_DELAY = 1000;
     MAX_BACKOFF_DELAY = 1024000;
 
-    def __init__(self, api_key, url=GCM_URL, proxy=None):
+    def __init__(self, api_key, url=GCM_URL, proxy=None, connection_pool=None):
         """ api_key : google api key
             url: url of gcm service.
             proxy: can be string "http://host:port" or dict {'https':'host:port'}
+            connection_pool: HTTPConnectionPool for url, requests are sent through urllib2 if not given
         """
         self.api_key = api_key
         self.url = url
+        self.connection_pool = connection_pool
         if proxy:
             if isinstance(proxy, basestring):
                 protocol = url.split(':')[0]
@@ -183,28 +187,40 @@ class GCM(object):
 
         if not is_json:
             data = urlencode_utf8(data)
-        req = urllib2.Request(self.url, data, headers)
-
-        try:
-            response = urllib2.urlopen(req).read()
-        except urllib2.HTTPError as e:
-            if e.code == 400:
-                raise GCMMalformedJsonException("The request could not be parsed as JSON")
-            elif e.code == 401:
-                raise GCMAuthenticationException("There was an error authenticating the nordifier account")
-            elif e.code == 503:
-                raise GCMUnavailableException("GCM service is unavailable")
-            else:
-                error = "GCM service error: %d" % e.code
-                raise GCMUnavailableException(error)
-        except urllib2.URLError as e:
-            raise GCMConnectionException(
-                "There was an internal error in the GCM server while trying to process the request")
+
+        if self.connection_pool is not None:
+            try:
+                status, response = self.connection_pool.request('POST', data, headers)
+            except ConnectionPoolException:
+                raise GCMConnectionException(
+                    "There was an internal error in the GCM server while trying to process the request")
+            if status != 200:
+                self.raise_http_error(status)
+        else:
+            req = urllib2.Request(self.url, data, headers)
+            try:
+                response = urllib2.urlopen(req).read()
+            except urllib2.HTTPError as e:
+                self.raise_http_error(e.code)
+            except urllib2.URLError as e:
+                raise GCMConnectionException(
+                    "There was an internal error in the GCM server while trying to process the request")
 
         if is_json:
             response = json.loads(response)
         return response
 
+    def raise_http_error(self, code):
+        if code == 400:
+            raise GCMMalformedJsonException("The request could not be parsed as JSON")
+        elif code == 401:
+            raise GCMAuthenticationException("There was an error authenticating the nordifier account")
+        elif code == 503:
+            raise GCMUnavailableException("GCM service is unavailable")
+        else:
+            error = "GCM service error: %d" % code
+            raise GCMUnavailableException(error)
+
     def raise_error(self, error):
         if error == 'InvalidRegistration':
             raise GCMInvalidRegistrationException("Registration ID is invalid")
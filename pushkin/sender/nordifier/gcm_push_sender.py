@@ -11,12 +11,18 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 import time
 import json
 import random
+from collections import OrderedDict
 from pushkin import context
 
 from sender import Sender
 import constants as const
 from gcm import GCM, GCMException, GCMConnectionException, GCMUnavailableException
-from gcm import GCMMissingRegistrationException, GCMTooManyRegIdsException
+from gcm import GCMMissingRegistrationException, GCMTooManyRegIdsException, GCM_URL
+from connection_pool import HTTPConnectionPool
+from retry_policy import GCM_RETRY_POLICY
+from pushkin.util.statistics import SharedStatistics
+
+CONNECTION_STATISTICS = SharedStatistics('gcm_connections', HTTPConnectionPool.STATISTICS_NAMES)
 
 
 class GCM2(GCM):
@@ -67,19 +73,19 @@ class GCM2(GCM):
 
         attempt = 0
         backoff = self.BACKOFF_INITIAL_DELAY
+        info = {}
         for attempt in range(retries):
             payload = self.construct_payload(
                 registration_ids, data, collapse_key,
                 delay_while_idle, time_to_live, True, dry_run, priority=priority
             )
             response = self.make_request(payload, is_json=True)
-            info = self.handle_json_response(response, registration_ids)
+            attempt_info = self.handle_json_response(response, registration_ids)
 
-            unsent_reg_ids = self.extract_unsent_reg_ids(info)
+            unsent_reg_ids = self.merge_attempt_info(info, attempt_info, attempt == retries - 1)
             if unsent_reg_ids:
                 registration_ids = unsent_reg_ids
-                sleep_time = backoff / 2 + random.randrange(backoff)
-                time.sleep(float(sleep_time) / 1000)
+                time.sleep(self.backoff_sleep_seconds(backoff))
                 if 2 * backoff < self.MAX_BACKOFF_DELAY:
                     backoff *= 2
             else:
@@ -87,21 +93,52 @@ class GCM2(GCM):
 
         return info
 
+    def merge_attempt_info(self, info, attempt_info, is_last_attempt):
+        """
+        Adds results of an attempt to info of a request, returns registration ids which should be sent again.
+
+        Results of ids which are not sent again are final.
+        """
+        unsent_reg_ids = self.extract_unsent_reg_ids(attempt_info)
+        is_last_attempt = is_last_attempt or not unsent_reg_ids
+        for error, reg_ids in attempt_info.get('errors', {}).items():
+            if error != 'Unavailable' or is_last_attempt:
+                info.setdefault('errors', {}).setdefault(error, []).extend(reg_ids)
+        if 'canonical' in attempt_info:
+            info.setdefault('canonical', {}).update(attempt_info['canonical'])
+        return unsent_reg_ids if not is_last_attempt else []
+
+    def backoff_sleep_seconds(self, backoff):
+        return float(backoff / 2 + random.randrange(backoff)) / 1000
+
 
 class GCMPushSender(Sender):
     """
     GCM Push Sender uses python-gcm module: https://github.com/geeknam/python-gcm
     GCM documentation: https://developer.android.com/google/gcm/gcm.html
     """
+    MAX_REGISTRATION_IDS = 1000
 
     def __init__(self, config, log):
         Sender.__init__(self, config, log)
+        self.batch_size = self.get_optional_int(config, 'gcm_batch_size', self.MAX_REGISTRATION_IDS)
+        self.linger_seconds = self.get_optional_float(config, 'gcm_linger_ms', 10.0) / 1000
         self.access_key = config.get('Messenger', 'gcm_access_key')
         self.base_deeplink_url = config.get('Messenger', 'base_deeplink_url')
-        self.gcm = GCM2(self.access_key)
+        connection_pool = HTTPConnectionPool(GCM_URL,
+                                             size=self.get_optional_int(config, 'gcm_connection_pool_size', 1),
+                                             idle_timeout=self.get_optional_int(config, 'gcm_connection_idle_timeout', 60),
+                                             timeout=self.get_optional_int(config, 'gcm_connection_timeout', 10),
+                                             statistics=CONNECTION_STATISTICS)
+        self.gcm = GCM2(self.access_key, connection_pool=connection_pool)
+        self.retry_policy = GCM_RETRY_POLICY
         self.canonical_ids = []
         self.unregistered_devices = []
 
+    def warm_up(self):
+        if self.gcm.connection_pool is not None:
+            self.gcm.connection_pool.warm_up()
+
     def pop_canonical_ids(self):
         items = self.canonical_ids
         self.canonical_ids = []
@@ -113,95 +150,142 @@ class GCMPushSender(Sender):
         return items
 
     def send(self, notification):
-        expiry_seconds = (notification['time_to_live_ts_bigint'] - int(round(time.time() * 1000))) / 1000
-        if expiry_seconds < 0:
-            self.log.warning(
-                'GCM: expired notification with sending_id: {0}; expiry_seconds: {1}'.format(notification['sending_id'],
-                                                                                             expiry_seconds))
-            notification['status'] = const.NOTIFICATION_EXPIRED
-            return
-
-        utm_source = 'pushnotification'
-        utm_campaign = str(notification['campaign_id'])
-        utm_medium = str(notification['message_id'])
-        data = {
-            'title': notification['title'],
-            'message': notification['content'],
-            'url': self.base_deeplink_url + '://' + notification[
-                'screen'] + '?utm_source=' + utm_source + '&utm_campaign=' + utm_campaign + '&utm_medium=' + utm_medium,
-            'notifid': notification['campaign_id'],
-        }
+        self.send_notifications([notification])
+
+    def send_batch(self):
+        notifications = self.queue
+        self.queue = []
+        self.send_notifications(notifications)
 
+    def send_notifications(self, notifications):
+        for notifications_by_reg_id, data, expiry_seconds, priority, dry_run in self.group_notifications(notifications):
+            self.send_multicast(notifications_by_reg_id, data, expiry_seconds, priority, dry_run)
+
+    def group_notifications(self, notifications):
+        """
+        Groups notifications with identical data, time to live, priority and dry run setting into multicasts of at most
+        MAX_REGISTRATION_IDS registration ids. Returns a list of (notifications_by_reg_id, data, expiry_seconds,
+        priority, dry_run) tuples, expired notifications are left out.
+        """
+        groups = OrderedDict()
+        now = int(round(time.time() * 1000))
+        for notification in notifications:
+            expiry_seconds = (notification['time_to_live_ts_bigint'] - now) / 1000
+            if expiry_seconds < 0:
+                self.log.warning(
+                    'GCM: expired notification with sending_id: {0}; expiry_seconds: {1}'.format(notification['sending_id'],
+                                                                                                 expiry_seconds))
+                notification['status'] = const.NOTIFICATION_EXPIRED
+                continue
+
+            utm_source = 'pushnotification'
+            utm_campaign = str(notification['campaign_id'])
+            utm_medium = str(notification['message_id'])
+            data = {
+                'title': notification['title'],
+                'message': notification['content'],
+                'url': self.base_deeplink_url + '://' + notification[
+                    'screen'] + '?utm_source=' + utm_source + '&utm_campaign=' + utm_campaign + '&utm_medium=' + utm_medium,
+                'notifid': notification['campaign_id'],
+            }
+            dry_run = 'dry_run' in notification and notification['dry_run'] == True
+            key = (tuple(sorted(data.items())), expiry_seconds, notification['priority'], dry_run)
+            if key not in groups:
+                groups[key] = (data, [])
+            groups[key][1].append(notification)
+
+        multicasts = []
+        for (_, expiry_seconds, priority, dry_run), (data, group) in groups.items():
+            notifications_by_reg_id = OrderedDict()
+            for notification in group:
+                notifications_by_reg_id.setdefault(notification['receiver_id'], []).append(notification)
+            reg_ids = notifications_by_reg_id.keys()
+            for i in range(0, len(reg_ids), self.MAX_REGISTRATION_IDS):
+                chunk = OrderedDict((reg_id, notifications_by_reg_id[reg_id])
+                                    for reg_id in reg_ids[i:i + self.MAX_REGISTRATION_IDS])
+                multicasts.append((chunk, data, expiry_seconds, priority, dry_run))
+        return multicasts
+
+    def send_multicast(self, notifications_by_reg_id, data, expiry_seconds, priority, dry_run):
+        """
+        Sends data in a single request to all registration ids and sets status of their notifications.
+
+        Failed notifications are scheduled for retry according to GCM retry policy.
+        """
         try:
-            for i in range(self.connection_error_retries):
-                try:
-                    dry_run = 'dry_run' in notification and notification['dry_run'] == True
-                    response = self.gcm.json_request(
-                        registration_ids=[notification['receiver_id']],
-                        data=data,
-                        time_to_live=expiry_seconds,
-                        retries=self.connection_error_retries,
-                        dry_run=dry_run,
-                        priority=notification['priority']
-                    )
-                    if 'errors' in response:
-                        # Initially it's a Fatal Error, unless we determine exact error
-                        notification['status'] = const.NOTIFICATION_GCM_FATAL_ERROR
-                        for error, reg_id_array in response['errors'].items():
-                            if len(reg_id_array) == 1:
-                                reg_id = reg_id_array[0]
-
-                                if error == 'InvalidRegistration':
-                                    notification['status'] = const.NOTIFICATION_GCM_INVALID_REGISTRATION_ID
-                                    self.log.warning('GCM InvalidRegistration for notification: {0}'.format(
-                                        notification))
-
-                                if error == 'NotRegistered':
-                                    notification['status'] = const.NOTIFICATION_GCM_DEVICE_UNREGISTERED
-                                    unregistered_data = {
-                                        'login_id': notification['login_id'],
-                                        'device_token': notification['receiver_id'],
-                                    }
-                                    self.unregistered_devices.append(unregistered_data)
-
-                        if notification['status'] == const.NOTIFICATION_GCM_FATAL_ERROR:
-                            self.log.debug(
-                                'Undefined fatal error, notification: {0}, response: {1}'.format(notification,
-                                                                                                 response))
-                    else:
-                        notification['status'] = const.NOTIFICATION_SUCCESS
-
-                    # If we got canonical id, that means that the notification is successfully sent,
-                    # but we should use a new registration (canonical) id in future
-                    if 'canonical' in response:
-                        self.log.debug('GCM Canonical response: {0}'.format(response))
-
-                        for reg_id, canonical_id in response['canonical'].items():
-                            canonical = {
-                                'login_id': notification['login_id'],
-                                'old_token': reg_id,
-                                'new_token': canonical_id
-                            }
-                            self.canonical_ids.append(canonical)
-
-                    break
-                except GCMConnectionException as e:
-                    notification['status'] = const.NOTIFICATION_CONNECTION_ERROR
-                    self.log.warning('GCM Connection error, failed in {0}th attempt'.format((i + 1)))
-                    if (i + 1) < self.connection_error_retries:
-                        delay = 1 + (i * 2)
-                        time.sleep(delay)
-                except GCMUnavailableException as e:
-                    notification['status'] = const.NOTIFICATION_GCM_UNAVAILABLE
-                    self.log.warning('GCM is unavailable, failed in {0}th attempt'.format((i + 1)))
-                    if (i + 1) < self.connection_error_retries:
-                        delay = 5 + (i * 2)
-                        time.sleep(delay)
+            response = self.gcm.json_request(
+                registration_ids=notifications_by_reg_id.keys(),
+                data=data,
+                time_to_live=expiry_seconds,
+                retries=1,
+                dry_run=dry_run,
+                priority=priority
+            )
+            self.handle_response(notifications_by_reg_id, response)
         except GCMException as e:
-            notification['status'] = const.NOTIFICATION_GCM_FATAL_ERROR
-            self.log.error('GCM Exception: "{0}"; while sending notification: {1}'.format(e, notification))
-
-    def send_batch(self):
-        while len(self.queue):
-            self.send(self.queue.pop())
-    
+            self.handle_error(notifications_by_reg_id, e)
+
+    def handle_response(self, notifications_by_reg_id, response):
+        """Sets status of notifications from a json_request response."""
+        for reg_notifications in notifications_by_reg_id.values():
+            for notification in reg_notifications:
+                notification['status'] = const.NOTIFICATION_SUCCESS
+
+        for error, reg_id_array in response.get('errors', {}).items():
+            for reg_id in reg_id_array:
+                for notification in notifications_by_reg_id.get(reg_id, []):
+                    # Initially it's a Fatal Error, unless we determine exact error
+                    notification['status'] = const.NOTIFICATION_GCM_FATAL_ERROR
+
+                    if error == 'InvalidRegistration':
+                        notification['status'] = const.NOTIFICATION_GCM_INVALID_REGISTRATION_ID
+                        self.log.warning('GCM InvalidRegistration for notification: {0}'.format(
+                            notification))
+
+                    if error == 'NotRegistered':
+                        notification['status'] = const.NOTIFICATION_GCM_DEVICE_UNREGISTERED
+                        unregistered_data = {
+                            'login_id': notification['login_id'],
+                            'device_token': notification['receiver_id'],
+                        }
+                        self.unregistered_devices.append(unregistered_data)
+
+                    if error == 'Unavailable':
+                        notification['status'] = const.NOTIFICATION_GCM_UNAVAILABLE
+
+                    if notification['status'] == const.NOTIFICATION_GCM_FATAL_ERROR:
+                        self.log.debug(
+                            'Undefined fatal error {0}, notification: {1}'.format(error, notification))
+
+                    self.retry(notification, error)
+
+        # If we got canonical id, that means that the notification is successfully sent,
+        # but we should use a new registration (canonical) id in future
+        if 'canonical' in response:
+            self.log.debug('GCM Canonical response: {0}'.format(response['canonical']))
+
+            for reg_id, canonical_id in response['canonical'].items():
+                for notification in notifications_by_reg_id.get(reg_id, []):
+                    canonical = {
+                        'login_id': notification['login_id'],
+                        'old_token': reg_id,
+                        'new_token': canonical_id
+                    }
+                    self.canonical_ids.append(canonical)
+
+    def handle_error(self, notifications_by_reg_id, e):
+        """Sets status of notifications after a failed request, schedules them for retry if error is not permanent."""
+        if isinstance(e, GCMConnectionException):
+            status = const.NOTIFICATION_CONNECTION_ERROR
+            self.log.warning('GCM Connection error: {0}'.format(e))
+        elif isinstance(e, GCMUnavailableException):
+            status = const.NOTIFICATION_GCM_UNAVAILABLE
+            self.log.warning('GCM is unavailable: {0}'.format(e))
+        else:
+            status = const.NOTIFICATION_GCM_FATAL_ERROR
+            self.log.error('GCM Exception: "{0}"; while sending notifications: {1}'.format(
+                e, [n for reg_notifications in notifications_by_reg_id.values() for n in reg_notifications]))
+        for reg_notifications in notifications_by_reg_id.values():
+            for notification in reg_notifications:
+                notification['status'] = status
+                self.retry(notification, e)
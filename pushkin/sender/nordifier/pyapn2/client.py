@@ -1,11 +1,17 @@
 from json import dumps
 
 import json
+import random
+import socket
 import time
+from collections import deque
+from h2.exceptions import TooManyStreamsError
 from hyper import HTTP20Connection
+from hyper.http20.exceptions import ConnectionError
 from hyper.tls import init_context
 from hyper.http20.connection import StreamResetError
-from errors import exception_class_for_reason
+from errors import exception_class_for_reason, ConnectionLost
+from hyper_connection import is_closed, can_read, read_frames, remote_max_concurrent_streams
 
 
 IMMEDIATE_NOTIFICATION_PRIORITY = 10
@@ -13,23 +19,208 @@ DELAYED_NOTIFICATION_PRIORITY = 5
 
 
 class APNsClient(object):
-    def __init__(self, cert_file, log, use_sandbox=False, use_alternative_port=False, proto=None):
+    STATISTICS_NAMES = ['connects', 'connect_failures', 'reconnects', 'pings', 'open', 'age_seconds']
+    CONNECTION_ERRORS = (StreamResetError, ConnectionError, socket.error)
+    # seconds to wait for SETTINGS frame of APNs after connecting
+    SETTINGS_TIMEOUT = 1
+
+    def __init__(self, cert_file, log, use_sandbox=False, use_alternative_port=False, proto=None, num_connections=1,
+                 max_concurrent_streams=100, ping_interval=60, reconnect_initial_delay=1, reconnect_max_delay=60,
+                 statistics=None):
         self.log = log
         self.server = 'api.development.push.apple.com' if use_sandbox else 'api.push.apple.com'
         self.port = 2197 if use_alternative_port else 443
         self.ssl_context = init_context()
         self.ssl_context.load_cert_chain(cert_file)
         self.proto = proto
-        self.__connection = None
-        self.connect_to_apn_if_needed()
+        self.max_concurrent_streams = max_concurrent_streams
+        self.ping_interval = ping_interval
+        self.reconnect_initial_delay = reconnect_initial_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.statistics = statistics
+        self.__connections = [None] * num_connections
+        self.__connected_at = [None] * num_connections
+        self.__last_used = [0] * num_connections
+        self.__failures = [0] * num_connections
+        self.__reconnect_at = [0] * num_connections
+
+    def _increment(self, name, value=1):
+        if self.statistics is not None:
+            self.statistics.increment(name, value)
+
+    def connect_to_apn_if_needed(self, index=0):
+        """Returns connection, connecting it if needed. None if it is waiting to be reconnected or can't connect."""
+        if self.__connections[index] is not None:
+            return self.__connections[index]
+        now = time.time()
+        if now < self.__reconnect_at[index]:
+            return None
+        connection = HTTP20Connection(self.server, self.port, ssl_context=self.ssl_context,
+                                      force_proto=self.proto or 'h2')
+        try:
+            connection.connect()
+            self.read_settings(connection, self.SETTINGS_TIMEOUT)
+        except self.CONNECTION_ERRORS:
+            self.log.exception("Could not connect to APN")
+            self._increment('connect_failures')
+            self.connection_lost(index)
+            return None
+        if self.__connected_at[index] is not None:
+            self._increment('reconnects')
+        self._increment('connects')
+        self.__connections[index] = connection
+        self.__connected_at[index] = now
+        self.__last_used[index] = now
+        self.__failures[index] = 0
+        return connection
+
+    def connection_lost(self, index):
+        """
+        Drops a connection. It is reconnected right away the first time, then with exponential backoff with jitter
+        while it keeps failing.
+        """
+        connection = self.__connections[index]
+        self.__connections[index] = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        self.__failures[index] += 1
+        if self.__failures[index] == 1:
+            delay = 0
+        else:
+            delay = min(self.reconnect_max_delay, self.reconnect_initial_delay * 2 ** (self.__failures[index] - 2))
+            delay = random.uniform(delay / 2, delay)
+        self.__reconnect_at[index] = time.time() + delay
+
+    def warm_up(self):
+        """Connects all connections."""
+        for i in range(len(self.__connections)):
+            self.connect_to_apn_if_needed(i)
+
+    def maintain_connections(self):
+        """
+        Reconnects lost connections which are due, handles frames received on idle connections, like GOAWAY sent on
+        APNs IdleTimeout, and pings connections idle for ping_interval seconds, so they are kept open.
+        """
+        now = time.time()
+        for i in range(len(self.__connections)):
+            connection = self.__connections[i]
+            if connection is None:
+                self.connect_to_apn_if_needed(i)
+                continue
+            try:
+                if can_read(connection):
+                    read_frames(connection)
+                if is_closed(connection):
+                    # closed by APNs
+                    self.connection_lost(i)
+                    self.connect_to_apn_if_needed(i)
+                elif now - self.__last_used[i] >= self.ping_interval:
+                    connection.ping(b'\0' * 8)
+                    self.__last_used[i] = now
+                    self._increment('pings')
+            except self.CONNECTION_ERRORS:
+                self.log.exception("Connection to APN lost while idle")
+                self.connection_lost(i)
+                self.connect_to_apn_if_needed(i)
+        if self.statistics is not None:
+            connected_at = [t for t, c in zip(self.__connected_at, self.__connections) if c is not None]
+            self.statistics.set_gauge('open', len(connected_at))
+            self.statistics.set_gauge('age_seconds', int(sum(now - t for t in connected_at)))
+
+    def read_settings(self, connection, timeout=0):
+        """
+        Handles frames received on connection until APNs limit of concurrent streams is known, waiting up to timeout
+        seconds for them. Returns False if the limit is not known yet.
+        """
+        deadline = time.time() + timeout
+        while True:
+            if remote_max_concurrent_streams(connection) is not None:
+                return True
+            if can_read(connection):
+                read_frames(connection)
+            elif time.time() >= deadline:
+                return False
+            else:
+                time.sleep(0.01)
 
-    def connect_to_apn_if_needed(self):
-        if self.__connection is None:
-            self.__connection = HTTP20Connection(self.server, self.port, ssl_context=self.ssl_context,
-                                                 force_proto=self.proto or 'h2')
+    def stream_limit(self, connection):
+        """
+        Number of streams which can be in flight on a connection, as allowed by both us and APNs. Until SETTINGS of
+        APNs arrive, it is max_concurrent_streams.
+        """
+        if not self.read_settings(connection):
+            return self.max_concurrent_streams
+        return max(1, min(self.max_concurrent_streams, remote_max_concurrent_streams(connection)))
 
     def send_notification(self, token_hex, notification, priority=IMMEDIATE_NOTIFICATION_PRIORITY, topic=None, expiration=None):
-        json_payload = dumps(notification.dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        results = []
+        self.send_notification_batch([(token_hex, notification, expiration)], lambda i, error: results.append(error),
+                                     priority=priority, topic=topic)
+        if results[0] is not None:
+            raise results[0]
+
+    def send_notification_batch(self, notifications, callback, priority=IMMEDIATE_NOTIFICATION_PRIORITY, topic=None):
+        """
+        Sends notifications over all connections, keeping up to stream limit requests in flight on each of them.
+
+        Expects a list of (token_hex, payload, expiration) tuples. callback(index, error) is called for every
+        notification as soon as its response arrives, error is None if notification was accepted or an APNsException
+        otherwise. When a connection is lost, its requests in flight fail with ConnectionLost and it is not used again
+        during this batch. A connection which refuses new streams while none are in flight is healthy, it is kept, but
+        no more requests are sent on it during this batch. Notifications left when no connection can be used fail too.
+        """
+        pending = deque(enumerate(notifications))
+        in_flight = [deque() for connection in self.__connections]
+        lost = set()
+        refusing = set()
+        while pending or any(in_flight):
+            unusable = lost | set(i for i in refusing if not in_flight[i])
+            if len(unusable) == len(self.__connections):
+                while pending:
+                    callback(pending.popleft()[0], ConnectionLost())
+                break
+            for i in range(len(self.__connections)):
+                if i in lost:
+                    continue
+                connection = self.connect_to_apn_if_needed(i)
+                if connection is None:
+                    lost.add(i)
+                    continue
+                try:
+                    limit = self.stream_limit(connection)
+                    while pending and len(in_flight[i]) < limit and i not in refusing:
+                        index, notification = pending.popleft()
+                        in_flight[i].append((None, index, notification))
+                        try:
+                            stream_id = self.request(connection, notification, priority, topic)
+                        except TooManyStreamsError:
+                            # APNs lowered its limit, rest is sent as responses arrive
+                            in_flight[i].pop()
+                            pending.appendleft((index, notification))
+                            if not in_flight[i]:
+                                refusing.add(i)
+                            break
+                        in_flight[i][-1] = (stream_id, index, notification)
+                    if in_flight[i]:
+                        stream_id, index, notification = in_flight[i][0]
+                        error = self.get_error(connection, stream_id)
+                        in_flight[i].popleft()
+                        callback(index, error)
+                    self.__last_used[i] = time.time()
+                except self.CONNECTION_ERRORS:
+                    # Connection to APN closed, requests in flight are retried by caller
+                    self.log.exception("Connection to APN lost")
+                    while in_flight[i]:
+                        callback(in_flight[i].popleft()[1], ConnectionLost())
+                    self.connection_lost(i)
+                    lost.add(i)
+
+    def request(self, connection, notification, priority, topic):
+        token_hex, payload, expiration = notification
+        json_payload = dumps(payload.dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
         headers = {
             'apns-priority': str(priority)
@@ -41,20 +232,13 @@ class APNsClient(object):
             headers['apns-expiration'] = "%d" % expiration
 
         url = '/3/device/{}'.format(token_hex)
-        sent = False
-        while not sent:
-            try:
-                self.connect_to_apn_if_needed()
-                stream_id = self.__connection.request('POST', url, json_payload, headers)
-                resp = self.__connection.get_response(stream_id)
-                with resp:
-                    if resp.status != 200:
-                        raw_data = resp.read().decode('utf-8')
-                        data = json.loads(raw_data)
-                        raise exception_class_for_reason(data['reason'])
-                sent = True
-            except StreamResetError:
-                # Connection to APN closed, reconnect
-                self.log.exception("Connection to APN lost, reconnecting and trying again")
-                self.__connection = None
-                time.sleep(5)
+        return connection.request('POST', url, json_payload, headers)
+
+    def get_error(self, connection, stream_id):
+        resp = connection.get_response(stream_id)
+        with resp:
+            if resp.status != 200:
+                raw_data = resp.read().decode('utf-8')
+                data = json.loads(raw_data)
+                return exception_class_for_reason(data['reason'])()
+        return None
@@ -2,6 +2,11 @@ class APNsException(Exception):
     pass
 
 
+class ConnectionLost(APNsException):
+    """Connection to APNs was lost before a response was received."""
+    pass
+
+
 class InternalException(APNsException):
     """This exception should not be raised. If it is, please report this as a bug."""
     pass
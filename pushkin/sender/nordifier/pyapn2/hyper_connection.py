@@ -0,0 +1,37 @@
+import hyper
+from h2.settings import SettingCodes
+from hyper import HTTP20Connection
+
+"""
+Access to state of hyper HTTP20Connection which hyper doesn't expose publicly. Internals of hyper are used only here, so
+a different hyper version is refused on import instead of breaking APNs client silently.
+"""
+
+SUPPORTED_HYPER_VERSIONS = ('0.7.',)
+
+if not hyper.__version__.startswith(SUPPORTED_HYPER_VERSIONS) or not hasattr(HTTP20Connection, '_single_read'):
+    raise ImportError("APNs client relies on internals of hyper {supported}, hyper {version} is installed".format(
+        supported=' or '.join(version + 'x' for version in SUPPORTED_HYPER_VERSIONS), version=hyper.__version__))
+
+
+def is_closed(connection):
+    """True if connection was closed, e.g. by GOAWAY of server."""
+    return connection._sock is None
+
+
+def can_read(connection):
+    """True if data received on connection is waiting to be read."""
+    return connection._sock is not None and connection._sock.can_read
+
+
+def read_frames(connection):
+    """Reads and handles frames received on connection, without waiting for a response."""
+    connection._single_read()
+
+
+def remote_max_concurrent_streams(connection):
+    """Limit of concurrent streams sent by server in its SETTINGS frame, None if they haven't been received yet."""
+    with connection._conn as conn:
+        if SettingCodes.MAX_CONCURRENT_STREAMS in conn.remote_settings:
+            return conn.remote_settings.max_concurrent_streams
+    return None
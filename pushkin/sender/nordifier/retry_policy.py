@@ -0,0 +1,75 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+from pushkin.util.statistics import SharedStatistics
+
+import gcm
+from pyapn2 import errors as apns_errors
+
+PERMANENT = 'permanent'
+RETRY = 'retry'
+THROTTLE = 'throttle'
+
+STATISTICS = SharedStatistics('retry_policy', ['apns_permanent', 'apns_retry', 'apns_throttle',
+                                               'gcm_permanent', 'gcm_retry', 'gcm_throttle'])
+
+APNS_POLICY = {
+    apns_errors.ConnectionLost: RETRY,
+    apns_errors.IdleTimeout: RETRY,
+    apns_errors.Shutdown: RETRY,
+    apns_errors.InternalServerError: RETRY,
+    apns_errors.ServiceUnavailable: RETRY,
+    apns_errors.TooManyRequests: THROTTLE,
+    # payload, token, topic and certificate errors, retrying them gives the same result
+    apns_errors.APNsException: PERMANENT,
+}
+
+GCM_POLICY = {
+    # errors of whole requests
+    gcm.GCMConnectionException: RETRY,
+    gcm.GCMUnavailableException: RETRY,
+    gcm.GCMException: PERMANENT,
+    # errors of single registration ids
+    'Unavailable': RETRY,
+    'InternalServerError': RETRY,
+    'DeviceMessageRateExceeded': THROTTLE,
+    'TopicsMessageRateExceeded': THROTTLE,
+}
+
+
+class RetryPolicy():
+    """
+    Classifies errors of a provider as permanent, worth retrying, or worth retrying later because of throttling.
+
+    Errors are either exceptions, classified by the closest class found in policy, or error strings. Anything not
+    found in policy is permanent.
+    """
+
+    def __init__(self, provider, policy):
+        self.provider = provider
+        self.policy = policy
+
+    def classify(self, error):
+        if isinstance(error, Exception):
+            for cls in type(error).__mro__:
+                if cls in self.policy:
+                    return self.policy[cls]
+            return PERMANENT
+        return self.policy.get(error, PERMANENT)
+
+    def record(self, error):
+        """Classifies error and counts it."""
+        classification = self.classify(error)
+        STATISTICS.increment('{}_{}'.format(self.provider, classification))
+        return classification
+
+
+APNS_RETRY_POLICY = RetryPolicy('apns', APNS_POLICY)
+GCM_RETRY_POLICY = RetryPolicy('gcm', GCM_POLICY)
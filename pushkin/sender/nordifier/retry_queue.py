@@ -0,0 +1,83 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import heapq
+import itertools
+import random
+import time
+
+from pushkin.util.statistics import SharedStatistics
+
+STATISTICS = SharedStatistics('sender_retries', ['scheduled', 'retried', 'dropped_exhausted', 'dropped_expired',
+                                                 'delay_ms'])
+
+
+class RetryQueue():
+    """
+    Notifications waiting to be sent again, ordered by time they are due.
+
+    Delay grows exponentially with number of retries of a notification, with random jitter so notifications failed
+    together are not sent again all at once. Notifications which would be due after they expire, or have no retries
+    left, are not scheduled.
+    """
+
+    def __init__(self, max_retries, initial_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self._heap = []
+        self._scheduled = set()
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, notification, min_delay=0):
+        """
+        Schedules notification to be sent again after at least min_delay seconds, returns False if it has no retries
+        or time left.
+        """
+        retries = notification.get('retries', 0)
+        if retries >= self.max_retries:
+            STATISTICS.increment('dropped_exhausted')
+            return False
+        delay = min(self.max_delay, self.initial_delay * 2 ** retries)
+        delay = max(min_delay, random.uniform(delay / 2, delay))
+        due = time.time() + delay
+        if due * 1000 >= notification['time_to_live_ts_bigint']:
+            STATISTICS.increment('dropped_expired')
+            return False
+        notification['retries'] = retries + 1
+        heapq.heappush(self._heap, (due, next(self._counter), notification))
+        self._scheduled.add(id(notification))
+        STATISTICS.increment('scheduled')
+        STATISTICS.increment('delay_ms', int(delay * 1000))
+        return True
+
+    def is_scheduled(self, notification):
+        return id(notification) in self._scheduled
+
+    def next_delay(self):
+        """Seconds until the next notification is due, None if there are none."""
+        if not self._heap:
+            return None
+        return max(0, self._heap[0][0] - time.time())
+
+    def pop_due(self):
+        """Removes and returns notifications which are due."""
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            notification = heapq.heappop(self._heap)[2]
+            self._scheduled.discard(id(notification))
+            due.append(notification)
+        if due:
+            STATISTICS.increment('retried', len(due))
+        return due
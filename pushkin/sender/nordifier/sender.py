@@ -10,25 +10,101 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 '''
 import time
 
+from retry_queue import RetryQueue
+from retry_policy import PERMANENT, THROTTLE
+
 
 class Sender:
+    # seconds between calls to maintain_connections, None if sender has nothing to maintain
+    MAINTENANCE_INTERVAL = None
+
     def __init__(self, config, log):
         self.queue = []
+        self.queue_started = None
+        self.flushed = []
         self.config = config
         self.log = log
 
         self.connection_error_retries = config.getint('Messenger', 'connection_error_retries')
         self.batch_size = 1
+        # seconds a queued notification waits for batch to fill up
+        self.linger_seconds = 0
+        self.retry_queue = RetryQueue(self.connection_error_retries - 1,
+                                      initial_delay=self.get_optional_float(config, 'retry_initial_delay', 1.0),
+                                      max_delay=self.get_optional_float(config, 'retry_max_delay', 60.0))
+        self.retry_throttle_delay = self.get_optional_float(config, 'retry_throttle_delay', 10.0)
+        self.retry_policy = None
+        self.last_maintenance = time.time()
+
+    def get_optional_int(self, config, option, default):
+        if config.has_option('Messenger', option):
+            return config.getint('Messenger', option)
+        return default
+
+    def get_optional_float(self, config, option, default):
+        if config.has_option('Messenger', option):
+            return config.getfloat('Messenger', option)
+        return default
+
+    def retry(self, notification, error):
+        '''
+        Schedules notification which failed with error to be sent again later, according to retry policy of sender.
+        Returns False if error is permanent or notification has no retries or time left.
+        '''
+        classification = self.retry_policy.record(error)
+        if classification == PERMANENT:
+            return False
+        min_delay = self.retry_throttle_delay if classification == THROTTLE else 0
+        return self.retry_queue.schedule(notification, min_delay=min_delay)
+
+    def warm_up(self):
+        '''Called by sender worker on start, before any notification is sent.'''
+        pass
+
+    def maintain_connections(self):
+        '''Called by sender worker every MAINTENANCE_INTERVAL seconds.'''
+        pass
+
+    def maintain_connections_if_due(self):
+        if self.MAINTENANCE_INTERVAL is not None and self.time_to_maintenance() == 0:
+            self.last_maintenance = time.time()
+            self.maintain_connections()
+
+    def time_to_maintenance(self):
+        '''Seconds until maintain_connections should be called, None if never.'''
+        if self.MAINTENANCE_INTERVAL is None:
+            return None
+        return max(0, self.last_maintenance + self.MAINTENANCE_INTERVAL - time.time())
 
     def send_in_batch(self, notification):
+        '''Queues notification, queue is sent once it has batch_size notifications or it lingered for linger_seconds.'''
+        if len(self.queue) == 0:
+            self.queue_started = time.time()
         self.queue.append(notification)
         if len(self.queue) >= self.batch_size:
-            self.send_batch()
+            self.send_remaining()
+
+    def time_to_flush(self):
+        '''Seconds until queued notifications should be sent, None if queue is empty.'''
+        if len(self.queue) == 0:
+            return None
+        return max(0, self.queue_started + self.linger_seconds - time.time())
+
+    def flush_if_due(self):
+        if self.time_to_flush() == 0:
+            self.send_remaining()
 
     def send_remaining(self):
+        self.flushed.extend(self.queue)
         while len(self.queue) > 0:
             self.send_batch()
 
+    def pop_flushed(self):
+        '''Returns notifications sent from queue since last call.'''
+        items = self.flushed
+        self.flushed = []
+        return items
+
     def send(self, notification):
         raise Exception('Not implemented')
 
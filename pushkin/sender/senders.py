@@ -8,36 +8,199 @@ The above copyright notice and this permission notice shall be included in all c
 
 THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 '''
-from Queue import Empty
-from threading import Thread
+from Queue import Empty, Full, Queue
+from threading import Thread, BoundedSemaphore, Lock
+import signal
+import sys
 import time
 import logging
 import multiprocessing
 
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
 from pushkin.database import database
 from pushkin.sender.nordifier.apns_push_sender import APNsPushSender
 from pushkin.sender.nordifier.gcm_push_sender import GCMPushSender
 from pushkin.sender.nordifier.apns2_push_sender import APNS2PushSender
-from pushkin.util.pool import ProcessPool
+from pushkin.sender.nordifier.async_gcm_push_sender import AsyncGCMPushSender
+from pushkin.sender.nordifier.deadline_queue import DeadlineQueue
+from pushkin.sender.spool import Spool
+from pushkin.util.pool import LanedProcessPool
+from pushkin.util.laned_queue import HIGH_PRIORITY, NORMAL_PRIORITY
+from pushkin.util.statistics import SharedStatistics
 from pushkin import config, context
 from pushkin.sender.nordifier import constants
 import timeit
 
 
-class NotificationSender(ProcessPool):
+class NotificationSender(LanedProcessPool):
 
     NUM_WORKERS_DEFAULT = 50
+    SPOOL_DRAIN_INTERVAL = 0.1
 
     def __init__(self, **kwargs):
         num_workers = kwargs.get('workers', self.NUM_WORKERS_DEFAULT)
-        ProcessPool.__init__(self, self.__class__.__name__, num_workers, config.sender_queue_limit)
+        LanedProcessPool.__init__(self, self.__class__.__name__, num_workers, config.sender_queue_limit,
+                                  config.sender_high_priority_queue_limit, config.sender_high_priority_weight)
+        # notifications taken from queue by a worker process, each process has its own after fork, their number is
+        # shared so they are counted in queue size
+        self.pending_statistics = SharedStatistics('pending_' + self.name, DeadlineQueue.STATISTICS_NAMES)
+        self.pending = DeadlineQueue(lane_of=self.lane_of, statistics=self.pending_statistics)
+        self.spool = None
+        if config.sender_spool:
+            self.spool = Spool('{path}.{name}'.format(path=config.sender_spool_path, name=self.name),
+                               config.sender_spool_size,
+                               statistics=SharedStatistics('spool_' + self.name, Spool.STATISTICS_NAMES))
+
+    def lane_of(self, notification):
+        # lane of the batch notification came with, independent of its delivery priority
+        return HIGH_PRIORITY if notification.get('lane') == HIGH_PRIORITY else NORMAL_PRIORITY
+
+    def start(self):
+        LanedProcessPool.start(self)
+        if self.spool is not None:
+            drainer = Thread(target=self.drain_spool, name=self.name + '-spool')
+            drainer.daemon = True
+            drainer.start()
 
     def limit_exceeded(self, notification):
+        if self.spool is not None and self.spool.append(notification):
+            return True
         notification['status'] = constants.NOTIFICATION_SENDER_QUEUE_LIMIT
         self.log_notifications([notification])
+        return False
+
+    def drain_spool(self):
+        '''
+        Moves spooled notifications back to queue, as it frees up. A notification is removed from spool only once it is
+        queued, so it is not lost if the process stops while queue is full.
+        '''
+        while True:
+            notification = self.spool.peek()
+            if notification is None:
+                time.sleep(self.SPOOL_DRAIN_INTERVAL)
+                continue
+            while True:
+                try:
+                    self.task_queue.put(notification, timeout=self.SPOOL_DRAIN_INTERVAL)
+                    self.statistics.increment('submitted')
+                    break
+                except Full:
+                    pass
+            self.spool.commit()
 
     def queue_size(self):
-        return self.task_queue.qsize()
+        return self.task_queue.qsize() + self.lane_pending(HIGH_PRIORITY) + self.lane_pending(NORMAL_PRIORITY)
+
+    def lane_size(self, lane):
+        return LanedProcessPool.lane_size(self, lane) + self.lane_pending(lane)
+
+    def lane_pending(self, lane):
+        """Notifications of lane taken from queue by workers and not sent yet."""
+        return int(self.pending_statistics.get('pending_' + lane))
+
+    def init_worker(self):
+        # workers are terminated with SIGTERM when pushkin stops, exit cleanly so lingering notifications are sent
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def read_queue(self, max_count, timeout=None, linger=0):
+        '''
+        Waits up to timeout seconds (forever if None) for a notification, then takes notifications already queued or
+        arriving within linger seconds, up to max_count in total.
+        '''
+        if max_count <= 0:
+            return []
+        try:
+            if timeout == 0:
+                notifications = [self.task_queue.get_nowait()]
+            else:
+                notifications = [self.task_queue.get(timeout=timeout)]
+        except Empty:
+            return []
+        deadline = time.time() + linger
+        while len(notifications) < max_count:
+            try:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    notifications.append(self.task_queue.get(timeout=remaining))
+                else:
+                    notifications.append(self.task_queue.get_nowait())
+            except Empty:
+                break
+        return notifications
+
+    def get_notifications(self, max_count, timeout=None, linger=0):
+        '''
+        Returns up to max_count notifications, high priority ones first, then ones closest to their deadline. Waits up
+        to timeout seconds (forever if None) if none are pending, and up to linger seconds for more to arrive. Expired
+        notifications are dropped.
+        '''
+        if len(self.pending) < max_count:
+            for notification in self.read_queue(max_count - len(self.pending), timeout if len(self.pending) == 0 else 0,
+                                                linger):
+                self.pending.push(notification)
+        # look ahead at notifications already queued, they may be closer to their deadline
+        for notification in self.read_queue(config.sender_lookahead - len(self.pending), 0):
+            self.pending.push(notification)
+        expired = self.pending.pop_expired()
+        if expired:
+            for notification in expired:
+                notification['status'] = constants.NOTIFICATION_EXPIRED
+            self.log_notifications(expired)
+        return self.pending.pop(max_count)
+
+    def get_notifications_to_send(self, sender):
+        '''
+        Returns retries of sender which are due and queued notifications, waits until there is at least one or until
+        notifications queued in sender should be sent. Connections of sender are maintained meanwhile.
+        '''
+        while True:
+            sender.maintain_connections_if_due()
+            notifications = sender.retry_queue.pop_due()
+            if len(notifications) < sender.batch_size:
+                if notifications:
+                    timeout = 0
+                else:
+                    timeouts = [t for t in (sender.retry_queue.next_delay(), sender.time_to_maintenance(),
+                                            sender.time_to_flush()) if t is not None]
+                    timeout = min(timeouts) if timeouts else None
+                notifications += self.get_notifications(sender.batch_size - len(notifications), timeout)
+            if notifications or sender.time_to_flush() == 0:
+                return notifications
+
+    def run_sender(self, sender, statistics):
+        '''Sends notifications through sender until worker is stopped, then sends notifications it still holds.'''
+        sender.warm_up()
+        try:
+            while True:
+                self.send_notifications_in_batch(sender, self.get_notifications_to_send(sender), statistics)
+        finally:
+            self.send_notifications_in_batch(sender, self.pending.pop(len(self.pending)), statistics, flush=True)
+
+    def send_notifications_in_batch(self, sender, notifications, statistics, flush=False):
+        try:
+            statistics.start()
+            for notification in notifications:
+                sender.send_in_batch(notification)
+            if flush:
+                sender.send_remaining()
+            else:
+                sender.flush_if_due()
+            statistics.stop()
+            self.post_process(sender)
+        except Exception:
+            context.main_logger.exception("{} failed to send notifications".format(self.name))
+        finally:
+            self.log_sent_notifications(sender, sender.pop_flushed())
+
+    def post_process(self, sender):
+        '''Called after notifications are sent, submits results of sending to NotificationPostProcessor.'''
+        pass
+
+    def log_sent_notifications(self, sender, notifications):
+        '''Logs notifications, except ones which will be sent again.'''
+        self.log_notifications([n for n in notifications if not sender.retry_queue.is_scheduled(n)])
 
     def log_notifications(self, notifications):
         main_logger = logging.getLogger(config.main_logger_name)
@@ -56,18 +219,111 @@ class NotificationOperation():
     def __init__(self, operation, data):
         self.operation = operation
         self.data = data
+        self.created = time.time()
+
+class PostProcessingWindow():
+    '''
+    Operations collected by NotificationPostProcessor, merged so every device is updated at most once.
+
+    Canonical ids are applied before unregistered devices, so a device unregistered under its old token is unregistered
+    under the canonical one.
+    '''
+    def __init__(self):
+        self.canonicals = {}
+        self.unregistered_devices = set()
+        self.num_operations = 0
+        self.num_items = 0
+        self.oldest = None
+        # (login_id, new_token) -> (login_id, old_token), for chains of canonicals within a window
+        self._canonical_sources = {}
+
+    def __len__(self):
+        return len(self.canonicals) + len(self.unregistered_devices)
+
+    def add(self, record):
+        if record.operation == NotificationPostProcessor.UPDATE_CANONICALS:
+            for canonical in record.data:
+                self.add_canonical(int(canonical['login_id']), canonical['old_token'], canonical['new_token'])
+        elif record.operation == NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES:
+            for device in record.data:
+                self.add_unregistered_device(int(device['login_id']), device['device_token'])
+        else:
+            context.main_logger.error("NotificationPostProcessor - unknown operation: {operation}".format(operation=record.operation))
+            return
+        self.num_operations += 1
+        if self.oldest is None or record.created < self.oldest:
+            self.oldest = record.created
+
+    def add_canonical(self, login_id, old_token, new_token):
+        self.num_items += 1
+        source = self._canonical_sources.pop((login_id, old_token), (login_id, old_token))
+        self.canonicals[source] = new_token
+        self._canonical_sources[(login_id, new_token)] = source
+
+    def add_unregistered_device(self, login_id, device_token):
+        self.num_items += 1
+        device_token = self.canonicals.get((login_id, device_token), device_token)
+        self.unregistered_devices.add((login_id, device_token))
+
+    def split(self, num_parts):
+        '''Splits window by login id, so changes of a user are always applied by the same worker.'''
+        parts = [PostProcessingWindow() for i in range(num_parts)]
+        for (login_id, old_token), new_token in self.canonicals.items():
+            parts[login_id % num_parts].canonicals[(login_id, old_token)] = new_token
+        for login_id, device_token in self.unregistered_devices:
+            parts[login_id % num_parts].unregistered_devices.add((login_id, device_token))
+        for part in parts:
+            part.oldest = self.oldest
+            # operations are shared among parts by their merged items, so parts add up to the window
+            part.num_operations = self.num_operations * len(part) // len(self) if len(self) > 0 else 0
+        parts[-1].num_operations += self.num_operations - sum(part.num_operations for part in parts)
+        return parts
+
+class PostProcessingWorker(Thread):
+    '''Applies windows of a NotificationPostProcessor to database.'''
+    def __init__(self, post_processor):
+        Thread.__init__(self)
+        self.daemon = True
+        self.post_processor = post_processor
+        # bounded, so collecting of windows stops while database writes are slow
+        self.queue = Queue(config.post_processor_worker_queue_size)
+
+    def run(self):
+        while True:
+            window = self.queue.get()
+            self.post_processor.apply(window)
+            self.post_processor.applied(window)
 
 class NotificationPostProcessor(Thread):
+    '''
+    Applies canonical ids and unregistered devices reported by sender processes to database.
+
+    Operations are collected into windows bounded by number of items and time, merged, and applied with one bulk
+    database call per kind of operation by a configurable number of worker threads.
+    '''
     UPDATE_CANONICALS = 1
     UPDATE_UNREGISTERED_DEVICES = 2
     OPERATION_QUEUE = multiprocessing.Queue()
+    STATISTICS = SharedStatistics('notification_post_processor', ['operations', 'items', 'duplicates', 'windows',
+                                                                  'errors', 'last_window_size', 'lag_ms'])
 
-    def __init__(self):
+    def __init__(self, window_size=None, window_seconds=None, num_workers=None):
         Thread.__init__(self)
         self.daemon = True
+        self.window_size = window_size or config.post_processor_window_size
+        self.window_seconds = window_seconds if window_seconds is not None else config.post_processor_window_seconds
+        self.workers = [PostProcessingWorker(self) for i in range(num_workers or config.post_processor_workers)]
+        # operations of windows handed to workers and not applied yet
+        self.pending_operations = 0
+        self.pending_lock = Lock()
 
     def queue_size(self):
-        return self.OPERATION_QUEUE.qsize()
+        '''Operations not applied yet, queued by senders or waiting in windows of workers.'''
+        return self.OPERATION_QUEUE.qsize() + self.pending_operations
+
+    def applied(self, window):
+        with self.pending_lock:
+            self.pending_operations -= window.num_operations
 
     def update_canonicals(self, canonical_ids):
         database.update_canonicals(canonical_ids)
@@ -75,16 +331,58 @@ class NotificationPostProcessor(Thread):
     def update_unregistered_devices(self, unregistered_devices):
         database.update_unregistered_devices(unregistered_devices)
 
+    def collect_window(self):
+        '''Waits for an operation, then collects operations until window is full or its time runs out.'''
+        window = PostProcessingWindow()
+        window.add(NotificationPostProcessor.OPERATION_QUEUE.get())
+        deadline = time.time() + self.window_seconds
+        while window.num_items < self.window_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                window.add(NotificationPostProcessor.OPERATION_QUEUE.get(timeout=timeout))
+            except Empty:
+                break
+        self.STATISTICS.increment('operations', window.num_operations)
+        self.STATISTICS.increment('items', window.num_items)
+        self.STATISTICS.increment('duplicates', window.num_items - len(window))
+        self.STATISTICS.increment('windows')
+        self.STATISTICS.set_gauge('last_window_size', len(window))
+        return window
+
+    def apply(self, window):
+        try:
+            if len(window.canonicals) > 0:
+                self.update_canonicals([{'login_id': login_id, 'old_token': old_token, 'new_token': new_token}
+                                        for (login_id, old_token), new_token in window.canonicals.items()])
+            if len(window.unregistered_devices) > 0:
+                self.update_unregistered_devices([{'login_id': login_id, 'device_token': device_token}
+                                                  for login_id, device_token in window.unregistered_devices])
+        except:
+            self.STATISTICS.increment('errors')
+            context.main_logger.exception("Exception while post processing notification.")
+        if window.oldest is not None:
+            self.STATISTICS.set_gauge('lag_ms', int((time.time() - window.oldest) * 1000))
+
+    def dispatch_window(self):
+        '''Collects a window and hands its parts to workers, waits while a worker is behind.'''
+        window = self.collect_window()
+        with self.pending_lock:
+            self.pending_operations += window.num_operations
+        for worker, part in zip(self.workers, window.split(len(self.workers))):
+            if len(part) > 0:
+                # operations keep waiting in OPERATION_QUEUE meanwhile
+                worker.queue.put(part)
+            else:
+                self.applied(part)
+
     def run(self):
+        for worker in self.workers:
+            worker.start()
         while True:
             try:
-                record = NotificationPostProcessor.OPERATION_QUEUE.get()
-                if record.operation == NotificationPostProcessor.UPDATE_CANONICALS:
-                    self.update_canonicals(record.data)
-                elif record.operation == NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES:
-                    self.update_unregistered_devices(record.data)
-                else:
-                    context.main_logger.error("NotificationPostProcessor - unknown operation: {operation}".format(operation=record.operation))
+                self.dispatch_window()
             except:
                 context.main_logger.exception("Exception while post processing notification.")
                 pass
@@ -120,20 +418,12 @@ class ApnNotificationSender(NotificationSender):
 
     def process(self):
         sender = APNS2PushSender(config.config, context.main_logger)
-        statistics = NotificationStatistics('APN', context.main_logger)
-        while True:
-            notification = self.task_queue.get()
-            try:
-                statistics.start()
-                sender.send_in_batch(notification)
-                statistics.stop()
-                unregistered_devices = sender.pop_unregistered_devices()
-                if len(unregistered_devices) > 0:
-                    NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES, unregistered_devices))
-            except Exception:
-                context.main_logger.exception("ApnNotificationProcessor failed to send notifications")
-            finally:
-                self.log_notifications([notification])
+        self.run_sender(sender, NotificationStatistics('APN', context.main_logger))
+
+    def post_process(self, sender):
+        unregistered_devices = sender.pop_unregistered_devices()
+        if len(unregistered_devices) > 0:
+            NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES, unregistered_devices))
 
 
 class GcmNotificationSender(NotificationSender):
@@ -143,20 +433,62 @@ class GcmNotificationSender(NotificationSender):
 
     def process(self):
         sender = GCMPushSender(config.config, context.main_logger)
-        statistics = NotificationStatistics('GCM', context.main_logger)
-        while True:
-            notification = self.task_queue.get()
-            try:
-                statistics.start()
-                sender.send_in_batch(notification)
-                statistics.stop()
-                canonical_ids = sender.pop_canonical_ids()
-                if len(canonical_ids) > 0:
-                    NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(NotificationPostProcessor.UPDATE_CANONICALS, canonical_ids))
-                unregistered_devices = sender.pop_unregistered_devices()
-                if len(unregistered_devices) > 0:
-                    NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES, unregistered_devices))
-            except Exception:
-                context.main_logger.exception("GcmNotificationProcessor failed to send notifications")
-            finally:
-                self.log_notifications([notification])
+        self.run_sender(sender, NotificationStatistics('GCM', context.main_logger))
+
+    def post_process(self, sender):
+        canonical_ids = sender.pop_canonical_ids()
+        if len(canonical_ids) > 0:
+            NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(NotificationPostProcessor.UPDATE_CANONICALS, canonical_ids))
+        unregistered_devices = sender.pop_unregistered_devices()
+        if len(unregistered_devices) > 0:
+            NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES, unregistered_devices))
+
+
+class AsyncGcmNotificationSender(GcmNotificationSender):
+    '''
+    GCM sender running an IOLoop in each worker process, so a few processes keep many requests to GCM in flight.
+
+    Besides workers, accepts concurrency: maximum number of batches and of HTTP requests in flight per process.
+    '''
+
+    NUM_WORKERS_DEFAULT = 2
+    CONCURRENCY_DEFAULT = 100
+    RETRY_CHECK_INTERVAL_MS = 100
+
+    def __init__(self, **kwargs):
+        GcmNotificationSender.__init__(self, **kwargs)
+        self.concurrency = kwargs.get('concurrency', self.CONCURRENCY_DEFAULT)
+
+    def process(self):
+        io_loop = IOLoop()
+        io_loop.make_current()
+        sender = AsyncGCMPushSender(config.config, context.main_logger, max_clients=self.concurrency)
+        slots = BoundedSemaphore(self.concurrency)
+
+        def read_notifications():
+            while True:
+                slots.acquire()
+                notifications = self.get_notifications(sender.batch_size, linger=sender.linger_seconds)
+                io_loop.add_callback(self.send_notifications, sender, notifications, slots)
+
+        def send_retries():
+            # retries are kept on IOLoop thread, they are sent when a slot is free
+            while sender.retry_queue.next_delay() == 0 and slots.acquire(False):
+                self.send_notifications(sender, sender.retry_queue.pop_due(), slots)
+
+        reader = Thread(target=read_notifications)
+        reader.daemon = True
+        reader.start()
+        PeriodicCallback(send_retries, self.RETRY_CHECK_INTERVAL_MS).start()
+        io_loop.start()
+
+    @gen.coroutine
+    def send_notifications(self, sender, notifications, slots):
+        try:
+            yield sender.send_notifications_async(notifications)
+            self.post_process(sender)
+        except Exception:
+            context.main_logger.exception("AsyncGcmNotificationSender failed to send notifications")
+        finally:
+            self.log_sent_notifications(sender, notifications)
+            slots.release()
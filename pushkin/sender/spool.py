@@ -0,0 +1,152 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import cPickle
+import mmap
+import multiprocessing
+import os
+import struct
+
+"""Append only spool file, holds notifications which didn't fit in sender queue."""
+
+SPOOL_MAGIC = 'PSP2'
+# magic, read offset, write offset, number of notifications
+SPOOL_HEADER = struct.Struct('=4sqqq')
+# length of pickled notification
+SPOOL_RECORD = struct.Struct('=I')
+
+
+class Spool():
+    """
+    FIFO of notifications kept in a memory mapped file of fixed size.
+
+    Notifications are appended at write offset and popped from read offset, both kept in the file header, so spooled
+    notifications survive a restart of the process. Space of popped notifications is reclaimed when the spool is
+    emptied or when an append doesn't fit at the end of the file.
+
+    Must be created before worker processes are forked. The mapping is shared by forked processes, every operation
+    reads the header under a process shared lock, so notifications may be appended and popped by any of them. A single
+    consumer may take notifications with peek and commit instead of pop, so a notification stays spooled until it is
+    handed over and isn't lost if the consumer dies meanwhile.
+
+    Depth and bytes in statistics are changed by each operation instead of being set, as gauges set by one process
+    would not see notifications spooled or drained by others.
+    """
+
+    STATISTICS_NAMES = ['spooled', 'drained', 'dropped', 'depth', 'bytes']
+
+    def __init__(self, path, size, statistics=None):
+        self.path = path
+        self.statistics = statistics
+        self.lock = multiprocessing.Lock()
+        exists = os.path.exists(path)
+        self._fd = open(path, 'r+b' if exists else 'w+b')
+        if os.path.getsize(path) < size:
+            self._fd.truncate(size)
+        self._map = mmap.mmap(self._fd.fileno(), 0)
+        self.size = len(self._map)
+        magic, read, write, depth = SPOOL_HEADER.unpack_from(self._map, 0)
+        if magic != SPOOL_MAGIC:
+            # new file, or a spool of an older format
+            read = write = SPOOL_HEADER.size
+            depth = 0
+            self._write_header(read, write, depth)
+        self._update_gauges(depth, write - read)
+
+    def _read_header(self):
+        magic, read, write, depth = SPOOL_HEADER.unpack_from(self._map, 0)
+        return read, write, depth
+
+    def _write_header(self, read, write, depth):
+        SPOOL_HEADER.pack_into(self._map, 0, SPOOL_MAGIC, read, write, depth)
+
+    def _update_gauges(self, depth_delta, bytes_delta):
+        if self.statistics is not None:
+            self.statistics.increment('depth', depth_delta)
+            self.statistics.increment('bytes', bytes_delta)
+
+    def _increment(self, name, value=1):
+        if self.statistics is not None:
+            self.statistics.increment(name, value)
+
+    def append(self, notification):
+        """Appends notification, returns False if spool is full."""
+        data = cPickle.dumps(notification, cPickle.HIGHEST_PROTOCOL)
+        length = SPOOL_RECORD.size + len(data)
+        with self.lock:
+            read, write, depth = self._read_header()
+            if write + length > self.size and read > SPOOL_HEADER.size:
+                # move unread notifications to the beginning of the file
+                unread = write - read
+                self._map.move(SPOOL_HEADER.size, read, unread)
+                read = SPOOL_HEADER.size
+                write = read + unread
+                self._write_header(read, write, depth)
+            if write + length > self.size:
+                self._increment('dropped')
+                return False
+            SPOOL_RECORD.pack_into(self._map, write, len(data))
+            self._map[write + SPOOL_RECORD.size:write + length] = data
+            write += length
+            depth += 1
+            self._write_header(read, write, depth)
+            self._increment('spooled')
+            self._update_gauges(1, length)
+            return True
+
+    def _head(self, read):
+        """Returns notification at read offset and length of its record."""
+        length = SPOOL_RECORD.unpack_from(self._map, read)[0]
+        start = read + SPOOL_RECORD.size
+        return cPickle.loads(self._map[start:start + length]), SPOOL_RECORD.size + length
+
+    def _remove_head(self, read, write, depth, length):
+        read += length
+        if read == write:
+            read = write = SPOOL_HEADER.size
+        self._write_header(read, write, depth - 1)
+        self._increment('drained')
+        self._update_gauges(-1, -length)
+
+    def peek(self):
+        """Returns the oldest notification without removing it, None if spool is empty."""
+        with self.lock:
+            read, write, depth = self._read_header()
+            if read == write:
+                return None
+            return self._head(read)[0]
+
+    def commit(self):
+        """Removes the oldest notification, the one returned by last peek."""
+        with self.lock:
+            read, write, depth = self._read_header()
+            if read == write:
+                return
+            self._remove_head(read, write, depth, self._head(read)[1])
+
+    def pop(self):
+        """Removes and returns the oldest notification, None if spool is empty."""
+        with self.lock:
+            read, write, depth = self._read_header()
+            if read == write:
+                return None
+            notification, length = self._head(read)
+            self._remove_head(read, write, depth, length)
+            return notification
+
+    def __len__(self):
+        with self.lock:
+            return self._read_header()[2]
+
+    def close(self):
+        with self.lock:
+            self._map.flush()
+            self._map.close()
+            self._fd.close()
@@ -44,14 +44,14 @@ def prepare_demodata():
     database.add_message(message_name='cooldown_fast', language_id=1, message_title='title en', message_text='text en', cooldown_ts=1, trigger_event_id=1)
 
 
-def assert_db_consistent(dict):
+def assert_db_consistent(pairs):
     """Checks if given data is consistent with database"""
     query = "SELECT * FROM user_message_last_time_sent ORDER BY login_id, message_id"
     db_results = database.execute_query_with_results(query)
-    db_dict = [{str(row[1]): str(row[2])} for row in db_results]
-    assert len(db_dict) == len(dict)
-    for row in db_dict:
-        assert row in dict
+    db_pairs = [(row[1], row[2]) for row in db_results]
+    assert len(db_pairs) == len(pairs)
+    for row in db_pairs:
+        assert row in pairs
 
     return db_results
 
@@ -59,26 +59,26 @@ def assert_db_consistent(dict):
 def test_empty_table_one_user_no_cooldown(setup):
     """Send a message with no cooldown for the first time."""
     user_set = {(1, 1)}
-    result = sorted(database.get_and_update_messages_to_send(user_set), key=lambda x: (x))
-    assert result == [{'1': '1'}]
+    result = sorted(database.get_and_update_messages_to_send(user_set))
+    assert result == [(1, 1)]
     assert_db_consistent(result)
 
 
 def test_empty_table_one_user_cooldown(setup):
     """Send a message with cooldown for the first time."""
     user_set = {(1, 2)}
-    result = sorted(database.get_and_update_messages_to_send(user_set), key=lambda x: (x))
-    assert result == [{'1': '2'}]
+    result = sorted(database.get_and_update_messages_to_send(user_set))
+    assert result == [(1, 2)]
     assert_db_consistent(result)
 
 
 def test_empty_table_two_users(setup):
     """Send messages for 2 users for the first time."""
     user_set = {(2, 1), (3, 2)}
-    result = sorted(database.get_and_update_messages_to_send(user_set), key=lambda x: (x))
+    result = sorted(database.get_and_update_messages_to_send(user_set))
     assert len(result) == 2
     for row in result:
-        assert row in [{'2': '1'}, {'3': '2'}]
+        assert row in [(2, 1), (3, 2)]
 
     assert_db_consistent(result)
 
@@ -87,19 +87,19 @@ def test_cooldown_updates(setup):
     """Test sending after allowed and not allowed cooldown."""
     user_set = {(1, 1), (1, 2), (2, 3)}
 
-    result = sorted(database.get_and_update_messages_to_send(user_set), key=lambda x: (x))
+    result = sorted(database.get_and_update_messages_to_send(user_set))
     db = assert_db_consistent(result)
     timestamp_insert_no_cd = db[0][3]
     timestamp_insert_big_cd = db[1][3]
     timestamp_insert_small_cd = db[2][3]
     assert len(result) == 3
     for row in result:
-        assert row in [{'1': '1'}, {'1': '2'}, {'2': '3'}]
+        assert row in [(1, 1), (1, 2), (2, 3)]
 
     time.sleep(1)
 
-    result = sorted(database.get_and_update_messages_to_send(user_set), key=lambda x: (x))
-    db = assert_db_consistent([{'1': '1'}, {'1': '2'}, {'2': '3'}])
+    result = sorted(database.get_and_update_messages_to_send(user_set))
+    db = assert_db_consistent([(1, 1), (1, 2), (2, 3)])
     timestamp_update_no_cd = db[0][3]
     timestamp_update_big_cd = db[1][3]
     timestamp_update_small_cd = db[2][3]
@@ -110,13 +110,23 @@ def test_cooldown_updates(setup):
 
     assert len(result) == 2
     for row in result:
-        assert row in [{'1': '1'}, {'2': '3'}]
+        assert row in [(1, 1), (2, 3)]
 
 
 def test_duplicate_pairs(setup):
     """Test if duplicates and handled."""
     user_set = {(1, 1), (1, 1)}
 
-    result = sorted(database.get_and_update_messages_to_send(user_set), key=lambda x: (x))
+    result = sorted(database.get_and_update_messages_to_send(user_set))
     assert_db_consistent(result)
-    assert result == [{'1': '1'}]
+    assert result == [(1, 1)]
+
+
+def test_unknown_pairs(setup):
+    """Test that pairs with unknown login or message are not eligible."""
+    user_set = {(1, 1), (100, 1), (1, 100)}
+
+    result = sorted(database.get_and_update_messages_to_send(user_set))
+    assert_db_consistent(result)
+    assert result == [(1, 1)]
+    assert database.get_and_update_messages_to_send(set()) == []
@@ -0,0 +1,127 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import mock
+import os
+import time
+
+import pytest
+
+from pushkin import test_config_ini_path
+from pushkin import context
+from pushkin.request import admission_controller
+from pushkin.request.admission_controller import AdmissionController
+from pushkin.sender.senders import GcmNotificationSender, NotificationPostProcessor, NotificationOperation
+from pushkin.util.laned_queue import HIGH_PRIORITY, NORMAL_PRIORITY
+
+context.setup_configuration(test_config_ini_path)
+
+
+def pool(name, queue_size, queue_limit=100):
+    queue_pool = mock.Mock(spool=None, lane_size=mock.Mock(return_value=queue_size),
+                           lane_limit=mock.Mock(return_value=queue_limit))
+    queue_pool.name = name
+    return queue_pool
+
+
+@pytest.fixture
+def request_processor():
+    request_processor = pool('RequestProcessor', 0)
+    sender = pool('ApnNotificationSender', 0)
+    request_processor.sender_manager.sender_by_name = {'pushkin.sender.senders.ApnNotificationSender': sender}
+    request_processor.sender_manager.notification_post_processor.queue_size.return_value = 0
+    return request_processor
+
+
+def test_admitted_below_low_watermarks(request_processor):
+    controller = AdmissionController(request_processor)
+    request_processor.lane_size.return_value = 60
+    assert max(controller.queue_pressures().values()) == 0
+    assert controller.admit()
+
+
+def test_throttled_between_watermarks(request_processor, mocker):
+    controller = AdmissionController(request_processor)
+    sender = request_processor.sender_manager.sender_by_name.values()[0]
+    sender.lane_size.return_value = 80
+    pressures = controller.queue_pressures()
+    assert pressures['ApnNotificationSender'] == pytest.approx(2 / 3.0)
+    mocker.patch.object(admission_controller.random, 'random', return_value=0.5)
+    assert not controller.admit()
+    admission_controller.random.random.return_value = 0.7
+    assert controller.admit()
+
+
+def test_shed_above_high_watermark_or_spooling(request_processor):
+    controller = AdmissionController(request_processor)
+    request_processor.sender_manager.notification_post_processor.queue_size.return_value = 100000
+    assert not controller.admit()
+
+    request_processor.sender_manager.notification_post_processor.queue_size.return_value = 0
+    sender = request_processor.sender_manager.sender_by_name.values()[0]
+    sender.spool = [{'login_id': 1}]
+    assert controller.queue_pressures()['ApnNotificationSender'] == 1
+    assert not controller.admit()
+    # spooled normal priority overflow doesn't shed high priority batches
+    assert controller.admit(HIGH_PRIORITY)
+
+
+def test_lanes_admitted_separately(request_processor):
+    controller = AdmissionController(request_processor)
+    request_processor.lane_size.side_effect = lambda lane: 100 if lane == NORMAL_PRIORITY else 0
+    assert not controller.admit()
+    assert controller.admit(HIGH_PRIORITY)
+
+
+def test_real_queue_depths(mocker, tmpdir):
+    '''Test that spool, notifications taken ahead by sender workers and post processor windows add pressure.'''
+    mocker.patch('pushkin.context.main_logger')
+    mocker.patch('pushkin.config.sender_queue_limit', 10)
+    mocker.patch('pushkin.config.sender_spool', True)
+    mocker.patch('pushkin.config.sender_spool_path', str(tmpdir.join('spool')))
+    mocker.patch('pushkin.config.post_processor_low_watermark', 0)
+    mocker.patch('pushkin.config.post_processor_high_watermark', 3)
+    sender = GcmNotificationSender(workers=0)
+    post_processor = NotificationPostProcessor(window_size=1, window_seconds=0, num_workers=1)
+    request_processor = pool('RequestProcessor', 0)
+    request_processor.sender_manager.sender_by_name = {'pushkin.sender.senders.GcmNotificationSender': sender}
+    request_processor.sender_manager.notification_post_processor = post_processor
+    controller = AdmissionController(request_processor)
+    assert max(controller.queue_pressures().values()) == 0
+
+    # notifications spooled by a request processor worker
+    pid = os.fork()
+    if pid == 0:
+        try:
+            sender.spool.append({'login_id': 1})
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert controller.queue_pressures()['GcmNotificationSender'] == 1
+    # high priority batches are still admitted
+    assert controller.queue_pressures(HIGH_PRIORITY)['GcmNotificationSender'] == 0
+    assert controller.admit(HIGH_PRIORITY)
+    assert sender.spool.pop() == {'login_id': 1}
+
+    # notifications taken ahead by a sender worker are still queued
+    expiry = int(round((time.time() + 100) * 1000))
+    for login_id in range(10):
+        assert sender.submit({'login_id': login_id, 'priority': 'normal', 'time_to_live_ts_bigint': expiry})
+    sender.get_notifications(1, timeout=1)
+    assert controller.queue_pressures()['GcmNotificationSender'] == 1
+
+    # windows waiting for a post processor worker
+    for login_id in range(3):
+        NotificationPostProcessor.OPERATION_QUEUE.put(NotificationOperation(
+            NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES, [{'login_id': login_id, 'device_token': 'd'}]))
+    for i in range(3):
+        post_processor.dispatch_window()
+    assert post_processor.OPERATION_QUEUE.qsize() == 0
+    assert controller.queue_pressures()['NotificationPostProcessor'] == 1
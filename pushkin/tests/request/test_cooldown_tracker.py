@@ -0,0 +1,113 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import pytest
+
+from pushkin import context
+from pushkin.database import database
+from pushkin.request.cooldown_tracker import CooldownTracker, STATISTICS, current_time_millis
+
+from pushkin import test_config_ini_path
+
+context.setup_configuration(test_config_ini_path)
+
+
+@pytest.fixture
+def mock_log(mocker):
+    mocker.patch("pushkin.context.main_logger")
+
+
+@pytest.fixture
+def setup(mock_log):
+    '''
+    Runs setup before and clean up after a test which use this fixture
+    '''
+    # prepare database for test
+    database.init_db()
+    database.create_database()
+    prepare_demodata()
+
+
+def prepare_demodata():
+    # add some test users
+    database.process_user_login(login_id=1, language_id=1, platform_id=2, device_token='dtoken1', application_version=200)
+    database.process_user_login(login_id=2, language_id=1, platform_id=2, device_token='dtoken2', application_version=200)
+
+    # insert messages with and without cooldown
+    database.add_message(message_name='no_cooldown', language_id=1, message_title='title en', message_text='text en')
+    database.add_message(message_name='cooldown_slow', language_id=1, message_title='title en', message_text='text en',
+                         cooldown_ts=100000)
+    database.add_message(message_name='cooldown_fast', language_id=1, message_title='title en', message_text='text en',
+                         cooldown_ts=1)
+
+
+def get_db_pairs():
+    query = "SELECT login_id, message_id FROM user_message_last_time_sent ORDER BY login_id, message_id"
+    return [(row[0], row[1]) for row in database.execute_query_with_results(query)]
+
+
+def test_cooldown(setup, mocker):
+    """Test that cooldowns are checked in memory and written to database on flush."""
+    tracker = CooldownTracker(size=1000, flush_interval=1)
+    fallback = mocker.spy(database, 'get_and_update_messages_to_send')
+    user_set = {(1, 1), (1, 2), (2, 3)}
+
+    assert sorted(tracker.get_and_update_messages_to_send(user_set)) == [(1, 1), (1, 2), (2, 3)]
+    assert get_db_pairs() == []
+    tracker.flush()
+    assert get_db_pairs() == [(1, 1), (1, 2), (2, 3)]
+
+    mocker.patch('pushkin.request.cooldown_tracker.current_time_millis', return_value=current_time_millis() + 10)
+    assert sorted(tracker.get_and_update_messages_to_send(user_set)) == [(1, 1), (2, 3)]
+    assert fallback.call_count == 0
+
+
+def test_warm_up(setup, mocker):
+    """Test that messages in cooldown are loaded from database on start."""
+    database.get_and_update_messages_to_send({(1, 2), (2, 3)})
+    mocker.patch('pushkin.request.cooldown_tracker.CooldownFlusher')
+    tracker = CooldownTracker(size=1000, flush_interval=1)
+    tracker.start()
+
+    # database keeps whole seconds
+    mocker.patch('pushkin.request.cooldown_tracker.current_time_millis', return_value=current_time_millis() + 1000)
+    assert sorted(tracker.get_and_update_messages_to_send({(1, 2), (2, 3)})) == [(2, 3)]
+
+
+def test_fallback_to_database(setup, mocker):
+    """Test that unknown messages and pairs which don't fit into memory are checked in database."""
+    # logins 1 and 65 share the same single slot
+    database.process_user_login(login_id=65, language_id=1, platform_id=2, device_token='dtoken65',
+                                application_version=200)
+    tracker = CooldownTracker(size=1, flush_interval=1)
+    fallbacks = STATISTICS.get('database_fallbacks')
+
+    assert tracker.get_and_update_messages_to_send({(1, 2)}) == [(1, 2)]
+    assert tracker.get_and_update_messages_to_send({(65, 2)}) == [(65, 2)]
+    assert tracker.get_and_update_messages_to_send({(1, 100)}) == []
+    assert STATISTICS.get('database_fallbacks') - fallbacks == 2
+    assert get_db_pairs() == [(65, 2)]
+
+    # both are still in cooldown
+    assert tracker.get_and_update_messages_to_send({(1, 2), (65, 2)}) == []
+
+
+def test_flush_failure(setup, mocker):
+    """Test that changes are kept when writing to database fails."""
+    tracker = CooldownTracker(size=1000, flush_interval=1)
+    tracker.get_and_update_messages_to_send({(1, 1)})
+    upsert = mocker.patch('pushkin.database.database.upsert_messages_last_time_sent', side_effect=Exception('down'))
+    tracker.flush()
+    assert get_db_pairs() == []
+    upsert.side_effect = None
+    upsert.reset_mock()
+    tracker.flush()
+    assert upsert.call_count == 1
+    assert [row[:2] for row in upsert.call_args[0][0]] == [(1, 1)]
@@ -119,6 +119,46 @@ def test_login_event_same_platform_different_device(setup):
     assert sorted(device_tokens) == [(1, 'str_device_token_1'), (1, 'str_device_token_2')]
 
 
+def test_login_events_in_one_batch(setup, mocker):
+    '''Tests that all logins of a batch are persisted with a single database call'''
+    context.event_handler_manager = EventHandlerManager()
+    process_user_logins = mocker.spy(database, 'process_user_logins')
+    process_user_login = mocker.spy(database, 'process_user_login')
+    event_request = EventRequestBatch([
+        create_batch_with_login_event(user_id=1338, platform_id=1, device_token='str_device_token_1'),
+        create_batch_with_login_event(user_id=1338, platform_id=2, device_token='str_device_token_2'),
+        create_batch_with_login_event(user_id=1339, platform_id=1, device_token='str_device_token_3'),
+        create_batch_with_login_event(user_id=1339, platform_id=1, device_token='str_device_token_3'),
+    ])
+    event_request.process()
+
+    assert process_user_logins.call_count == 1
+    assert process_user_login.call_count == 0
+    assert sorted(database.get_device_tokens(1338)) == [(1, 'str_device_token_1'), (2, 'str_device_token_2')]
+    assert database.get_device_tokens(1339) == [(1, 'str_device_token_3')]
+
+
+def test_login_events_fallback(setup, mocker):
+    '''Tests that logins are persisted one by one if bulk processing fails'''
+    context.event_handler_manager = EventHandlerManager()
+    process_user_logins = database.process_user_logins
+
+    def fail_bulk(logins):
+        if len(logins) > 1:
+            raise Exception('bulk failed')
+        process_user_logins(logins)
+
+    mocker.patch('pushkin.database.database.process_user_logins', side_effect=fail_bulk)
+    event_request = EventRequestBatch([
+        create_batch_with_login_event(user_id=1338, platform_id=1, device_token='str_device_token_1'),
+        create_batch_with_login_event(user_id=1339, platform_id=1, device_token='str_device_token_2'),
+    ])
+    event_request.process()
+
+    assert database.get_device_tokens(1338) == [(1, 'str_device_token_1')]
+    assert database.get_device_tokens(1339) == [(1, 'str_device_token_2')]
+
+
 def test_build_messages_missing_user(setup):
     context.event_handler_manager = EventHandlerManager()
     single_request = EventRequestSingle(5, 1, {}, 1442502890000)
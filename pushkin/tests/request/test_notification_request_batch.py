@@ -12,6 +12,7 @@ import pytest
 from pushkin.request.requests import NotificationRequestSingle
 from pushkin.request.requests import NotificationRequestBatch
 from pushkin.context import config
+from pushkin import context
 from pushkin.database import database
 
 
@@ -74,4 +75,28 @@ def test_notification_proto_empty_screen_process(mocker, mock_log):
     notification = NotificationRequestSingle(1338, "Msg title", "Text of a message.")
     NotificationRequestBatch([notification]).process_single(notification)
     database.get_raw_messages.assert_called_with(1338, "Msg title", "Text of a message.", "", config.game,
-                                                 config.world_id, config.dry_run)
+                                                 config.world_id, config.dry_run, devices=None)
+
+
+def test_notification_batch_single_device_query(mocker, mock_log):
+    '''Test that devices for the whole batch are fetched with one query.'''
+    mocker.patch('pushkin.context.request_processor')
+    mocker.patch('pushkin.database.database.get_device_tokens')
+    mocker.patch('pushkin.database.database.get_device_tokens_batch', return_value={1: [(1, 'token1')], 2: [(2, 'token2')]})
+    notifications = [NotificationRequestSingle(login_id, "Msg title", "Text of a message.") for login_id in [1, 2, 3]]
+    NotificationRequestBatch(notifications).process()
+    database.get_device_tokens_batch.assert_called_once_with([1, 2, 3])
+    assert not database.get_device_tokens.called
+    submitted = [call[0][0] for call in context.request_processor.sender_manager.submit.call_args_list]
+    assert sorted((message['login_id'], message['platform'], message['receiver_id']) for message in submitted) == \
+        [(1, 1, 'token1'), (2, 2, 'token2')]
+
+
+def test_notification_batch_lane(mocker, mock_log):
+    '''Test that notifications carry lane of their batch, while their delivery priority is left as it is.'''
+    mocker.patch('pushkin.database.database.get_raw_messages', return_value=[{'login_id': 1338, 'priority': 'normal'}])
+    mocker.patch('pushkin.context.request_processor')
+    notification = NotificationRequestSingle(1338, "Msg title", "Text of a message.")
+    NotificationRequestBatch([notification], 'high').process_single(notification)
+    context.request_processor.sender_manager.submit.assert_called_once_with(
+        {'login_id': 1338, 'priority': 'normal', 'lane': 'high'})
@@ -0,0 +1,281 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import json
+import socket
+from contextlib import contextmanager
+from threading import Thread
+
+import mock
+import pytest
+from h2.connection import H2Connection
+from h2.exceptions import TooManyStreamsError
+from h2.settings import Settings, SettingCodes
+from hyper import HTTP20Connection
+from hyper.http20.connection import StreamResetError
+
+from pushkin.sender.nordifier.pyapn2 import client
+from pushkin.sender.nordifier.pyapn2.errors import Unregistered, ConnectionLost
+from pushkin.sender.nordifier.pyapn2.payload import Payload
+
+
+class FakeResponse():
+    def __init__(self, status, body=''):
+        self.status = status
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def read(self):
+        return self.body
+
+
+class FakeSocket():
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def can_read(self):
+        return self.connection.unread_settings is not None
+
+
+class FakeConnection():
+    """Records requests, answers them when asked for a response. SETTINGS of server are received on first read."""
+
+    def __init__(self, events, max_concurrent_streams=2, fail_on_response=None, stream_capacity=None):
+        self.events = events
+        self.settings = mock.Mock(remote_settings=Settings(client=False))
+        self.unread_settings = None
+        if max_concurrent_streams is not None:
+            self.unread_settings = {SettingCodes.MAX_CONCURRENT_STREAMS: max_concurrent_streams}
+        self.fail_on_response = fail_on_response
+        # streams server actually accepts, it may lower its limit after sending SETTINGS
+        self.stream_capacity = stream_capacity
+        self.next_stream_id = 1
+        self.tokens = {}
+        self.pings = 0
+        self.closed = False
+        self._sock = FakeSocket(self)
+
+    def _single_read(self):
+        self.settings.remote_settings = Settings(client=False, initial_values=self.unread_settings)
+        self.unread_settings = None
+
+    def connect(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        self._sock = None
+
+    def ping(self, opaque_data):
+        self.pings += 1
+
+    @property
+    @contextmanager
+    def _conn(self):
+        yield self.settings
+
+    def request(self, method, url, body, headers):
+        if self.stream_capacity is not None and len(self.tokens) >= self.stream_capacity:
+            raise TooManyStreamsError()
+        stream_id = self.next_stream_id
+        self.next_stream_id += 2
+        self.tokens[stream_id] = url.rsplit('/', 1)[1]
+        self.events.append(('request', self.tokens[stream_id]))
+        return stream_id
+
+    def get_response(self, stream_id):
+        token = self.tokens.pop(stream_id)
+        if token == self.fail_on_response:
+            self.fail_on_response = None
+            raise StreamResetError("Stream forcefully closed")
+        self.events.append(('response', token))
+        if token.startswith('unregistered'):
+            return FakeResponse(410, json.dumps({'reason': 'Unregistered'}))
+        return FakeResponse(200)
+
+
+@pytest.fixture
+def apns(mocker):
+    mocker.patch.object(client, 'init_context')
+    events = []
+    connections = []
+
+    def connect(*args, **kwargs):
+        connection = FakeConnection(events, fail_on_response='t2' if not connections else None)
+        connections.append(connection)
+        return connection
+
+    mocker.patch.object(client, 'HTTP20Connection', side_effect=connect)
+    apns = client.APNsClient('cert.pem', mock.Mock(), max_concurrent_streams=10, ping_interval=60,
+                             statistics=mock.Mock())
+    return apns, events, connections
+
+
+def test_streams_pipelined(apns):
+    apns, events, connections = apns
+    results = {}
+    notifications = [('t1', Payload(alert='a'), None), ('unregistered1', Payload(alert='b'), None),
+                     ('t3', Payload(alert='c'), None)]
+    apns.send_notification_batch(notifications, lambda index, error: results.update({index: error}))
+    # up to two streams, as advertised by server, are in flight at once
+    assert events == [('request', 't1'), ('request', 'unregistered1'), ('response', 't1'), ('request', 't3'),
+                      ('response', 'unregistered1'), ('response', 't3')]
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], Unregistered)
+
+
+def test_streams_before_settings(apns, mocker):
+    apns, events, connections = apns
+    mocker.patch.object(client.APNsClient, 'SETTINGS_TIMEOUT', 0)
+    mocker.patch.object(client, 'HTTP20Connection', side_effect=lambda *args, **kwargs: FakeConnection(
+        events, max_concurrent_streams=None))
+    results = {}
+    notifications = [('t{}'.format(i), Payload(alert='a'), None) for i in range(3)]
+    apns.send_notification_batch(notifications, lambda index, error: results.update({index: error}))
+    # limit of APNs is not known yet, our own limit of 10 applies
+    assert [event for event, token in events[:3]] == ['request'] * 3
+    assert results == {0: None, 1: None, 2: None}
+
+
+def test_too_many_streams(apns, mocker):
+    apns, events, connections = apns
+    mocker.patch.object(client, 'HTTP20Connection', side_effect=lambda *args, **kwargs: FakeConnection(
+        events, stream_capacity=1))
+    results = {}
+    notifications = [('t{}'.format(i), Payload(alert='a'), None) for i in range(3)]
+    apns.send_notification_batch(notifications, lambda index, error: results.update({index: error}))
+    # stream refused by server is sent once a response arrives
+    assert events == [('request', 't0'), ('response', 't0'), ('request', 't1'), ('response', 't1'),
+                      ('request', 't2'), ('response', 't2')]
+    assert results == {0: None, 1: None, 2: None}
+
+
+def test_too_many_streams_idle_connection(apns, mocker):
+    apns, events, connections = apns
+    mocker.patch.object(client, 'HTTP20Connection', side_effect=lambda *args, **kwargs: FakeConnection(
+        events, stream_capacity=0))
+    results = {}
+    notifications = [('t{}'.format(i), Payload(alert='a'), None) for i in range(2)]
+    apns.send_notification_batch(notifications, lambda index, error: results.update({index: error}))
+    # nothing could be sent in this batch, connection is kept for the next one
+    assert all(isinstance(results[i], ConnectionLost) for i in (0, 1))
+    connection = apns.connect_to_apn_if_needed(0)
+    assert not connection.closed
+    connection.stream_capacity = None
+    results = {}
+    apns.send_notification_batch(notifications, lambda index, error: results.update({index: error}))
+    assert apns.connect_to_apn_if_needed(0) is connection
+    assert results == {0: None, 1: None}
+    apns.statistics.increment.assert_called_once_with('connects', 1)
+
+
+def test_settings_of_real_hyper_connection(apns):
+    '''Test that internals of installed hyper used by client give limit of streams sent by server.'''
+    apns, events, connections = apns
+    server_socket = socket.socket()
+    server_socket.bind(('127.0.0.1', 0))
+    server_socket.listen(1)
+    server = H2Connection(client_side=False)
+    server.local_settings = Settings(client=False, initial_values={SettingCodes.MAX_CONCURRENT_STREAMS: 3})
+
+    def serve():
+        sock, address = server_socket.accept()
+        server.initiate_connection()
+        sock.sendall(server.data_to_send())
+        sock.recv(65535)
+        sock.close()
+
+    thread = Thread(target=serve)
+    thread.start()
+    connection = HTTP20Connection('127.0.0.1', server_socket.getsockname()[1], secure=False)
+    try:
+        assert client.remote_max_concurrent_streams(connection) is None
+        connection.connect()
+        assert apns.read_settings(connection, timeout=1)
+        assert client.remote_max_concurrent_streams(connection) == 3
+        assert apns.stream_limit(connection) == 3
+        assert not client.is_closed(connection)
+    finally:
+        connection.close()
+        thread.join(1)
+        server_socket.close()
+    assert client.is_closed(connection)
+
+
+def test_in_flight_fail_after_reset(apns):
+    apns, events, connections = apns
+    results = {}
+    notifications = [('t1', Payload(alert='a'), None), ('t2', Payload(alert='b'), None),
+                     ('t3', Payload(alert='c'), None), ('t4', Payload(alert='d'), None)]
+    apns.send_notification_batch(notifications, lambda index, error: results.update({index: error}))
+    assert events == [('request', 't1'), ('request', 't2'), ('response', 't1'), ('request', 't3')]
+    assert results[0] is None
+    assert all(isinstance(results[i], ConnectionLost) for i in (1, 2, 3))
+
+    # lost connection is replaced on next use
+    apns.send_notification_batch(notifications[:1], lambda index, error: results.update({index: error}))
+    assert len(connections) == 2
+    assert results[0] is None
+
+
+def test_warm_up_and_ping_idle(apns, mocker):
+    apns, events, connections = apns
+    time_mock = mocker.patch.object(client.time, 'time', return_value=1000.0)
+    apns.warm_up()
+    assert len(connections) == 1
+
+    apns.maintain_connections()
+    assert connections[0].pings == 0
+    time_mock.return_value = 1060.0
+    apns.maintain_connections()
+    assert connections[0].pings == 1
+    apns.statistics.set_gauge.assert_any_call('open', 1)
+    apns.statistics.set_gauge.assert_any_call('age_seconds', 60)
+
+
+def test_reconnect_after_goaway(apns, mocker):
+    apns, events, connections = apns
+    mocker.patch.object(client.time, 'time', return_value=1000.0)
+    apns.warm_up()
+    # APNs closed idle connection
+    connections[0]._sock = None
+    apns.maintain_connections()
+    assert len(connections) == 2
+    assert connections[0].closed
+    apns.statistics.increment.assert_any_call('reconnects', 1)
+
+
+def test_reconnect_backoff(apns, mocker):
+    apns, events, connections = apns
+    time_mock = mocker.patch.object(client.time, 'time', return_value=1000.0)
+    mocker.patch.object(client.random, 'uniform', side_effect=lambda low, high: high)
+    failing = mocker.patch.object(FakeConnection, 'connect',
+                                  side_effect=client.socket.error('refused'))
+    # first failure retries right away, the following ones wait 1, 2, 4... seconds
+    assert apns.connect_to_apn_if_needed(0) is None
+    assert apns.connect_to_apn_if_needed(0) is None
+    assert apns.connect_to_apn_if_needed(0) is None
+    assert failing.call_count == 2
+    time_mock.return_value = 1001.0
+    assert apns.connect_to_apn_if_needed(0) is None
+    assert failing.call_count == 3
+    time_mock.return_value = 1002.5
+    assert apns.connect_to_apn_if_needed(0) is None
+    assert failing.call_count == 3
+
+    failing.side_effect = None
+    time_mock.return_value = 1003.0
+    assert apns.connect_to_apn_if_needed(0) is connections[-1]
@@ -0,0 +1,79 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import json
+import time
+
+import mock
+import pytest
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError
+
+from pushkin import context, config
+from pushkin.sender.nordifier import constants
+from pushkin.sender.nordifier.async_gcm_push_sender import AsyncGCMPushSender
+
+from pushkin import test_config_ini_path
+
+context.setup_configuration(test_config_ini_path)
+
+TIME_TO_LIVE = int(round(time.time() * 1000)) + 3600 * 1000
+
+
+def notification(login_id, receiver_id, message_id=1):
+    return {
+        'login_id': login_id,
+        'receiver_id': receiver_id,
+        'title': 'Title',
+        'content': 'Content {}'.format(message_id),
+        'screen': 'home',
+        'campaign_id': 1,
+        'message_id': message_id,
+        'sending_id': 0,
+        'priority': 'normal',
+        'time_to_live_ts_bigint': TIME_TO_LIVE,
+    }
+
+
+@pytest.mark.gen_test
+def test_multicasts_sent_concurrently():
+    sender = AsyncGCMPushSender(config.config, mock.Mock())
+    requests = []
+
+    def fetch(request):
+        requests.append((json.loads(request.body), Future()))
+        return requests[-1][1]
+
+    sender.gcm.http_client.fetch = fetch
+    notifications = [notification(1, 'r1'), notification(2, 'r2', message_id=2), notification(3, 'r3')]
+    sending = sender.send_notifications_async(notifications)
+    yield gen.moment
+    # both requests are in flight before any response arrives
+    assert sorted(payload['registration_ids'] for payload, future in requests) == [['r1', 'r3'], ['r2']]
+    for payload, future in requests:
+        results = [{'error': 'NotRegistered'} if reg_id == 'r3' else {'message_id': '1'}
+                   for reg_id in payload['registration_ids']]
+        future.set_result(mock.Mock(body=json.dumps({'results': results})))
+    yield sending
+    assert [n['status'] for n in notifications] == [constants.NOTIFICATION_SUCCESS, constants.NOTIFICATION_SUCCESS,
+                                                    constants.NOTIFICATION_GCM_DEVICE_UNREGISTERED]
+    assert sender.pop_unregistered_devices() == [{'login_id': 3, 'device_token': 'r3'}]
+
+
+@pytest.mark.gen_test
+def test_connection_error():
+    sender = AsyncGCMPushSender(config.config, mock.Mock())
+    sender.gcm.http_client.fetch = mock.Mock(side_effect=HTTPError(599))
+    notifications = [notification(1, 'r1')]
+    yield sender.send_notifications_async(notifications)
+    assert sender.gcm.http_client.fetch.call_count == 1
+    assert notifications[0]['status'] == constants.NOTIFICATION_CONNECTION_ERROR
+    assert sender.retry_queue.is_scheduled(notifications[0])
@@ -0,0 +1,74 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import zlib
+
+import pytest
+
+from pushkin.util import body_decoder
+from pushkin.util.body_decoder import BodyDecoder, BodyTooLarge, TruncatedBody
+
+requires_zstandard = pytest.mark.skipif(body_decoder.zstandard is None, reason="zstandard is not installed")
+
+
+def gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def zstd(data):
+    return body_decoder.zstandard.ZstdCompressor().compress(data)
+
+
+def decode(encoding, body, max_size=1000000, chunk_size=1000):
+    decoder = BodyDecoder(encoding, max_size)
+    data = ''.join(decoder.decode(body[i:i + chunk_size]) for i in range(0, len(body), chunk_size))
+    decoder.finish()
+    return data
+
+
+@pytest.mark.parametrize("encoding", ['gzip', pytest.param('zstd', marks=requires_zstandard)])
+def test_decoded_in_chunks(encoding):
+    data = ''.join(chr(i % 251) for i in range(100000))
+    compress = gzip if encoding == 'gzip' else zstd
+    assert decode(encoding, compress(data)) == data
+
+
+@pytest.mark.parametrize("encoding", ['gzip', pytest.param('zstd', marks=requires_zstandard)])
+def test_truncated_rejected(encoding):
+    compress = gzip if encoding == 'gzip' else zstd
+    body = compress('a' * 100000)
+    with pytest.raises(TruncatedBody):
+        decode(encoding, body[:-3])
+    with pytest.raises(Exception):
+        decode(encoding, body + 'trailing')
+
+
+class RecordingDecompressor():
+    def __init__(self, decompressor):
+        self.decompressor = decompressor
+        self.output_size = 0
+
+    def decompress(self, data):
+        output = self.decompressor.decompress(data)
+        self.output_size += len(output)
+        return output
+
+
+@requires_zstandard
+def test_zstd_bomb_capped():
+    body = zstd('\0' * 20000000)
+    decoder = BodyDecoder('zstd', 1000000)
+    decoder._decompressor = RecordingDecompressor(decoder._decompressor)
+    with pytest.raises(BodyTooLarge):
+        # whole bomb in a single chunk
+        decoder.decode(body)
+    # decompression stops within two blocks of the limit
+    assert decoder._decompressor.output_size <= 1000000 + 2 * body_decoder.ZSTD_BLOCK_MAX_SIZE
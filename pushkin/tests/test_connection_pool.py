@@ -0,0 +1,103 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import BaseHTTPServer
+import threading
+import time
+
+import pytest
+
+from pushkin.sender.nordifier.connection_pool import HTTPConnectionPool, ConnectionPoolException
+from pushkin.util.statistics import SharedStatistics
+
+STATISTICS = SharedStatistics('test_connection_pool', HTTPConnectionPool.STATISTICS_NAMES)
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        KeepAliveHandler.received.append(body)
+        if body == 'slow':
+            time.sleep(0.5)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return 'http://127.0.0.1:{}/send'.format(server.server_address[1])
+
+
+def test_connection_reused(server):
+    before = STATISTICS.as_dict()
+    pool = HTTPConnectionPool(url(server), statistics=STATISTICS)
+    for i in range(3):
+        assert pool.request('POST', 'body{}'.format(i)) == (200, 'body{}'.format(i))
+    assert STATISTICS.get('requests') - before['requests'] == 3
+    assert STATISTICS.get('connections') - before['connections'] == 1
+    assert pool._idle[0].requests == 3
+    assert STATISTICS.get('max_requests') >= 3
+    pool.close()
+    # requests per connection are reported once it is closed
+    assert STATISTICS.get('closed') - before['closed'] == 1
+    assert STATISTICS.get('closed_requests') - before['closed_requests'] == 3
+
+
+def test_idle_eviction_and_reconnect(server):
+    before = STATISTICS.as_dict()
+    pool = HTTPConnectionPool(url(server), idle_timeout=0, statistics=STATISTICS)
+    pool.request('POST', 'a')
+    pool.request('POST', 'b')
+    assert STATISTICS.get('idle_evictions') - before['idle_evictions'] == 1
+    assert STATISTICS.get('connections') - before['connections'] == 2
+
+    # connection closed by the other side is replaced by a new one
+    pool.idle_timeout = 60
+    pool._idle[0].connection.sock.close()
+    assert pool.request('POST', 'c') == (200, 'c')
+    assert STATISTICS.get('reconnects') - before['reconnects'] == 1
+    pool.close()
+
+
+def test_connection_refused():
+    pool = HTTPConnectionPool('http://127.0.0.1:1/send')
+    with pytest.raises(ConnectionPoolException):
+        pool.request('POST', 'a')
+
+
+def test_timeout_not_retried(server):
+    before = STATISTICS.as_dict()
+    pool = HTTPConnectionPool(url(server), timeout=0.2, statistics=STATISTICS)
+    pool.request('POST', 'a')
+    # server got the request on a reused connection but answered too late, sending it again would duplicate it
+    with pytest.raises(ConnectionPoolException):
+        pool.request('POST', 'slow')
+    assert KeepAliveHandler.received.count('slow') == 1
+    assert STATISTICS.get('reconnects') - before['reconnects'] == 0
+    pool.close()
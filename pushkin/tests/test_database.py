@@ -10,7 +10,8 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 '''
 import pytest
 from pushkin.database import database
-import datetime, time
+from pushkin.database import device_directory
+import datetime, time, os
 from pushkin import context, config
 
 from pushkin import test_config_ini_path
@@ -33,6 +34,52 @@ def test_devices(setup_database):
     assert sorted(list(database.get_device_tokens(login_id=12345))) == [(1, '123'), (1, '124'), (1, '125')]
 
 
+def test_devices_batch(setup_database):
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='1a', application_version=1007)
+    database.process_user_login(login_id=1, language_id=7, platform_id=2, device_token='1b', application_version=1007)
+    database.process_user_login(login_id=2, language_id=7, platform_id=1, device_token='2a', application_version=1007)
+    database.process_user_login(login_id=3, language_id=7, platform_id=1, device_token='3a', application_version=1007)
+    database.update_unregistered_devices([{'login_id': 3, 'device_token': '3a'}])
+    devices = database.get_device_tokens_batch([1, 2, 3, 4, 1])
+    assert devices == {1: [(1, '1a'), (2, '1b')], 2: [(1, '2a')]}
+    for login_id in [1, 2, 3, 4]:
+        assert devices.get(login_id, []) == database.get_device_tokens(login_id)
+    assert database.get_device_tokens_batch([]) == {}
+
+
+def test_deviceless_login_cache(setup_database, mocker):
+    """Test that logins without devices are not queried again until a device is registered"""
+    assert database.get_device_tokens(login_id=1) == []
+    assert database.get_device_tokens_batch([2, 3]) == {}
+
+    session_scope = mocker.spy(database, 'session_scope')
+    hits_before = database.DEVICELESS_LOGIN_STATISTICS.get('hits')
+    assert database.get_device_tokens(login_id=1) == []
+    assert database.get_device_tokens(login_id=2) == []
+    assert database.get_device_tokens_batch([1, 3]) == {}
+    assert session_scope.call_count == 0
+    assert database.DEVICELESS_LOGIN_STATISTICS.get('hits') - hits_before == 4
+
+    # registering a device is seen immediately, both by single and batch lookups
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='d1', application_version=1007)
+    database.process_user_logins([{'login_id': 2, 'language_id': 7, 'platform_id': 1, 'device_token': 'd2',
+                                   'application_version': 1007}])
+    database.upsert_login(3, 7)
+    database.upsert_device(login_id=3, platform_id=1, device_token='d3', application_version=1007)
+    assert database.get_device_tokens(login_id=1) == [(1, 'd1')]
+    assert database.get_device_tokens_batch([2, 3]) == {2: [(1, 'd2')], 3: [(1, 'd3')]}
+
+    # login without a device token does not register a device
+    database.process_user_login(login_id=4, language_id=7, platform_id=1, device_token=None, application_version=1007)
+    assert database.get_device_tokens(login_id=4) == []
+
+    # expired entries are checked again
+    session_scope.reset_mock()
+    mocker.patch('pushkin.util.cache.time.time', return_value=time.time() + config.deviceless_login_cache_ttl + 1)
+    database.get_device_tokens(login_id=4)
+    assert session_scope.call_count == 1
+
+
 def test_message(setup_database):
     # user using serbian language
     database.process_user_login(login_id=12345, language_id=7, platform_id=1, device_token='123',
@@ -80,6 +127,42 @@ def test_message(setup_database):
     database.delete_message(message_1.message)
     assert database.get_message('test') is None
 
+def test_localization_cache(setup_database, mocker):
+    """Test that localizations and user languages are served from cache and refreshed on change"""
+    database.process_user_login(login_id=12345, language_id=7, platform_id=1, device_token='123',
+                                application_version=1007)
+    message = database.add_message(message_name='test', language_id=1, message_title='title en',
+                                   message_text='text en')
+    assert database.get_localized_message(login_id=12345, message_id=message.message_id).language_id == 1
+
+    statistics_before = database.LOCALIZATION_STATISTICS.as_dict()
+    session_scope = mocker.spy(database, 'session_scope')
+    for i in range(3):
+        localized_message = database.get_localized_message(login_id=12345, message_id=message.message_id)
+        assert localized_message.message_title == 'title en'
+    assert session_scope.call_count == 0
+    statistics = database.LOCALIZATION_STATISTICS.as_dict()
+    assert statistics['hits'] - statistics_before['hits'] == 3
+    assert statistics['misses'] == statistics_before['misses']
+    assert statistics['login_language_hits'] - statistics_before['login_language_hits'] == 3
+
+    # changing a localization invalidates the cache
+    database.upsert_message_localization(message_name='test', language_id=1, message_title='title en 2',
+                                         message_text='text en 2')
+    assert database.get_localized_message(login_id=12345, message_id=message.message_id).message_title == 'title en 2'
+
+    # changing language of a user is seen immediately
+    database.add_message(message_name='test', language_id=3, message_title='title 3', message_text='text 3')
+    database.process_user_logins([{'login_id': 12345, 'language_id': '3', 'platform_id': 1, 'device_token': '123',
+                                   'application_version': 1007}])
+    assert database.get_localized_message(login_id=12345, message_id=message.message_id).language_id == 3
+
+    # expired localizations are reloaded
+    mocker.patch('pushkin.config.localization_cache_ttl', 0)
+    misses_before = database.LOCALIZATION_STATISTICS.get('misses')
+    database.get_localized_message(login_id=12345, message_id=message.message_id)
+    assert database.LOCALIZATION_STATISTICS.get('misses') == misses_before + 1
+
 def test_message_blacklist(setup_database):
     login = database.upsert_login(12345, 7)
     blacklist = database.upsert_message_blacklist(12345, [7])
@@ -203,6 +286,75 @@ def test_max_users_per_device_on_update_canocicals(setup_database):
     assert sorted(list(database.get_device_tokens(login_id=20))) == []
     assert sorted(list(database.get_device_tokens(login_id=21))) == [(1, 'd20new')]
 
+def test_update_canonicals_batch(setup_database):
+    """Test that a batch of canonicals is applied as a whole"""
+    config.max_users_per_device = 1
+    database.update_canonicals([])
+    database.process_user_login(login_id=30, language_id=7, platform_id=1, device_token='d30', application_version=1007)
+    database.process_user_login(login_id=31, language_id=7, platform_id=1, device_token='d31', application_version=1007)
+    database.process_user_login(login_id=32, language_id=7, platform_id=1, device_token='d32', application_version=1007)
+    database.update_canonicals([
+        {'login_id': 30, 'old_token': 'd30', 'new_token': 'd30new'},
+        {'login_id': 30, 'old_token': 'd30', 'new_token': 'd30new'},
+        {'login_id': 31, 'old_token': 'd31', 'new_token': 'd32'},
+        {'login_id': 32, 'old_token': 'unknown', 'new_token': 'd32new'},
+    ])
+    assert sorted(list(database.get_device_tokens(login_id=30))) == [(1, 'd30new')]
+    assert len(database.get_device_tokens(login_id=31)) + len(database.get_device_tokens(login_id=32)) == 1
+
+def test_process_user_logins(setup_database):
+    """Test that bulk login processing matches processing logins one by one"""
+    database.process_user_logins([])
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='d1', application_version=1007)
+    database.update_canonicals([{'login_id': 1, 'old_token': 'd1', 'new_token': 'd1new'}])
+    database.process_user_logins([
+        {'login_id': 1, 'language_id': 7, 'platform_id': 1, 'device_token': 'd1', 'application_version': 1008},
+        {'login_id': 2, 'language_id': None, 'platform_id': '2', 'device_token': 'd2', 'application_version': '1007'},
+        {'login_id': 2, 'language_id': 1, 'platform_id': 2, 'device_token': 'd2', 'application_version': 1008},
+        {'login_id': 3, 'language_id': 7, 'platform_id': 1, 'device_token': None, 'application_version': 1007},
+    ])
+    assert list(database.get_device_tokens(login_id=1)) == [(1, 'd1new')]
+    assert list(database.get_device_tokens(login_id=2)) == [(2, 'd2')]
+    assert list(database.get_device_tokens(login_id=3)) == []
+    assert database.get_login(2).language_id == 1
+    assert database.get_login(3).language_id == 7
+    assert [device.application_version for device in database.get_devices(database.get_login(1))] == [1008]
+
+def test_process_user_logins_limits(setup_database, mocker):
+    """Test that bulk login processing keeps max devices per user and max users per device"""
+    mocker.patch('pushkin.config.max_devices_per_user', 2)
+    mocker.patch('pushkin.config.max_users_per_device', 1)
+    database.process_user_logins([
+        {'login_id': 1, 'language_id': 7, 'platform_id': 1, 'device_token': 'd1', 'application_version': 1007},
+        {'login_id': 1, 'language_id': 7, 'platform_id': 1, 'device_token': 'd2', 'application_version': 1007},
+        {'login_id': 1, 'language_id': 7, 'platform_id': 1, 'device_token': 'd3', 'application_version': 1007},
+        {'login_id': 2, 'language_id': 7, 'platform_id': 1, 'device_token': 'd3', 'application_version': 1007},
+        {'login_id': 3, 'language_id': 7, 'platform_id': 2, 'device_token': 'd3', 'application_version': 1007},
+    ])
+    assert sorted(list(database.get_device_tokens(login_id=1))) == [(1, 'd2')]
+    assert sorted(list(database.get_device_tokens(login_id=2))) == [(1, 'd3')]
+    assert sorted(list(database.get_device_tokens(login_id=3))) == [(2, 'd3')]
+
+def test_process_user_logins_reassigns_device_in_order(setup_database, mocker):
+    """Test that a device changing hands within a batch ends with the same user as when logins are processed in order"""
+    mocker.patch('pushkin.config.max_users_per_device', 1)
+    logins = [
+        {'login_id': 2, 'language_id': 7, 'platform_id': 1, 'device_token': 'T', 'application_version': 1007},
+        {'login_id': 1, 'language_id': 7, 'platform_id': 1, 'device_token': 'T', 'application_version': 1007},
+    ]
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='T', application_version=1007)
+    for login in logins:
+        database.process_user_login(**login)
+    sequential = [list(database.get_device_tokens(login_id=login_id)) for login_id in (1, 2)]
+    assert sequential == [[(1, 'T')], []]
+
+    database.clear_caches()
+    for login_id in (1, 2):
+        database.delete_login(database.get_login(login_id))
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='T', application_version=1007)
+    database.process_user_logins(logins)
+    assert [list(database.get_device_tokens(login_id=login_id)) for login_id in (1, 2)] == sequential
+
 def test_ttl(setup_database):
     user_id = 12345
     event_ts_bigint = int(round(time.time() * 1000))
@@ -357,6 +509,7 @@ def test_multiple_devices_with_same_token(setup_database):
     database.upsert_device(login_id=login.id, platform_id=1, device_token='new', application_version=1000)
 
     assert sorted(list(database.get_device_tokens(login_id=login.id))) == [(1, 'new'), (2, 'new')]
+    assert database.get_device_tokens_batch([login.id]) == {login.id: [(1, 'new'), (2, 'new')]}
     
 def test_device_filter(setup_database):
     '''Test that device from device filter is used if specified in event.'''
@@ -378,5 +531,136 @@ def test_device_filter(setup_database):
     assert raw_messages[0]['platform'] == 6
     assert raw_messages[0]['receiver_id'] == '789'
 
+def test_connection_pool(setup_database):
+    '''Test that connections are pooled and pool statistics are collected.'''
+    assert database.ENGINE.pool.size() == config.db_pool_size
+    checkouts = database.POOL_STATISTICS.get('checkouts')
+    with database.session_scope() as session:
+        session.execute('SELECT 1')
+        assert database.POOL_STATISTICS.get('checked_out') == 1
+    assert database.POOL_STATISTICS.get('checked_out') == 0
+    assert database.POOL_STATISTICS.get('checkouts') == checkouts + 1
+
+    # raw queries use the same pool
+    assert database.execute_query_with_results('SELECT 1')[0][0] == 1
+    assert database.POOL_STATISTICS.get('checkouts') == checkouts + 2
+    assert database.ENGINE.pool.checkedin() >= 1
+
+
+def test_connection_pool_after_fork(setup_database, mocker):
+    '''Test that a forked process does not reuse engine of its parent.'''
+    engine = database.ENGINE
+    database.init_db()
+    assert database.ENGINE is engine
+    mocker.patch('os.getpid', return_value=database.ENGINE_PID + 1)
+    database.init_db()
+    assert database.ENGINE is not engine
 
 
+@pytest.fixture
+def enabled_device_directory(setup_database, mocker, tmpdir):
+    mocker.patch('pushkin.config.device_directory', True)
+    mocker.patch('pushkin.config.device_directory_path', str(tmpdir.join('devices')))
+    mocker.patch('pushkin.config.device_directory_delta_log_size', 256)
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='d1', application_version=1007)
+    database.process_user_login(login_id=2, language_id=7, platform_id=2, device_token='d2',
+                                application_version=1007)
+    database.init_device_directory()
+    yield database.DEVICE_DIRECTORY
+    database.DEVICE_DIRECTORY = None
+
+def test_device_directory(enabled_device_directory, mocker):
+    '''Test that device directory follows device changes without querying database on lookup.'''
+    session_scope = mocker.spy(database, 'session_scope')
+    assert database.get_device_tokens(1) == [(1, 'd1')]
+    assert database.get_device_tokens(2) == [(2, 'd2')]
+    assert database.get_device_tokens(3) == []
+    assert database.get_device_tokens_batch([1, 2, 3]) == {1: [(1, 'd1')], 2: [(2, 'd2')]}
+    assert session_scope.call_count == 0
+
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='d1b', application_version=1007)
+    database.process_user_login(login_id=3, language_id=7, platform_id=1, device_token='d3', application_version=1007)
+    assert database.get_device_tokens(1) == [(1, 'd1'), (1, 'd1b')]
+    assert database.get_device_tokens(3) == [(1, 'd3')]
+
+    database.update_unregistered_devices([{'login_id': 1, 'device_token': 'd1'}])
+    assert database.get_device_tokens(1) == [(1, 'd1b')]
+
+    # canonical token already used by another user keeps only one of them, max_users_per_device is 1
+    database.update_canonicals([{'login_id': 1, 'old_token': 'd1b', 'new_token': 'd3'}])
+    assert database.get_device_tokens(1) == []
+    assert database.get_device_tokens(3) == [(1, 'd3')]
+    assert database.query_device_tokens([1, 3]) == {3: [(1, 'd3')]}
+
+    # login on a device of another user removes it from that user
+    database.process_user_login(login_id=4, language_id=7, platform_id=2, device_token='d2',
+                                application_version=1007)
+    assert database.get_device_tokens(2) == []
+    assert database.get_device_tokens(4) == [(2, 'd2')]
+
+    database.delete_login(database.get_login(4))
+    assert database.get_device_tokens(4) == []
+
+def test_device_directory_rebuild(enabled_device_directory):
+    '''Test that snapshot is rebuilt when delta log fills up.'''
+    rebuilds = device_directory.STATISTICS.get('rebuilds')
+    for login_id in range(10, 40):
+        database.process_user_login(login_id=login_id, language_id=7, platform_id=1,
+                                    device_token='token{}'.format(login_id), application_version=1007)
+    assert device_directory.STATISTICS.get('rebuilds') > rebuilds
+    for login_id in range(10, 40):
+        assert database.get_device_tokens(login_id) == [(1, 'token{}'.format(login_id))]
+    assert database.get_device_tokens(1) == [(1, 'd1')]
+
+def test_device_directory_rebuild_not_blocking(enabled_device_directory, mocker):
+    '''Test that lookups and publishing go on while snapshot is built and deltas published meanwhile are kept.'''
+    build = enabled_device_directory.build
+
+    def build_with_changes(rows, version):
+        assert database.get_device_tokens(1) == [(1, 'd1')]
+        database.process_user_login(login_id=6, language_id=7, platform_id=1, device_token='d6',
+                                    application_version=1007)
+        build(rows, version)
+
+    mocker.patch.object(enabled_device_directory, 'build', side_effect=build_with_changes)
+    database.rebuild_device_directory()
+    assert enabled_device_directory.build.call_count == 1
+    assert database.get_device_tokens(6) == [(1, 'd6')]
+    assert database.get_device_tokens(1) == [(1, 'd1')]
+
+def test_device_directory_publish_out_of_order(enabled_device_directory, mocker):
+    '''Test that devices are read without a directory lock and an older delta appended late doesn't win.'''
+    query_device_tokens = database.query_device_tokens
+
+    def query_then_change(login_ids):
+        devices_by_login = query_device_tokens(login_ids)
+        if 1 in login_ids and database.query_device_tokens.call_count == 1:
+            # another writer changes and publishes the same login meanwhile
+            database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='d1c',
+                                        application_version=1007)
+        return devices_by_login
+
+    mocker.patch.object(database, 'query_device_tokens', side_effect=query_then_change)
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='d1b', application_version=1007)
+    assert database.query_device_tokens.call_count == 2
+    assert database.get_device_tokens(1) == [(1, 'd1'), (1, 'd1b'), (1, 'd1c')]
+
+    # rows read before a rebuild don't override the new snapshot
+    version = enabled_device_directory.next_version()
+    database.rebuild_device_directory()
+    assert enabled_device_directory.append({1: []}, version)
+    assert database.get_device_tokens(1) == [(1, 'd1'), (1, 'd1b'), (1, 'd1c')]
+
+def test_device_directory_shared(enabled_device_directory):
+    '''Test that device changes made in a forked process are seen by its parent.'''
+    assert database.get_device_tokens(5) == []
+    pid = os.fork()
+    if pid == 0:
+        try:
+            database.init_db()
+            database.process_user_login(login_id=5, language_id=7, platform_id=1, device_token='d5',
+                                        application_version=1007)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert database.get_device_tokens(5) == [(1, 'd5')]
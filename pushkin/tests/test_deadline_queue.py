@@ -0,0 +1,75 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import time
+
+from pushkin import context
+from pushkin import test_config_ini_path
+from pushkin.sender.nordifier.deadline_queue import DeadlineQueue
+from pushkin.sender.senders import GcmNotificationSender
+
+context.setup_configuration(test_config_ini_path)
+
+
+def notification(login_id, expires_in_seconds, priority='normal'):
+    return {
+        'login_id': login_id,
+        'priority': priority,
+        'time_to_live_ts_bigint': int(round((time.time() + expires_in_seconds) * 1000)),
+    }
+
+
+def test_high_priority_then_earliest_deadline():
+    queue = DeadlineQueue()
+    for n in [notification(1, 300), notification(2, 100), notification(3, 200, priority='high'),
+              notification(4, 400, priority='high'), notification(5, 100)]:
+        queue.push(n)
+    assert [n['login_id'] for n in queue.pop(3)] == [3, 4, 2]
+    assert [n['login_id'] for n in queue.pop(3)] == [5, 1]
+    assert len(queue) == 0
+
+
+def test_expired_dropped():
+    queue = DeadlineQueue()
+    for n in [notification(1, 100), notification(2, -10), notification(3, -5, priority='high'),
+              notification(4, -1), notification(5, 10, priority='high')]:
+        queue.push(n)
+    assert sorted(n['login_id'] for n in queue.pop_expired()) == [2, 3, 4]
+    assert queue.pop_expired() == []
+    assert [n['login_id'] for n in queue.pop(10)] == [5, 1]
+
+
+def test_pending_counted_in_sender_queue_size(mocker):
+    mocker.patch('pushkin.context.main_logger')
+    sender = GcmNotificationSender(workers=0)
+    for login_id in range(3):
+        assert sender.submit(notification(login_id, 100))
+    assert [n['login_id'] for n in sender.get_notifications(1, timeout=1)] == [0]
+    # rest was taken ahead by this worker, it is still waiting to be sent
+    assert len(sender.pending) == 2
+    assert sender.queue_size() == 2
+    assert sender.lane_size('normal') == 2
+    assert sender.lane_size('high') == 0
+
+
+def test_sender_lane_of_batch(mocker):
+    '''Test that sender lanes follow lane of the batch, not delivery priority of notifications.'''
+    mocker.patch('pushkin.context.main_logger')
+    sender = GcmNotificationSender(workers=0)
+    urgent = notification(1, 100, priority='high')
+    batched = notification(2, 200)
+    batched['lane'] = 'high'
+    assert sender.submit(urgent)
+    assert sender.submit(batched)
+    assert sender.lane_size('high') == 1
+    assert sender.lane_size('normal') == 1
+    assert [n['login_id'] for n in sender.get_notifications(1, timeout=1)] == [2]
+    assert sender.lane_size('high') == 0
+    assert sender.lane_size('normal') == 1
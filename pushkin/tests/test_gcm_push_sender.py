@@ -0,0 +1,137 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import json
+import time
+
+import mock
+
+from pushkin import context, config
+from pushkin.sender.nordifier import constants
+from pushkin.sender.nordifier.gcm import GCMConnectionException
+from pushkin.sender.nordifier.gcm_push_sender import GCMPushSender
+
+from pushkin import test_config_ini_path
+
+context.setup_configuration(test_config_ini_path)
+
+# same time to live for all notifications, so ones with same content are grouped together
+TIME_TO_LIVE = int(round(time.time() * 1000)) + 3600 * 1000
+
+
+def notification(login_id, receiver_id, message_id=1):
+    return {
+        'login_id': login_id,
+        'receiver_id': receiver_id,
+        'title': 'Title',
+        'content': 'Content {}'.format(message_id),
+        'screen': 'home',
+        'campaign_id': 1,
+        'message_id': message_id,
+        'sending_id': 0,
+        'priority': 'normal',
+        'time_to_live_ts_bigint': TIME_TO_LIVE,
+    }
+
+
+def results(payload, result_by_reg_id):
+    return {'results': [result_by_reg_id.get(reg_id, {'message_id': '1'}) for reg_id in payload['registration_ids']]}
+
+
+def test_multicast():
+    sender = GCMPushSender(config.config, mock.Mock())
+    payloads = []
+
+    def make_request(payload, is_json=True):
+        payload = json.loads(payload)
+        payloads.append(payload)
+        return results(payload, {
+            'r2': {'error': 'NotRegistered'},
+            'r3': {'error': 'InvalidRegistration'},
+            'r4': {'message_id': '1', 'registration_id': 'r4new'},
+        })
+
+    sender.gcm.make_request = make_request
+    notifications = [notification(1, 'r1'), notification(2, 'r2'), notification(3, 'r3'), notification(4, 'r4'),
+                     notification(5, 'r1'), notification(6, 'r6', message_id=2)]
+    for n in notifications:
+        sender.send_in_batch(n)
+    sender.send_remaining()
+
+    assert sorted(payload['registration_ids'] for payload in payloads) == [['r1', 'r2', 'r3', 'r4'], ['r6']]
+    assert [n['status'] for n in notifications] == [
+        constants.NOTIFICATION_SUCCESS,
+        constants.NOTIFICATION_GCM_DEVICE_UNREGISTERED,
+        constants.NOTIFICATION_GCM_INVALID_REGISTRATION_ID,
+        constants.NOTIFICATION_SUCCESS,
+        constants.NOTIFICATION_SUCCESS,
+        constants.NOTIFICATION_SUCCESS,
+    ]
+    assert sender.pop_unregistered_devices() == [{'login_id': 2, 'device_token': 'r2'}]
+    assert sender.pop_canonical_ids() == [{'login_id': 4, 'old_token': 'r4', 'new_token': 'r4new'}]
+
+
+def test_multicast_retries_unavailable():
+    sender = GCMPushSender(config.config, mock.Mock())
+    payloads = []
+
+    def make_request(payload, is_json=True):
+        payload = json.loads(payload)
+        payloads.append(payload)
+        if len(payloads) == 1:
+            return results(payload, {'r1': {'error': 'Unavailable'}, 'r2': {'error': 'NotRegistered'}})
+        return results(payload, {})
+
+    sender.gcm.make_request = make_request
+    notifications = [notification(1, 'r1'), notification(2, 'r2')]
+    sender.send_notifications(notifications)
+
+    assert [payload['registration_ids'] for payload in payloads] == [['r1', 'r2']]
+    assert [n['status'] for n in notifications] == [constants.NOTIFICATION_GCM_UNAVAILABLE,
+                                                    constants.NOTIFICATION_GCM_DEVICE_UNREGISTERED]
+    assert sender.retry_queue.is_scheduled(notifications[0])
+    assert not sender.retry_queue.is_scheduled(notifications[1])
+
+
+def test_connection_error_retried():
+    sender = GCMPushSender(config.config, mock.Mock())
+    sender.gcm.make_request = mock.Mock(side_effect=GCMConnectionException('refused'))
+    sender.retry_queue.initial_delay = 0
+    notifications = [notification(1, 'r1')]
+    for attempt in range(sender.connection_error_retries):
+        sender.send_notifications(notifications)
+        assert notifications[0]['status'] == constants.NOTIFICATION_CONNECTION_ERROR
+        is_last_attempt = attempt == sender.connection_error_retries - 1
+        assert sender.retry_queue.pop_due() == ([] if is_last_attempt else notifications)
+    assert sender.gcm.make_request.call_count == sender.connection_error_retries
+
+
+def test_linger(mocker):
+    sender = GCMPushSender(config.config, mock.Mock())
+    sender.batch_size = 3
+    sender.linger_seconds = 0.5
+    send_notifications = mocker.patch.object(sender, 'send_notifications')
+    time_mock = mocker.patch('pushkin.sender.nordifier.sender.time.time', return_value=1000.0)
+
+    # queued notifications wait until batch fills up or linger time passes
+    sender.send_in_batch(notification(1, 'r1'))
+    sender.flush_if_due()
+    assert not send_notifications.called
+    assert sender.time_to_flush() == 0.5
+    time_mock.return_value = 1000.5
+    sender.flush_if_due()
+    assert send_notifications.call_count == 1
+    assert [n['login_id'] for n in sender.pop_flushed()] == [1]
+    assert sender.time_to_flush() is None
+
+    for login_id in range(2, 5):
+        sender.send_in_batch(notification(login_id, 'r{}'.format(login_id)))
+    assert send_notifications.call_count == 2
+    assert [n['login_id'] for n in sender.pop_flushed()] == [2, 3, 4]
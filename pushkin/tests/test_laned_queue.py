@@ -0,0 +1,78 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+from Queue import Empty, Full
+from threading import Timer
+
+import pytest
+
+from pushkin.util.laned_queue import LanedQueue, HIGH_PRIORITY, NORMAL_PRIORITY
+from pushkin.util.statistics import SharedStatistics
+
+STATISTICS = SharedStatistics('lanes_test', LanedQueue.STATISTICS_NAMES)
+
+
+def lane_of(item):
+    return HIGH_PRIORITY if item.startswith('h') else NORMAL_PRIORITY
+
+
+def take_all(queue):
+    items = []
+    while True:
+        try:
+            items.append(queue.get(timeout=1))
+        except Empty:
+            return items
+
+
+def test_weighted_dequeue():
+    queue = LanedQueue({HIGH_PRIORITY: 100, NORMAL_PRIORITY: 100}, 2, lane_of)
+    for i in range(3):
+        queue.put_nowait('n{}'.format(i))
+    for i in range(5):
+        queue.put_nowait('h{}'.format(i))
+    assert queue.qsize() == 8
+    # two high priority items for each normal one, while both lanes have items
+    assert take_all(queue) == ['h0', 'h1', 'n0', 'h2', 'h3', 'n1', 'h4', 'n2']
+    with pytest.raises(Empty):
+        queue.get_nowait()
+
+
+def test_lane_limits():
+    queue = LanedQueue({HIGH_PRIORITY: 1, NORMAL_PRIORITY: 2}, 4, lane_of, statistics=STATISTICS)
+    queue.put_nowait('n0')
+    queue.put_nowait('n1')
+    with pytest.raises(Full):
+        queue.put_nowait('n2')
+    # full normal lane doesn't block high priority items
+    queue.put_nowait('h0')
+    with pytest.raises(Full):
+        queue.put('h1', timeout=0.01)
+    assert queue.lane_size(HIGH_PRIORITY) == 1
+    assert queue.lane_size(NORMAL_PRIORITY) == 2
+    assert take_all(queue) == ['h0', 'n0', 'n1']
+    assert STATISTICS.get('normal_submitted') == 2
+    assert STATISTICS.get('normal_rejected') == 1
+    assert STATISTICS.get('high_submitted') == 1
+    assert STATISTICS.get('high_rejected') == 1
+    assert STATISTICS.get('high_taken') == 1
+    assert STATISTICS.get('normal_taken') == 2
+
+
+def test_waits_for_item_in_flight(mocker):
+    '''Test that consumer waits for an item still on its way to its lane instead of polling lanes.'''
+    queue = LanedQueue({HIGH_PRIORITY: 100, NORMAL_PRIORITY: 100}, 2, lane_of)
+    lane = queue._lanes[NORMAL_PRIORITY]
+    mocker.spy(lane, 'qsize')
+    # item is counted, but reaches its lane later
+    queue._items.release()
+    Timer(0.3, lane.put, ['n0']).start()
+    assert queue.get(timeout=1) == 'n0'
+    assert lane.qsize.call_count < 20
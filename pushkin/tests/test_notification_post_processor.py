@@ -0,0 +1,113 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+from threading import Thread
+import time
+
+import pytest
+
+from pushkin import context
+from pushkin.database import database
+from pushkin.sender.senders import NotificationPostProcessor, NotificationOperation, PostProcessingWindow
+
+from pushkin import test_config_ini_path
+
+context.setup_configuration(test_config_ini_path)
+
+
+@pytest.fixture
+def setup_database():
+    database.init_db()
+    database.create_database()
+
+
+def canonicals(*items):
+    return NotificationOperation(NotificationPostProcessor.UPDATE_CANONICALS,
+                                 [{'login_id': l, 'old_token': o, 'new_token': n} for l, o, n in items])
+
+
+def unregistered(*items):
+    return NotificationOperation(NotificationPostProcessor.UPDATE_UNREGISTERED_DEVICES,
+                                 [{'login_id': l, 'device_token': t} for l, t in items])
+
+
+def test_window_merges_operations():
+    window = PostProcessingWindow()
+    window.add(canonicals((1, 'a', 'b')))
+    window.add(canonicals((1, 'a', 'b'), (2, 'c', 'd')))
+    window.add(canonicals((1, 'b', 'e')))
+    window.add(unregistered((2, 'c'), (3, 'f')))
+    window.add(unregistered((3, 'f')))
+    assert window.num_operations == 5
+    assert window.num_items == 7
+    assert window.canonicals == {(1, 'a'): 'e', (2, 'c'): 'd'}
+    assert window.unregistered_devices == {(2, 'd'), (3, 'f')}
+    assert len(window) == 4
+
+
+def test_window_split_by_login():
+    window = PostProcessingWindow()
+    window.add(canonicals((1, 'a', 'b'), (2, 'c', 'd')))
+    window.add(unregistered((3, 'f'), (5, 'g')))
+    first, second = window.split(2)
+    assert first.canonicals == {(2, 'c'): 'd'}
+    assert first.unregistered_devices == set()
+    assert second.canonicals == {(1, 'a'): 'b'}
+    assert second.unregistered_devices == {(3, 'f'), (5, 'g')}
+
+
+def test_collect_and_apply_window(setup_database, mocker):
+    mocker.patch('pushkin.context.main_logger')
+    database.process_user_login(login_id=1, language_id=7, platform_id=1, device_token='a', application_version=1007)
+    database.process_user_login(login_id=2, language_id=7, platform_id=1, device_token='c', application_version=1007)
+    post_processor = NotificationPostProcessor(window_size=4, window_seconds=1, num_workers=1)
+    NotificationPostProcessor.OPERATION_QUEUE.put(canonicals((1, 'a', 'b')))
+    NotificationPostProcessor.OPERATION_QUEUE.put(unregistered((2, 'c')))
+    NotificationPostProcessor.OPERATION_QUEUE.put(unregistered((2, 'c')))
+    NotificationPostProcessor.OPERATION_QUEUE.put(canonicals((1, 'b', 'e')))
+    NotificationPostProcessor.OPERATION_QUEUE.put(unregistered((1, 'e')))
+    window = post_processor.collect_window()
+    assert window.num_operations == 4
+    post_processor.apply(window)
+    assert list(database.get_device_tokens(login_id=1)) == [(1, 'e')]
+    assert list(database.get_device_tokens(login_id=2)) == []
+    window = post_processor.collect_window()
+    assert window.num_operations == 1
+    post_processor.apply(window)
+    assert list(database.get_device_tokens(login_id=1)) == []
+
+
+def test_worker_queue_bounded_and_counted(mocker):
+    mocker.patch('pushkin.config.post_processor_worker_queue_size', 1)
+    post_processor = NotificationPostProcessor(window_size=1, window_seconds=0, num_workers=1)
+    worker = post_processor.workers[0]
+    mocker.patch.object(post_processor, 'apply')
+    for login_id in range(3):
+        NotificationPostProcessor.OPERATION_QUEUE.put(canonicals((login_id, 'a', 'b')))
+    post_processor.dispatch_window()
+    assert post_processor.queue_size() == 3
+
+    # worker is behind, second window waits for its queue
+    dispatcher = Thread(target=post_processor.dispatch_window)
+    dispatcher.daemon = True
+    dispatcher.start()
+    time.sleep(0.2)
+    assert dispatcher.is_alive()
+    assert post_processor.queue_size() == 3
+
+    worker.start()
+    dispatcher.join(1)
+    assert not dispatcher.is_alive()
+    deadline = time.time() + 1
+    while post_processor.queue_size() > 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert post_processor.queue_size() == 1
+    assert post_processor.apply.call_count == 2
+    post_processor.collect_window()
@@ -0,0 +1,66 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+from pushkin.util import pool
+from pushkin.util.laned_queue import HIGH_PRIORITY, NORMAL_PRIORITY
+
+
+class SamplePool(pool.ThreadPool):
+    def process(self):
+        pass
+
+    def limit_exceeded(self, task):
+        return False
+
+
+class LanedSamplePool(pool.LanedProcessPool):
+    def process(self):
+        pass
+
+    def limit_exceeded(self, task):
+        return False
+
+    def lane_of(self, task):
+        return HIGH_PRIORITY if task.startswith('h') else NORMAL_PRIORITY
+
+
+def test_drain_rate(mocker):
+    time_mock = mocker.patch.object(pool.time, 'time', return_value=1000.0)
+    sample_pool = SamplePool('sample_drain_rate', 1, 100)
+    for i in range(80):
+        sample_pool.submit(i)
+    sample_pool.sample_drain_rate()
+    assert sample_pool.drain_rate() is None
+
+    # workers took 30 items while 10 more were submitted
+    for i in range(30):
+        sample_pool.task_queue.get()
+    for i in range(10):
+        sample_pool.submit(i)
+    time_mock.return_value = 1002.0
+    sample_pool.sample_drain_rate()
+    assert sample_pool.drain_rate() == 15
+    # 60 items queued, 10 above half of the limit
+    assert sample_pool.seconds_to_drain(0.5) == 10 / 15.0
+    assert sample_pool.seconds_to_drain(0.9) == 0
+
+
+def test_seconds_to_drain_lane(mocker):
+    '''Test that time to drain is computed from the lane and its limit, not the whole queue.'''
+    laned_pool = LanedSamplePool('sample_drain_lane', 0, 100, 50, 2)
+    for i in range(60):
+        laned_pool.submit('n{}'.format(i))
+    for i in range(50):
+        laned_pool.submit('h{}'.format(i))
+    mocker.patch.object(laned_pool, 'drain_rate', return_value=5.0)
+    # 60 normal items, 10 above half of normal lane limit, high items don't count
+    assert laned_pool.seconds_to_drain(0.5) == 10 / 5.0
+    assert laned_pool.seconds_to_drain(0.5, HIGH_PRIORITY) == 25 / 5.0
+    assert laned_pool.seconds_to_drain(0.9, NORMAL_PRIORITY) == 0
@@ -0,0 +1,47 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import pytest
+
+from pushkin.protobuf import EventMessage_pb2
+from pushkin.util.proto_stream import ProtoStreamParser, ProtoStreamError
+
+
+def batch(num_events):
+    event_request_proto = EventMessage_pb2.BatchEventRequest()
+    for user_id in range(num_events):
+        event_proto = event_request_proto.events.add()
+        event_proto.user_id = user_id
+        event_proto.event_id = 1
+        event_proto.event_type = 2
+        event_proto.timestamp = 12345 + user_id * 1000000
+        pair = event_proto.pairs.add()
+        pair.key = 'world_id'
+        pair.value = 'x' * user_id * 50
+    return event_request_proto.SerializeToString()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64, 100000])
+def test_items_parsed_across_chunks(chunk_size):
+    body = batch(10)
+    parser = ProtoStreamParser(1, EventMessage_pb2.Event)
+    events = []
+    for i in range(0, len(body), chunk_size):
+        events.extend(parser.feed(body[i:i + chunk_size]))
+    parser.finish()
+    assert events == list(EventMessage_pb2.BatchEventRequest.FromString(body).events)
+    assert parser.bytes_received == len(body)
+
+
+def test_truncated_message():
+    parser = ProtoStreamParser(1, EventMessage_pb2.Event)
+    assert len(parser.feed(batch(2)[:-1])) == 1
+    with pytest.raises(ProtoStreamError):
+        parser.finish()
@@ -0,0 +1,41 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+from pushkin.sender.nordifier import gcm
+from pushkin.sender.nordifier.pyapn2 import errors
+from pushkin.sender.nordifier.retry_policy import APNS_RETRY_POLICY, GCM_RETRY_POLICY, PERMANENT, RETRY, THROTTLE
+from pushkin.sender.nordifier.retry_policy import STATISTICS
+
+
+def test_apns_policy():
+    assert APNS_RETRY_POLICY.classify(errors.ConnectionLost()) == RETRY
+    assert APNS_RETRY_POLICY.classify(errors.ServiceUnavailable()) == RETRY
+    assert APNS_RETRY_POLICY.classify(errors.TooManyRequests()) == THROTTLE
+    assert APNS_RETRY_POLICY.classify(errors.Unregistered()) == PERMANENT
+    assert APNS_RETRY_POLICY.classify(errors.BadDeviceToken()) == PERMANENT
+    assert APNS_RETRY_POLICY.classify(errors.PayloadTooLarge()) == PERMANENT
+
+
+def test_gcm_policy():
+    assert GCM_RETRY_POLICY.classify(gcm.GCMConnectionException()) == RETRY
+    assert GCM_RETRY_POLICY.classify(gcm.GCMUnavailableException()) == RETRY
+    assert GCM_RETRY_POLICY.classify(gcm.GCMAuthenticationException()) == PERMANENT
+    assert GCM_RETRY_POLICY.classify('Unavailable') == RETRY
+    assert GCM_RETRY_POLICY.classify('DeviceMessageRateExceeded') == THROTTLE
+    assert GCM_RETRY_POLICY.classify('NotRegistered') == PERMANENT
+    assert GCM_RETRY_POLICY.classify('SomethingNew') == PERMANENT
+
+
+def test_record():
+    before = STATISTICS.as_dict()
+    assert GCM_RETRY_POLICY.record('InvalidRegistration') == PERMANENT
+    assert APNS_RETRY_POLICY.record(errors.TooManyRequests()) == THROTTLE
+    assert STATISTICS.get('gcm_permanent') - before['gcm_permanent'] == 1
+    assert STATISTICS.get('apns_throttle') - before['apns_throttle'] == 1
@@ -0,0 +1,56 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import time
+
+import mock
+
+from pushkin.sender.nordifier.retry_queue import RetryQueue
+
+
+def notification(time_to_live_seconds=3600):
+    return {'time_to_live_ts_bigint': int(round((time.time() + time_to_live_seconds) * 1000))}
+
+
+def test_retry_delays(mocker):
+    mocker.patch('random.uniform', side_effect=lambda a, b: b)
+    queue = RetryQueue(max_retries=3, initial_delay=1, max_delay=3)
+    first, second = notification(), notification()
+    now = time.time()
+    with mock.patch('time.time', return_value=now):
+        assert queue.schedule(first)
+    with mock.patch('time.time', return_value=now + 0.5):
+        assert queue.schedule(second)
+        assert queue.next_delay() == 0.5
+        assert queue.pop_due() == []
+    with mock.patch('time.time', return_value=now + 1):
+        assert queue.pop_due() == [first]
+        assert not queue.is_scheduled(first)
+        assert queue.is_scheduled(second)
+        # delay doubles with every retry
+        assert queue.schedule(first)
+        assert first['retries'] == 2
+        assert queue.next_delay() == 0.5
+    with mock.patch('time.time', return_value=now + 3):
+        assert queue.pop_due() == [second, first]
+        # up to max_delay
+        assert queue.schedule(first)
+        assert queue.next_delay() == 3
+    with mock.patch('time.time', return_value=now + 6):
+        assert queue.pop_due() == [first]
+        # no retries left
+        assert not queue.schedule(first)
+    assert len(queue) == 0
+
+
+def test_expired_not_scheduled():
+    queue = RetryQueue(max_retries=3, initial_delay=10)
+    assert not queue.schedule(notification(time_to_live_seconds=1))
+    assert len(queue) == 0
@@ -1,3 +1,4 @@
+import json
 import pytest
 from pushkin import pushkin_cli
 import tornado.web
@@ -155,3 +156,13 @@ def test_post_event(setup_database, mock_processor, http_client, post_event_url,
     request = tornado.httpclient.HTTPRequest(post_event_url, method='POST', body=event_batch_json_bad_user_id)
     with pytest.raises(tornado.httpclient.HTTPError):
         yield http_client.fetch(request)
+
+
+@pytest.mark.gen_test
+def test_get_statistics(setup_database, mock_processor, http_client, base_url):
+    '''Test that statistics are returned as JSON'''
+    response = yield http_client.fetch(base_url + config.statistics_handler_url)
+    assert response.code == 200
+    statistics = json.loads(response.body)
+    assert 'checked_out' in statistics['database_pool']
+
@@ -1,6 +1,10 @@
+import json
+import zlib
+
 import pytest
 from pushkin import pushkin_cli
 import tornado.web
+import tornado.gen
 from pushkin.protobuf import EventMessage_pb2
 from pushkin.protobuf import PushNotificationMessage_pb2
 from pushkin import context
@@ -9,6 +13,7 @@ from pushkin.request.request_processor import RequestProcessor
 from pushkin.sender.sender_manager import NotificationSenderManager
 from pushkin.requesthandlers.events import ProtoEventHandler
 from pushkin.requesthandlers.notifications import ProtoNotificationHandler
+from pushkin.requesthandlers.batch import COMPRESSION_STATISTICS
 from pushkin import test_config_ini_path
 from pushkin import config
 
@@ -177,3 +182,166 @@ def test_post_event_service_unavailable(setup_database, mock_processor, http_cli
     RequestProcessor.submit.return_value = False
     with pytest.raises(tornado.httpclient.HTTPError):
         yield http_client.fetch(request)
+
+
+@pytest.mark.gen_test
+def test_post_event_streamed_in_sub_batches(setup_database, mock_processor, http_client, post_event_url, mocker):
+    '''Test that a streamed batch is submitted in sub batches'''
+    mocker.patch.object(config, 'stream_sub_batch_size', 2)
+    context.request_processor.submit.return_value = True
+    event_request_proto = EventMessage_pb2.BatchEventRequest()
+    for user_id in range(5):
+        event_proto = event_request_proto.events.add()
+        event_proto.user_id = user_id
+        event_proto.event_id = 1
+        event_proto.event_type = 2
+        event_proto.timestamp = 12345
+    body = event_request_proto.SerializeToString()
+
+    def body_producer(write):
+        # send body in small chunks, so events are split between them
+        for i in range(0, len(body), 7):
+            write(body[i:i + 7])
+
+    request = tornado.httpclient.HTTPRequest(post_event_url, method='POST', body_producer=body_producer,
+                                             headers={'Content-Length': str(len(body))})
+    response = yield http_client.fetch(request)
+    assert response.code == 200
+    submitted = [[r.user_id for r in call[0][0].events] for call in context.request_processor.submit.call_args_list]
+    assert submitted == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.gen_test
+def test_post_event_stream_error_report(setup_database, mock_processor, http_client, post_event_url, mocker):
+    '''Test that a batch failing after some of its sub batches were submitted reports where to resume'''
+    mocker.patch.object(config, 'stream_sub_batch_size', 2)
+    context.request_processor.submit.return_value = True
+    event_request_proto = EventMessage_pb2.BatchEventRequest()
+    for user_id in range(5):
+        event_proto = event_request_proto.events.add()
+        event_proto.user_id = user_id
+        event_proto.event_id = 1
+        event_proto.event_type = 2
+        event_proto.timestamp = 12345
+    valid = event_request_proto.SerializeToString()
+    body = valid + '\xff' * 11
+
+    @tornado.gen.coroutine
+    def body_producer(write):
+        # malformed data arrives after the first sub batches were submitted
+        yield write(valid)
+        yield tornado.gen.sleep(0.05)
+        yield write(body[len(valid):])
+
+    request = tornado.httpclient.HTTPRequest(post_event_url + '?report=true', method='POST',
+                                             body_producer=body_producer, headers={'Content-Length': str(len(body))})
+    with pytest.raises(tornado.httpclient.HTTPError) as e:
+        yield http_client.fetch(request)
+    assert e.value.code == 400
+    assert json.loads(e.value.response.body) == {'accepted': 4, 'rejected': [], 'unprocessed_from': 4}
+    assert context.request_processor.submit.call_count == 2
+
+
+@pytest.mark.gen_test
+def test_post_event_gzip(setup_database, mock_processor, http_client, post_event_url, event_batch_proto):
+    '''Test that a gzip compressed batch is decompressed'''
+    context.request_processor.submit.return_value = True
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    body = compressor.compress(event_batch_proto) + compressor.flush()
+    request = tornado.httpclient.HTTPRequest(post_event_url, method='POST', body=body,
+                                             headers={'Content-Encoding': 'gzip'})
+    response = yield http_client.fetch(request)
+    assert response.code == 200
+    assert [r.user_id for r in context.request_processor.submit.call_args[0][0].events] == [123]
+    assert COMPRESSION_STATISTICS.get('proto_events_decompressed_bytes') >= len(event_batch_proto)
+
+
+@pytest.mark.gen_test
+@pytest.mark.parametrize("encoding, code", [
+    ('gzip', 413),
+    ('br', 415),
+])
+def test_post_event_encoding_rejected(setup_database, mock_processor, http_client, post_event_url, mocker, encoding,
+                                  code):
+    '''Test that unsupported encodings and bodies too large after decompression are rejected'''
+    mocker.patch.object(config, 'max_decoded_body_size', 1000)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    body = compressor.compress('\0' * 100000) + compressor.flush()
+    request = tornado.httpclient.HTTPRequest(post_event_url, method='POST', body=body,
+                                             headers={'Content-Encoding': encoding})
+    with pytest.raises(tornado.httpclient.HTTPError) as e:
+        yield http_client.fetch(request)
+    assert e.value.code == code
+    assert not context.request_processor.submit.called
+
+
+@pytest.mark.gen_test
+def test_post_notification_report(setup_database, mock_processor, http_client, post_notification_url):
+    '''Test that invalid requests are reported when report is asked for'''
+    context.request_processor.submit.return_value = True
+    notification_request_proto = PushNotificationMessage_pb2.BatchNotificationRequest()
+    for login_id in range(3):
+        notification_proto = notification_request_proto.notifications.add()
+        notification_proto.login_id = login_id
+        notification_proto.content = "Text of a message."
+        if login_id != 1:
+            notification_proto.title = "Msg title"
+    request = tornado.httpclient.HTTPRequest(post_notification_url + '?report=true', method='POST',
+                                             body=notification_request_proto.SerializeToString())
+    response = yield http_client.fetch(request)
+    assert response.code == 200
+    assert json.loads(response.body) == {'accepted': 2, 'rejected': [{'index': 1, 'reason': 'missing title'}]}
+
+
+@pytest.mark.gen_test
+def test_post_event_retry_after(setup_database, mock_processor, http_client, post_event_url, event_batch_proto,
+                                mocker):
+    '''Test that 503 carries time until queues are drained at measured rate'''
+    context.request_processor.submit.return_value = False
+    pools = [context.request_processor] + context.request_processor.sender_manager.sender_by_name.values()
+    for pool in pools:
+        mocker.patch.object(pool, 'seconds_to_drain', return_value=0)
+    pools[0].seconds_to_drain.return_value = 12.2
+    request = tornado.httpclient.HTTPRequest(post_event_url + '?report=1', method='POST', body=event_batch_proto)
+    with pytest.raises(tornado.httpclient.HTTPError) as e:
+        yield http_client.fetch(request)
+    assert e.value.code == 503
+    assert e.value.response.headers['Retry-After'] == '13'
+    assert json.loads(e.value.response.body) == {'accepted': 0, 'rejected': [], 'unprocessed_from': 0}
+    pools[0].seconds_to_drain.assert_called_with(config.retry_after_drain_target, 'normal')
+
+    # queue which is not draining
+    pools[-1].seconds_to_drain.return_value = None
+    with pytest.raises(tornado.httpclient.HTTPError) as e:
+        yield http_client.fetch(request)
+    assert e.value.response.headers['Retry-After'] == str(config.max_retry_after)
+
+
+@pytest.mark.gen_test
+def test_post_event_not_admitted(setup_database, mock_processor, http_client, post_event_url, event_batch_proto,
+                                 mocker):
+    '''Test that requests are rejected before they are read when queues are close to their limits'''
+    mocker.patch.object(context.admission_controller, 'admit', return_value=False)
+    request = tornado.httpclient.HTTPRequest(post_event_url, method='POST', body=event_batch_proto)
+    with pytest.raises(tornado.httpclient.HTTPError) as e:
+        yield http_client.fetch(request)
+    assert e.value.code == 503
+    assert 'Retry-After' in e.value.response.headers
+    assert not context.request_processor.submit.called
+
+
+@pytest.mark.gen_test
+def test_post_event_high_priority(setup_database, mock_processor, http_client, post_event_url, event_batch_proto,
+                                  mocker):
+    '''Test that batches posted with high priority are admitted and processed in high priority lane'''
+    mocker.spy(context.admission_controller, 'admit')
+    request = tornado.httpclient.HTTPRequest(post_event_url + '?priority=high', method='POST', body=event_batch_proto)
+    response = yield http_client.fetch(request)
+    assert response.code == 200
+    context.admission_controller.admit.assert_called_once_with('high')
+    assert context.request_processor.submit.call_args[0][0].priority == 'high'
+
+    request = tornado.httpclient.HTTPRequest(post_event_url + '?priority=urgent', method='POST', body=event_batch_proto)
+    with pytest.raises(tornado.httpclient.HTTPError) as e:
+        yield http_client.fetch(request)
+    assert e.value.code == 400
@@ -0,0 +1,147 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import os
+import time
+from threading import Thread
+
+import mock
+
+from pushkin import context
+from pushkin import test_config_ini_path
+from pushkin.sender.senders import GcmNotificationSender
+from pushkin.sender.spool import Spool, SPOOL_HEADER
+from pushkin.util.statistics import SharedStatistics
+
+context.setup_configuration(test_config_ini_path)
+
+
+def notification(login_id):
+    return {'login_id': login_id, 'content': u'Content \u0161', 'platform': 1}
+
+
+def test_fifo_survives_reopen(tmpdir):
+    path = str(tmpdir.join('spool'))
+    spool = Spool(path, 4096)
+    for login_id in range(3):
+        assert spool.append(notification(login_id))
+    assert spool.pop() == notification(0)
+    spool.close()
+
+    spool = Spool(path, 4096)
+    assert len(spool) == 2
+    assert spool.pop() == notification(1)
+    assert spool.pop() == notification(2)
+    assert spool.pop() is None
+    assert len(spool) == 0
+
+
+def test_full_spool_reclaims_popped_space(tmpdir):
+    statistics = mock.Mock()
+    spool = Spool(str(tmpdir.join('spool')), 1024, statistics=statistics)
+    count = 0
+    while spool.append(notification(count)):
+        count += 1
+    assert count > 1
+    statistics.increment.assert_any_call('dropped', 1)
+
+    # space of popped notifications is reused, order is kept
+    assert spool.pop() == notification(0)
+    assert spool.append(notification(count))
+    assert spool._read_header()[0] == SPOOL_HEADER.size
+    assert [spool.pop()['login_id'] for i in range(len(spool))] == range(1, count + 1)
+    assert sum(args[1] for args, kwargs in statistics.increment.call_args_list if args[0] == 'bytes') == 0
+
+
+def test_shared_by_forked_processes(tmpdir):
+    spool = Spool(str(tmpdir.join('spool')), 4096)
+    pids = []
+    for child in range(2):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for i in range(3):
+                    spool.append(notification(child * 10 + i))
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    # notifications appended by workers are drained by parent
+    assert len(spool) == 6
+    login_ids = [spool.pop()['login_id'] for i in range(6)]
+    assert sorted(login_ids) == [0, 1, 2, 10, 11, 12]
+    assert spool.pop() is None
+
+
+def test_depth_shared_by_forked_processes(tmpdir):
+    '''Test that depth and bytes add up when notifications are spooled and drained by different processes.'''
+    statistics = SharedStatistics('spool_test', Spool.STATISTICS_NAMES)
+    spool = Spool(str(tmpdir.join('spool')), 4096, statistics=statistics)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for login_id in range(5):
+                spool.append(notification(login_id))
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert statistics.get('depth') == 5
+    assert statistics.get('bytes') > 0
+    for i in range(5):
+        assert spool.pop() is not None
+    assert len(spool) == 0
+    assert statistics.get('depth') == 0
+    assert statistics.get('bytes') == 0
+
+
+def test_peek_and_commit(tmpdir):
+    spool = Spool(str(tmpdir.join('spool')), 4096)
+    assert spool.peek() is None
+    spool.append(notification(0))
+    spool.append(notification(1))
+    # peeked notification stays spooled, also for other processes and after reopen
+    assert spool.peek() == notification(0)
+    assert spool.peek() == notification(0)
+    assert len(spool) == 2
+    spool.commit()
+    assert len(spool) == 1
+    assert spool.peek() == notification(1)
+    spool.commit()
+    assert spool.peek() is None
+    assert spool._read_header()[:2] == (SPOOL_HEADER.size, SPOOL_HEADER.size)
+
+
+def test_drained_only_once_queued(mocker, tmpdir):
+    '''Test that a notification stays spooled while sender queue is full.'''
+    mocker.patch('pushkin.context.main_logger')
+    mocker.patch('pushkin.config.sender_queue_limit', 1)
+    mocker.patch('pushkin.config.sender_spool', True)
+    mocker.patch('pushkin.config.sender_spool_path', str(tmpdir.join('spool')))
+    sender = GcmNotificationSender(workers=0)
+    assert sender.submit(notification(0))
+    # queue is full, notification goes to spool
+    assert sender.submit(notification(1))
+    assert len(sender.spool) == 1
+    drainer = Thread(target=sender.drain_spool)
+    drainer.daemon = True
+    drainer.start()
+    time.sleep(0.3)
+    assert len(sender.spool) == 1
+    assert sender.task_queue.get(timeout=1) == notification(0)
+    assert sender.task_queue.get(timeout=1) == notification(1)
+    deadline = time.time() + 1
+    while len(sender.spool) > 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(sender.spool) == 0
+    # stop drainer
+    mocker.patch.object(sender.spool, 'peek', side_effect=SystemExit)
+    drainer.join(1)
+    assert not drainer.is_alive()
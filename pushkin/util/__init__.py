@@ -1,3 +1,5 @@
 from . import pool
 from . import multiprocesslogging
 from . import tools
+from . import statistics
+from . import cache
@@ -0,0 +1,133 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""Incremental decoding of compressed request bodies."""
+
+SUPPORTED_ENCODINGS = ('identity', 'gzip', 'zstd')
+
+# a zstd block decompresses to at most ZSTD_BLOCK_MAX_SIZE bytes and takes at least ZSTD_BLOCK_MIN_INPUT bytes
+ZSTD_BLOCK_MAX_SIZE = 128 * 1024
+ZSTD_BLOCK_MIN_INPUT = 4
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class TruncatedBody(Exception):
+    pass
+
+
+class BodyDecoder():
+    """
+    Decodes a body with given Content-Encoding chunk by chunk, and fails as soon as decoded body would be larger than
+    max_size, so a small compressed body can't exhaust memory.
+
+    gzip output is capped exactly. zstd input is fed in steps which can't decompress to more than the remaining size
+    and two blocks, as zstandard has no cap on output of a single call.
+    """
+
+    def __init__(self, encoding, max_size):
+        encoding = (encoding or 'identity').strip().lower()
+        if encoding == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise UnsupportedEncoding("zstd encoding needs zstandard package")
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        elif encoding == 'identity':
+            self._decompressor = None
+        else:
+            raise UnsupportedEncoding("Unsupported encoding {}".format(encoding))
+        self.encoding = encoding
+        self.max_size = max_size
+        self.encoded_size = 0
+        self.decoded_size = 0
+
+    def decode(self, chunk):
+        """
+        Returns decoded part of body.
+
+        :raises BodyTooLarge: if decoded body exceeds max size
+        :raises zlib.error, zstandard.ZstdError: if body is not valid
+        """
+        self.encoded_size += len(chunk)
+        if self._decompressor is None:
+            data = chunk
+        elif self.encoding == 'gzip':
+            # never decompress more than the limit allows
+            data = self._decompressor.decompress(chunk, self.max_size - self.decoded_size + 1)
+            if self._decompressor.unconsumed_tail:
+                raise BodyTooLarge()
+        else:
+            data = self._decode_zstd(chunk)
+        self.decoded_size += len(data)
+        if self.decoded_size > self.max_size:
+            raise BodyTooLarge()
+        return data
+
+    def _decode_zstd(self, chunk):
+        parts = []
+        decoded_size = self.decoded_size
+        position = 0
+        while position < len(chunk):
+            # input which can't complete more blocks than fit in the limit, besides one started by earlier input
+            step = max(ZSTD_BLOCK_MIN_INPUT,
+                       ((self.max_size - decoded_size) // ZSTD_BLOCK_MAX_SIZE - 1) * ZSTD_BLOCK_MIN_INPUT)
+            data = self._decompressor.decompress(chunk[position:position + step])
+            position += step
+            decoded_size += len(data)
+            if decoded_size > self.max_size:
+                raise BodyTooLarge()
+            parts.append(data)
+        return ''.join(parts)
+
+    def finish(self):
+        """
+        Called after the last chunk.
+
+        :raises TruncatedBody: if compressed stream didn't end, or there is data after its end
+        """
+        if self._decompressor is None:
+            return
+        if getattr(self._decompressor, 'unused_data', ''):
+            raise TruncatedBody("Data after end of {} stream".format(self.encoding))
+        if not self._ended():
+            raise TruncatedBody("{} stream is truncated".format(self.encoding))
+
+    def _ended(self):
+        eof = getattr(self._decompressor, 'eof', None)
+        if eof is not None:
+            return eof
+        if self.encoding == 'gzip':
+            # input after end of stream is left unused
+            probe = self._decompressor.copy()
+            try:
+                probe.decompress('\0')
+            except zlib.error:
+                return False
+            return probe.unused_data != ''
+        # zstandard before 0.15 refuses any input once its frame is complete
+        try:
+            self._decompressor.decompress('')
+        except zstandard.ZstdError:
+            return True
+        return False
@@ -0,0 +1,58 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import time
+from collections import OrderedDict
+
+"""Process local caches."""
+
+MISSING = object()
+
+
+class TTLCache():
+    """
+    A bounded cache whose entries expire after ttl_seconds.
+
+    When the cache is full, the least recently used entry is evicted. A cache with max_size 0 stores nothing.
+    Not shared between processes, each worker process has its own copy.
+    """
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        """Returns cached value, or default if key is not cached or has expired."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.time():
+            return default
+        self._entries[key] = entry
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._entries.pop(key, None)
+        while len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+        self._entries[key] = (time.time() + self.ttl_seconds, value)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
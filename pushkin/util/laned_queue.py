@@ -0,0 +1,105 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+from multiprocessing import Queue as ProcessQueue, Semaphore
+from Queue import Empty, Full
+import time
+
+"""Multiprocessing queue split in a high and a normal priority lane."""
+
+HIGH_PRIORITY = 'high'
+NORMAL_PRIORITY = 'normal'
+LANES = (HIGH_PRIORITY, NORMAL_PRIORITY)
+
+# seconds to wait for an item which was put, but is still on its way to its lane, doubled while it doesn't arrive
+ARRIVAL_TIMEOUT = 0.001
+MAX_ARRIVAL_TIMEOUT = 0.1
+
+
+class LanedQueue():
+    """
+    Queue shared by processes, with a high and a normal priority lane, each with its own size limit.
+
+    Items go to lane returned by lane_of(item). While both lanes have items, a consumer takes up to high_weight items
+    from high lane for each item from normal lane, so high priority items overtake normal ones without starving them.
+    A semaphore counts items in both lanes, so consumers block on it instead of polling lanes. Supports the part of
+    multiprocessing.Queue interface used by pools.
+    """
+
+    STATISTICS_NAMES = ['high_submitted', 'high_rejected', 'high_taken',
+                        'normal_submitted', 'normal_rejected', 'normal_taken']
+
+    def __init__(self, limits, high_weight, lane_of, statistics=None):
+        self.limits = limits
+        self.high_weight = high_weight
+        self.lane_of = lane_of
+        self.statistics = statistics
+        self._lanes = dict((lane, ProcessQueue(limits[lane])) for lane in LANES)
+        self._items = Semaphore(0)
+        # high priority items taken in a row, each consumer process has its own after fork
+        self._high_taken = 0
+
+    def _increment(self, name):
+        if self.statistics is not None:
+            self.statistics.increment(name)
+
+    def put(self, item, block=True, timeout=None):
+        """Puts item in its lane, raises Full if the lane is full."""
+        lane = self.lane_of(item)
+        try:
+            self._lanes[lane].put(item, block, timeout)
+        except Full:
+            self._increment(lane + '_rejected')
+            raise
+        self._items.release()
+        self._increment(lane + '_submitted')
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def get(self, block=True, timeout=None):
+        """Takes an item, preferring high lane unless high_weight high items were taken in a row. Raises Empty."""
+        if not self._items.acquire(block, timeout):
+            raise Empty
+        if self._high_taken >= self.high_weight:
+            order = (NORMAL_PRIORITY, HIGH_PRIORITY)
+        else:
+            order = (HIGH_PRIORITY, NORMAL_PRIORITY)
+        arrival_timeout = ARRIVAL_TIMEOUT
+        while True:
+            for lane in order:
+                queue = self._lanes[lane]
+                if queue.qsize() == 0:
+                    continue
+                try:
+                    # item put by another process may not have reached the lane yet
+                    item = queue.get(timeout=arrival_timeout)
+                except Empty:
+                    continue
+                if lane == HIGH_PRIORITY:
+                    self._high_taken += 1
+                else:
+                    self._high_taken = 0
+                self._increment(lane + '_taken')
+                return item
+            # semaphore was released, but item is not counted in its lane yet, wait instead of polling lanes
+            time.sleep(arrival_timeout)
+            arrival_timeout = min(2 * arrival_timeout, MAX_ARRIVAL_TIMEOUT)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def lane_size(self, lane):
+        """Current items number in lane. Estimated value."""
+        return self._lanes[lane].qsize()
+
+    def qsize(self):
+        """Current items number in both lanes. Estimated value."""
+        return sum(queue.qsize() for queue in self._lanes.values())
@@ -12,15 +12,27 @@ from threading import Thread
 from Queue import Queue as ThreadQueue
 from multiprocessing import Process, Queue as ProcessQueue
 from Queue import Full
+from collections import deque
+import time
+
+from pushkin.util.laned_queue import LanedQueue, HIGH_PRIORITY, NORMAL_PRIORITY
+from pushkin.util.statistics import SharedStatistics
 
 
 
 class AbstractPool():
     """Abstraction of worker pool. Holds common code for concrete pools."""
 
+    # seconds over which drain rate of queue is measured
+    DRAIN_RATE_WINDOW = 10
+
     def __init__(self, name, num_workers, queue_limit):
         self.num_workers = num_workers
         self.name = name
+        self.queue_limit = queue_limit
+        # counted in any process submitting to this pool
+        self.statistics = SharedStatistics('pool_' + name, ['submitted', 'rejected'])
+        self._drain_samples = deque()
         self.worker_list = [self.create_worker('{name}-{id}'.format(name=self.name, id=str(i))) for i in
                             range(num_workers)]
         self.task_queue = self.create_queue(queue_limit)
@@ -38,7 +50,7 @@ class AbstractPool():
         raise Exception("Not implemented!")
 
     def limit_exceeded(self, task):
-        """Called when queue limit is exceeded."""
+        """Called when queue limit is exceeded. Returns True if task was accepted anyway, e.g. stored elsewhere."""
         raise Exception("Not implemetned!")
 
     def start(self):
@@ -51,19 +63,59 @@ class AbstractPool():
         """
         Used to submit a task to this pool.
 
-        Returns false is queue size is exceeded.
+        Returns false is queue size is exceeded and task was not accepted by limit_exceeded.
         """
         try:
             self.task_queue.put_nowait(task)
+            self.statistics.increment('submitted')
             return True
         except Full:
-            self.limit_exceeded(task)
-            return False
+            self.statistics.increment('rejected')
+            return bool(self.limit_exceeded(task))
 
     def queue_size(self):
         """Current items number in job queue. Estimated value."""
         return self.task_queue.qsize()
 
+    def lane_size(self, lane):
+        """Current items number in priority lane of job queue, whole queue if it has no lanes. Estimated value."""
+        return self.queue_size()
+
+    def lane_limit(self, lane):
+        """Limit of priority lane of job queue, whole queue if it has no lanes."""
+        return self.queue_limit
+
+    def sample_drain_rate(self):
+        """Records queue state for drain_rate, at most once a second. Should be called regularly by one process."""
+        now = time.time()
+        if self._drain_samples and now - self._drain_samples[-1][0] < 1:
+            return
+        self._drain_samples.append((now, self.statistics.get('submitted'), self.queue_size()))
+        while len(self._drain_samples) > 2 and now - self._drain_samples[1][0] >= self.DRAIN_RATE_WINDOW:
+            self._drain_samples.popleft()
+
+    def drain_rate(self):
+        """Items taken from queue by workers per second, over last DRAIN_RATE_WINDOW seconds. None if not measured."""
+        if len(self._drain_samples) < 2:
+            return None
+        start_time, start_submitted, start_size = self._drain_samples[0]
+        end_time, end_submitted, end_size = self._drain_samples[-1]
+        taken = (end_submitted - start_submitted) - (end_size - start_size)
+        return max(0, taken) / (end_time - start_time)
+
+    def seconds_to_drain(self, fill, lane=NORMAL_PRIORITY):
+        """
+        Seconds until priority lane of queue is drained to fill (fraction of its limit) at current drain rate of queue,
+        None if queue is not draining.
+        """
+        excess = self.lane_size(lane) - fill * self.lane_limit(lane)
+        if excess <= 0:
+            return 0
+        rate = self.drain_rate()
+        if not rate:
+            return None
+        return excess / rate
+
 
 class ThreadPool(AbstractPool):
     """A pool of threads."""
@@ -79,7 +131,7 @@ class ThreadPool(AbstractPool):
 
 
 class ProcessPool(AbstractPool):
-    """A pool of threads."""
+    """A pool of processes."""
 
     def __init__(self, name, num_workers, queue_limit):
         AbstractPool.__init__(self, name, num_workers, queue_limit)
@@ -88,4 +140,36 @@ class ProcessPool(AbstractPool):
         return ProcessQueue(queue_limit)
 
     def create_worker(self, name):
-        return Process(target=self.process, name=name)
+        return Process(target=self.run_worker, name=name)
+
+    def init_worker(self):
+        """Called once in each worker process after fork, before process()."""
+        pass
+
+    def run_worker(self):
+        self.init_worker()
+        self.process()
+
+
+class LanedProcessPool(ProcessPool):
+    """A pool of processes taking tasks from a high and a normal priority lane, each with its own limit."""
+
+    def __init__(self, name, num_workers, queue_limit, high_priority_queue_limit, high_priority_weight):
+        self.high_priority_queue_limit = high_priority_queue_limit
+        self.high_priority_weight = high_priority_weight
+        ProcessPool.__init__(self, name, num_workers, queue_limit)
+
+    def create_queue(self, queue_limit):
+        return LanedQueue({HIGH_PRIORITY: self.high_priority_queue_limit, NORMAL_PRIORITY: queue_limit},
+                          self.high_priority_weight, self.lane_of,
+                          statistics=SharedStatistics('lanes_' + self.name, LanedQueue.STATISTICS_NAMES))
+
+    def lane_of(self, task):
+        """Returns priority lane of task, HIGH_PRIORITY or NORMAL_PRIORITY."""
+        raise Exception("Not implemented!")
+
+    def lane_size(self, lane):
+        return self.task_queue.lane_size(lane)
+
+    def lane_limit(self, lane):
+        return self.task_queue.limits[lane]
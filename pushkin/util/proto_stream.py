@@ -0,0 +1,99 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+"""Incremental parsing of repeated message fields of a protobuf message, as its serialized bytes arrive."""
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+
+class ProtoStreamError(Exception):
+    pass
+
+
+def decode_varint(buffer, position):
+    """Returns (value, position after it), None if buffer ends before varint does."""
+    value = 0
+    shift = 0
+    while position < len(buffer):
+        byte = ord(buffer[position])
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+        if shift > 63:
+            raise ProtoStreamError("Varint is too long")
+    return None
+
+
+class ProtoStreamParser():
+    """
+    Parses items of a repeated message field (e.g. events of BatchEventRequest) from chunks of a serialized message.
+
+    Top level fields are length delimited on the wire, so each item is parsed as soon as all of its bytes arrived and
+    only bytes of an incomplete item are kept. Other top level fields are skipped.
+    """
+
+    def __init__(self, field_number, message_class):
+        self.field_number = field_number
+        self.message_class = message_class
+        self.bytes_received = 0
+        self._buffer = ''
+
+    def feed(self, chunk):
+        """Returns items completed by chunk."""
+        self.bytes_received += len(chunk)
+        buffer = self._buffer + chunk if self._buffer else chunk
+        position = 0
+        items = []
+        while position < len(buffer):
+            key = decode_varint(buffer, position)
+            if key is None:
+                break
+            key, value_position = key
+            field_number, wire_type = key >> 3, key & 0x7
+            if wire_type == WIRETYPE_LENGTH_DELIMITED:
+                length = decode_varint(buffer, value_position)
+                if length is None:
+                    break
+                length, value_position = length
+                end = value_position + length
+            elif wire_type == WIRETYPE_VARINT:
+                value = decode_varint(buffer, value_position)
+                if value is None:
+                    break
+                end = value[1]
+            elif wire_type == WIRETYPE_FIXED64:
+                end = value_position + 8
+            elif wire_type == WIRETYPE_FIXED32:
+                end = value_position + 4
+            else:
+                raise ProtoStreamError("Unsupported wire type {}".format(wire_type))
+            if end > len(buffer):
+                break
+            if field_number == self.field_number and wire_type == WIRETYPE_LENGTH_DELIMITED:
+                item = self.message_class()
+                try:
+                    item.ParseFromString(buffer[value_position:end])
+                except Exception as e:
+                    raise ProtoStreamError("Item could not be parsed: {}".format(e))
+                items.append(item)
+            position = end
+        self._buffer = buffer[position:]
+        return items
+
+    def finish(self):
+        """Checks that the message ended with a complete field."""
+        if self._buffer:
+            raise ProtoStreamError("Message ended in the middle of a field")
@@ -0,0 +1,73 @@
+'''
+The MIT License (MIT)
+Copyright (c) 2016 Nordeus LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+import multiprocessing
+import os
+from collections import OrderedDict
+
+"""Statistics shared between the server process and its forked worker processes."""
+
+_registry = OrderedDict()
+
+
+class SharedStatistics():
+    """
+    A group of named numeric values kept in shared memory.
+
+    Must be created before worker processes are forked, values updated in any worker are then visible to the server
+    process (e.g. to monitoring handlers). Counters are summed over all processes. Gauges are per process values,
+    reported value is the sum of the last value set by each process. Maximums are the highest value seen by any process.
+    """
+
+    def __init__(self, group, names):
+        self.group = group
+        self.names = list(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._values = multiprocessing.Array('d', len(self.names))
+        self._gauges = {}
+        self._gauges_pid = None
+        _registry[group] = self
+
+    def increment(self, name, value=1):
+        """Add value to a counter."""
+        with self._values.get_lock():
+            self._values[self._index[name]] += value
+
+    def update_max(self, name, value):
+        """Raise a maximum over all processes to value, if it is higher."""
+        with self._values.get_lock():
+            index = self._index[name]
+            if value > self._values[index]:
+                self._values[index] = value
+
+    def set_gauge(self, name, value):
+        """Set value of a gauge for the current process."""
+        pid = os.getpid()
+        if self._gauges_pid != pid:
+            # values inherited from parent process are not ours to report
+            self._gauges = {}
+            self._gauges_pid = pid
+        delta = value - self._gauges.get(name, 0)
+        self._gauges[name] = value
+        if delta:
+            self.increment(name, delta)
+
+    def get(self, name):
+        return self._values[self._index[name]]
+
+    def as_dict(self):
+        with self._values.get_lock():
+            values = self._values[:]
+        return OrderedDict(zip(self.names, values))
+
+
+def get_all_statistics():
+    """Returns values of all registered statistics in format {group: {name: value}}."""
+    return OrderedDict((group, statistics.as_dict()) for group, statistics in _registry.items())
@@ -54,6 +54,9 @@ setup(
         'alembic>=0.8.6',
         'hyper==0.7.0',
         ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     package_data = {
         '': ['*.sql', '*.sh', '*.ini', '*.mako']
     },